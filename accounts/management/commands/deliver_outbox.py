@@ -0,0 +1,45 @@
+import time
+
+from django.core.mail import get_connection
+from django.core.management.base import BaseCommand
+
+from accounts.outbox import claim_emails, deliver_emails, requeue_stale_emails, worker_name
+
+
+class Command(BaseCommand):
+    help = "Deliver queued outbox emails in batches over a reused mail connection."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=50, help="Emails claimed and sent per connection.")
+        parser.add_argument('--poll-interval', type=float, default=2.0, help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--max-attempts', type=int, default=5, help="Attempts before an email is marked failed.")
+        parser.add_argument('--backoff', type=float, default=30, help="Retry delay in seconds after the first failure; doubles on each attempt.")
+        parser.add_argument('--stale-after', type=int, default=600, help="Requeue emails claimed longer ago than this many seconds.")
+        parser.add_argument('--backend', help="Email backend to send with instead of EMAIL_BACKEND.")
+        parser.add_argument('--once', action='store_true', help="Drain the outbox once and exit instead of polling.")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(f"Outbox worker {worker} started")
+        try:
+            while True:
+                requeued = requeue_stale_emails(options['stale_after'])
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} stale email(s)")
+
+                emails = claim_emails(worker, options['batch_size'])
+                if emails:
+                    connection = get_connection(options['backend'])
+                    sent, failed = deliver_emails(
+                        emails, connection, max_attempts=options['max_attempts'], backoff=options['backoff'],
+                    )
+                    retrying = len(emails) - sent - failed
+                    self.stdout.write(f"Processed {len(emails)} email(s): {sent} sent, {retrying} retrying, {failed} failed")
+                    continue
+
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Outbox worker {worker} stopped")
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from accounts.otp import purge_expired
+
+
+class Command(BaseCommand):
+    help = "Delete expired one-time password rows in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        deleted = purge_expired(options['chunk_size'])
+        self.stdout.write(f"Deleted {deleted} expired OTP(s)")
@@ -0,0 +1,33 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:39
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def backfill_open_requests(apps, schema_editor):
+    DoctorProfile = apps.get_model('accounts', 'DoctorProfile')
+    RecommendationRequest = apps.get_model('api', 'RecommendationRequest')
+    db_alias = schema_editor.connection.alias
+    counts = (
+        RecommendationRequest.objects.using(db_alias).filter(is_reviewed=False)
+        .values('doctor_id').annotate(open=Count('pk')).order_by()
+    )
+    for row in counts:
+        DoctorProfile.objects.using(db_alias).filter(pk=row['doctor_id']).update(open_requests=row['open'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0002_outbox_email'),
+        ('api', '0006_pending_file_deletion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='doctorprofile',
+            name='open_requests',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.RunPython(backfill_open_requests, migrations.RunPython.noop),
+    ]
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import User
 import random
@@ -9,6 +10,9 @@ class DoctorProfile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     license_number = models.CharField(max_length=100, blank=True, null=True)
     phone_number = models.CharField(max_length=15, blank=True, null=True)
+    # Unreviewed RecommendationRequests assigned to this doctor, kept in step
+    # by api.assignment so picking the least loaded doctor is one indexed lookup.
+    open_requests = models.PositiveIntegerField(default=0, db_index=True)
 
     def __str__(self):
         return f"Dr. {self.user.username}"
@@ -27,9 +31,37 @@ class OTP(models.Model):
     otp_code = models.CharField(max_length=6)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'otp_code', 'created_at']),
+            models.Index(fields=['created_at']),
+        ]
+
     def generate_otp(self):
         self.otp_code = ''.join(random.choices(string.digits, k=6))
         self.save()
 
     def is_valid(self):
-        return timezone.now() - self.created_at <= timedelta(minutes=10)
\ No newline at end of file
+        return timezone.now() - self.created_at <= timedelta(seconds=settings.OTP_TTL_SECONDS)
+
+class OutboxEmail(models.Model):
+    """An email queued by a request and delivered by ``manage.py deliver_outbox``."""
+    STATUS_CHOICES = [('pending', 'Pending'), ('sending', 'Sending'), ('sent', 'Sent'), ('failed', 'Failed')]
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    from_email = models.CharField(max_length=255, blank=True, default='')
+    recipients = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+    def __str__(self):
+        return f"{self.subject} -> {', '.join(self.recipients)} ({self.status})"
@@ -0,0 +1,68 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import transaction
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare
+
+from .models import OTP
+
+
+def _cache_key(user_id):
+    return f"otp:{user_id}"
+
+
+def _cache_is_shared():
+    # A per-process cache would keep accepting a replaced code in every
+    # process except the one that issued the new one.
+    return not isinstance(caches['default'], LocMemCache)
+
+
+def issue_otp(user):
+    """Create a fresh code for ``user``, invalidating any earlier ones.
+
+    With a cache shared by all processes (``CACHE_BACKEND=file`` or a
+    network cache) the code is kept there for ``OTP_TTL_SECONDS`` so
+    verification normally never touches the database; the row is the
+    fallback for cache misses. With the per-process default the row is the
+    only source of truth.
+    """
+    with transaction.atomic():
+        OTP.objects.filter(user=user).delete()
+        otp = OTP(user=user)
+        otp.generate_otp()
+        if _cache_is_shared():
+            transaction.on_commit(lambda: cache.set(_cache_key(user.pk), otp.otp_code, settings.OTP_TTL_SECONDS))
+    return otp
+
+
+def check_otp(user, code):
+    """``'valid'``, ``'expired'`` or ``'invalid'`` for ``code``."""
+    if _cache_is_shared():
+        cached = cache.get(_cache_key(user.pk))
+        if cached is not None and constant_time_compare(cached, code):
+            return 'valid'
+    # One lookup on the (user, otp_code, created_at) index.
+    created_at = (
+        OTP.objects.filter(user=user, otp_code=code)
+        .order_by('-created_at').values_list('created_at', flat=True).first()
+    )
+    if created_at is None:
+        return 'invalid'
+    if timezone.now() - created_at > timedelta(seconds=settings.OTP_TTL_SECONDS):
+        return 'expired'
+    return 'valid'
+
+
+def purge_expired(chunk_size=1000):
+    """Delete expired OTP rows ``chunk_size`` at a time; returns how many went."""
+    cutoff = timezone.now() - timedelta(seconds=settings.OTP_TTL_SECONDS)
+    deleted = 0
+    while True:
+        ids = list(OTP.objects.filter(created_at__lt=cutoff).values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return deleted
+        count, _ = OTP.objects.filter(pk__in=ids).delete()
+        deleted += count
@@ -0,0 +1,116 @@
+import os
+import socket
+import uuid
+from datetime import timedelta
+
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OutboxEmail
+
+MAX_BACKOFF_SECONDS = 3600
+
+
+def queue_mail(subject, message, from_email, recipient_list):
+    """Drop-in for ``send_mail`` that stores the email instead of sending it.
+
+    The row is written in the caller's transaction, so the email goes out if
+    and only if the change that triggered it commits.
+    """
+    return OutboxEmail.objects.create(
+        subject=subject, body=message, from_email=from_email or '', recipients=list(recipient_list),
+    )
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_emails(worker, limit):
+    """Atomically claim up to ``limit`` emails that are due for (re)delivery."""
+    with transaction.atomic():
+        ids = list(
+            OutboxEmail.objects.select_for_update(skip_locked=True)
+            .filter(status='pending', next_attempt_at__lte=timezone.now())
+            .order_by('next_attempt_at')
+            .values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        OutboxEmail.objects.filter(pk__in=ids, status='pending').update(
+            status='sending', worker=worker, claimed_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        return list(OutboxEmail.objects.filter(pk__in=ids, status='sending', worker=worker))
+
+
+def requeue_stale_emails(older_than):
+    """Return emails stuck in ``sending`` (e.g. after a worker crash) to the queue."""
+    cutoff = timezone.now() - timedelta(seconds=older_than)
+    return OutboxEmail.objects.filter(status='sending', claimed_at__lt=cutoff).update(status='pending', worker='')
+
+
+def backoff_delay(attempts, base):
+    return timedelta(seconds=min(base * 2 ** (attempts - 1), MAX_BACKOFF_SECONDS))
+
+
+def _close_quietly(connection):
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def _record_failure(email, error, max_attempts, backoff):
+    """Schedule a retry for ``email`` or give up on it; returns True if it failed for good."""
+    email.error = str(error)
+    if email.attempts < max_attempts:
+        email.status = 'pending'
+        email.next_attempt_at = timezone.now() + backoff_delay(email.attempts, backoff)
+    else:
+        email.status = 'failed'
+    email.save(update_fields=['status', 'next_attempt_at', 'error'])
+    return email.status == 'failed'
+
+
+def deliver_emails(emails, connection=None, max_attempts=5, backoff=30):
+    """Send claimed ``emails`` over a single connection and record the outcome.
+
+    Messages are handed to ``send_messages`` one at a time so a failure is
+    attributed to exactly one row and never causes the rest of the batch to
+    be sent twice. Failed emails are retried with exponential backoff until
+    ``max_attempts`` is reached. If the mail server cannot be reached, that
+    counts as a failed attempt for every email left in the batch.
+    """
+    connection = connection or get_connection()
+    sent = failed = 0
+    connected = False
+    try:
+        for index, email in enumerate(emails):
+            if not connected:
+                try:
+                    connection.open()
+                except Exception as e:
+                    for pending in emails[index:]:
+                        failed += _record_failure(pending, e, max_attempts, backoff)
+                    break
+                connected = True
+            message = EmailMessage(email.subject, email.body, email.from_email or None, email.recipients, connection=connection)
+            try:
+                connection.send_messages([message])
+            except Exception as e:
+                # The connection may be unusable after an SMTP error; the next
+                # message opens a fresh one.
+                _close_quietly(connection)
+                connected = False
+                failed += _record_failure(email, e, max_attempts, backoff)
+            else:
+                email.status = 'sent'
+                email.sent_at = timezone.now()
+                email.error = ''
+                sent += 1
+                email.save(update_fields=['status', 'sent_at', 'error'])
+    finally:
+        _close_quietly(connection)
+    return sent, failed
@@ -1,3 +1,101 @@
-from django.test import TestCase
+import shutil
+import tempfile
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core import mail
+from django.core.cache import cache
+from django.core.mail import get_connection
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from .models import OTP, OutboxEmail
+from .otp import _cache_key, check_otp, issue_otp
+from .outbox import claim_emails, deliver_emails, queue_mail
+
+
+class OutboxDeliveryTests(TestCase):
+    """Queued emails are sent once, retried with backoff and eventually given up on."""
+
+    def queue(self, count):
+        for i in range(count):
+            queue_mail(f'Subject {i}', 'Body', 'noreply@example.com', [f'user{i}@example.com'])
+
+    def test_claimed_emails_are_sent_once(self):
+        self.queue(3)
+        emails = claim_emails('worker-1', 10)
+        self.assertEqual(claim_emails('worker-2', 10), [])
+        self.assertEqual(deliver_emails(emails, get_connection()), (3, 0))
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(OutboxEmail.objects.filter(status='sent').count(), 3)
+
+    def test_a_failing_message_is_retried_alone(self):
+        self.queue(3)
+        connection = get_connection()
+        send = connection.send_messages
+
+        def flaky(messages):
+            if messages[0].to == ['user1@example.com']:
+                raise OSError('rejected')
+            return send(messages)
+
+        with mock.patch.object(connection, 'send_messages', side_effect=flaky):
+            self.assertEqual(deliver_emails(claim_emails('worker-1', 10), connection, backoff=30), (2, 0))
+        retry = OutboxEmail.objects.get(status='pending')
+        self.assertEqual((retry.recipients, retry.attempts, retry.error), (['user1@example.com'], 1, 'rejected'))
+        self.assertGreater(retry.next_attempt_at, timezone.now())
+        self.assertEqual(len(mail.outbox), 2)
+
+    def test_unreachable_server_backs_off_the_whole_batch(self):
+        self.queue(3)
+        connection = get_connection()
+        with mock.patch.object(connection, 'open', side_effect=OSError('connection refused')):
+            self.assertEqual(deliver_emails(claim_emails('worker-1', 10), connection, max_attempts=2), (0, 0))
+            self.assertEqual(OutboxEmail.objects.filter(status='pending', next_attempt_at__gt=timezone.now()).count(), 3)
+            # Nothing is due again until the backoff has passed.
+            self.assertEqual(claim_emails('worker-1', 10), [])
+
+            OutboxEmail.objects.update(next_attempt_at=timezone.now())
+            self.assertEqual(deliver_emails(claim_emails('worker-1', 10), connection, max_attempts=2), (0, 3))
+        self.assertEqual(OutboxEmail.objects.filter(status='failed', attempts=2).count(), 3)
+        self.assertEqual(len(mail.outbox), 0)
+
+
+class OTPTests(TestCase):
+    """Issuing a code invalidates the previous one in every process."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', email='patient@example.com', password='x')
+
+    def issue(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            return issue_otp(self.user).otp_code
+
+    def test_replaced_code_is_rejected_even_if_a_process_still_caches_it(self):
+        old = self.issue()
+        new = self.issue()
+        if new == old:
+            new = self.issue()
+        # What the local cache of the process that issued the old code still holds.
+        cache.set(_cache_key(self.user.pk), old, 600)
+        self.assertEqual(check_otp(self.user, old), 'invalid')
+        self.assertEqual(check_otp(self.user, new), 'valid')
+
+    def test_shared_cache_answers_without_the_database(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        file_cache = {'default': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location}}
+        with override_settings(CACHES=file_cache):
+            old = self.issue()
+            new = self.issue()
+            if new != old:
+                self.assertEqual(check_otp(self.user, old), 'invalid')
+            with self.assertNumQueries(0):
+                self.assertEqual(check_otp(self.user, new), 'valid')
+
+    def test_expired_code(self):
+        code = self.issue()
+        OTP.objects.update(created_at=timezone.now() - timedelta(seconds=601))
+        self.assertEqual(check_otp(self.user, code), 'expired')
@@ -3,15 +3,40 @@ from django.shortcuts import render, redirect
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate, login, logout as auth_logout
 from django.contrib import messages
-from django.core.mail import send_mail
+from django.db import transaction
 from django.contrib.auth.password_validation import validate_password
 from django.core.exceptions import ValidationError
-from .models import DoctorProfile, PatientProfile, OTP
+from .models import DoctorProfile, PatientProfile
+from .otp import check_otp, issue_otp
+from .outbox import queue_mail
 from .forms import DoctorSignupForm, PatientSignupForm, ContactForm
 import random
 import string
 from django.conf import settings
 from django.utils import timezone
+from django.utils.cache import get_conditional_response, set_response_etag
+from django.views.decorators.cache import cache_page
+from functools import wraps
+
+
+def cache_anonymous_page(view):
+    """Serve ``view`` from the page cache to anonymous visitors.
+
+    Logged-in users and requests with pending flash messages (rendered by the
+    base template) get a fresh render. Cached responses carry an ETag, so
+    revalidations are answered with 304.
+    """
+    @cache_page(settings.PAGE_CACHE_SECONDS)
+    def cached_view(request, *args, **kwargs):
+        return set_response_etag(view(request, *args, **kwargs))
+
+    @wraps(view)
+    def wrapper(request, *args, **kwargs):
+        if request.user.is_authenticated or len(messages.get_messages(request)):
+            return view(request, *args, **kwargs)
+        response = cached_view(request, *args, **kwargs)
+        return get_conditional_response(request, etag=response.get('ETag'), response=response) or response
+    return wrapper
 
 
 def profile_view(request):
@@ -54,30 +79,30 @@ def signup(request):
             messages.error(request, "Email is already taken")
             return redirect('signup')
 
-        # Create user
-        user = User.objects.create_user(username=username, password=password, email=email, first_name=first_name, last_name=last_name)
-        user.save()
-
-        # Process based on user role
-        if role == 'doctor':
-            license_number = request.POST.get('license_number')
-            phone_number = request.POST.get('phone_number')
-            doctor_profile = DoctorProfile(user=user, license_number=license_number, phone_number=phone_number)
-            doctor_profile.save()
-        elif role == 'patient':
-            dob = request.POST.get('dob')
-            phone_number = request.POST.get('phone_number')
-            patient_profile = PatientProfile(user=user, dob=dob, phone_number=phone_number)
-            patient_profile.save()
-
-        # Send a confirmation email
-        send_mail(
-            'Welcome to Our Site!',
-            'Thank you for signing up. We are excited to have you on board!',
-            'from@example.com',  # Replace with your sender email
-            [email],  # Send to the user's email
-            fail_silently=False,
-        )
+        with transaction.atomic():
+            # Create user
+            user = User.objects.create_user(username=username, password=password, email=email, first_name=first_name, last_name=last_name)
+            user.save()
+
+            # Process based on user role
+            if role == 'doctor':
+                license_number = request.POST.get('license_number')
+                phone_number = request.POST.get('phone_number')
+                doctor_profile = DoctorProfile(user=user, license_number=license_number, phone_number=phone_number)
+                doctor_profile.save()
+            elif role == 'patient':
+                dob = request.POST.get('dob')
+                phone_number = request.POST.get('phone_number')
+                patient_profile = PatientProfile(user=user, dob=dob, phone_number=phone_number)
+                patient_profile.save()
+
+            # Queue a confirmation email
+            queue_mail(
+                'Welcome to Our Site!',
+                'Thank you for signing up. We are excited to have you on board!',
+                'from@example.com',  # Replace with your sender email
+                [email],  # Send to the user's email
+            )
 
         messages.success(request, "User created successfully. Please log in.")
         return redirect('login')  # Redirect to the login page after successful signup
@@ -132,18 +157,17 @@ def forgot_password(request):
         # Store email in session
         request.session['email'] = user.email
 
-        # Generate OTP and send to user
-        otp_instance = OTP(user=user)
-        otp_instance.generate_otp()
+        with transaction.atomic():
+            # Generate OTP (replacing any earlier one) and send to user
+            otp_instance = issue_otp(user)
 
-        # Send OTP via email
-        send_mail(
-            'Password Reset OTP',
-            f'Your OTP is: {otp_instance.otp_code}',
-            'from@example.com',  # Replace with your sender email
-            [user.email],
-            fail_silently=False,
-        )
+            # Queue the OTP email
+            queue_mail(
+                'Password Reset OTP',
+                f'Your OTP is: {otp_instance.otp_code}',
+                'from@example.com',  # Replace with your sender email
+                [user.email],
+            )
 
         messages.success(request, "An OTP has been sent to your registered email.")
         return redirect('verify_otp')
@@ -169,13 +193,12 @@ def verify_otp(request):
             messages.error(request, "No user found with this email address.")
             return redirect('verify_otp')
 
-        try:
-            otp_instance = OTP.objects.get(user=user, otp_code=otp_code)
-        except OTP.DoesNotExist:
+        otp_status = check_otp(user, otp_code)
+        if otp_status == 'invalid':
             messages.error(request, "Invalid OTP code.")
             return redirect('verify_otp')
 
-        if otp_instance.is_valid():
+        if otp_status == 'valid':
             # OTP is valid, proceed to password reset or further steps
             messages.success(request, "OTP verified successfully. You can now reset your password.")
             return redirect('reset_password')  # Replace with your actual password reset URL
@@ -229,9 +252,11 @@ def logout(request):
     auth_logout(request)
     return redirect('login')
 
+@cache_anonymous_page
 def home(request):
     return render(request, 'core/index.html')
 
+@cache_anonymous_page
 def about(request):
     return render(request, 'core/about.html')
 
@@ -244,16 +269,13 @@ def contact_view(request):
             email = form.cleaned_data['email']
             message = form.cleaned_data['message']
             
-            # Send email
+            # Queue email
             subject = f"Contact Form Submission from {name}"
             email_message = f"Name: {name}\nEmail: {email}\n\nMessage:\n{message}"
             recipient_email = "nayanai.innovate@gmail.com"  # Your email
             
-            try:
-                send_mail(subject, email_message, settings.DEFAULT_FROM_EMAIL, [recipient_email])
-                messages.success(request, "Your message has been sent successfully!")
-            except Exception as e:
-                messages.error(request, f"An error occurred: {e}")
+            queue_mail(subject, email_message, settings.DEFAULT_FROM_EMAIL, [recipient_email])
+            messages.success(request, "Your message has been sent successfully!")
             
             return redirect('contact')  # Redirect to the contact page after submission
     else:
@@ -0,0 +1,172 @@
+"""Admission control for in-process inference.
+
+At most ``INFERENCE_MAX_CONCURRENCY`` predictions (by default one per usable
+core) run at once. Up to ``INFERENCE_MAX_QUEUE`` more wait for a slot, each
+for at most ``INFERENCE_QUEUE_TIMEOUT`` seconds; anything beyond that fails
+straight away with ``InferenceBusy``, which the upload views answer with
+503 Service Unavailable and a ``Retry-After`` header instead of letting every
+request slow down together.
+
+The controller belongs to the process that runs the model: with
+``manage.py inference_server`` that is the server, so the limits hold for all
+web workers on the host together.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from django.conf import settings
+
+from .batching import percentile
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBusy(Exception):
+    """No slot became free: the wait queue was full or the wait timed out."""
+
+    def __init__(self, message='inference is busy', retry_after=1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """A counting semaphore with a bounded, timed wait queue and statistics."""
+
+    def __init__(self, slots, max_queue, timeout=None, retry_after=1, stats_window=1000):
+        self.slots = max(1, int(slots))
+        self.max_queue = max(0, int(max_queue))
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._cond = threading.Condition()
+        self.active = 0
+        self.waiting = 0
+        self.peak_waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waits = deque(maxlen=stats_window)
+
+    def acquire(self):
+        """Take a slot, waiting in the queue if needed; raises ``InferenceBusy``."""
+        with self._cond:
+            waited = 0.0
+            if self.active >= self.slots:
+                if self.waiting >= self.max_queue:
+                    self.rejected += 1
+                    raise InferenceBusy('inference queue is full', self.retry_after)
+                self.waiting += 1
+                self.peak_waiting = max(self.peak_waiting, self.waiting)
+                started = time.perf_counter()
+                try:
+                    admitted = self._cond.wait_for(lambda: self.active < self.slots, self.timeout)
+                finally:
+                    self.waiting -= 1
+                if not admitted:
+                    self.timed_out += 1
+                    raise InferenceBusy(f'no inference slot freed up within {self.timeout}s', self.retry_after)
+                waited = (time.perf_counter() - started) * 1000.0
+            self.active += 1
+            self.admitted += 1
+            self._waits.append(waited)
+
+    def release(self):
+        with self._cond:
+            self.active -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def slot(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        with self._cond:
+            waits = list(self._waits)
+            return {
+                'slots': self.slots,
+                'active': self.active,
+                'queue_depth': self.waiting,
+                'max_queue': self.max_queue,
+                'peak_queue_depth': self.peak_waiting,
+                'admitted': self.admitted,
+                'rejected': self.rejected,
+                'timed_out': self.timed_out,
+                'wait_ms_p50': percentile(waits, 50),
+                'wait_ms_p95': percentile(waits, 95),
+            }
+
+
+def parse_cpu_list(value):
+    """CPU numbers in a list such as ``"0-3,6"``."""
+    cpus = set()
+    for part in value.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        first, _, last = part.partition('-')
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def usable_cpus():
+    """Number of cores this process may run on (after any affinity pinning)."""
+    if hasattr(os, 'sched_getaffinity'):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def _pin_process():
+    cpus = parse_cpu_list(settings.INFERENCE_CPU_AFFINITY)
+    if not cpus:
+        return
+    if not hasattr(os, 'sched_setaffinity'):
+        logger.warning("INFERENCE_CPU_AFFINITY is not supported on this platform")
+        return
+    os.sched_setaffinity(0, cpus)
+    logger.info("Pinned inference process to CPUs %s", sorted(cpus))
+
+
+_controller = None
+_controller_lock = threading.Lock()
+
+
+def get_controller():
+    """The process's ``AdmissionController``, created (and the process pinned) on first use."""
+    global _controller
+    if _controller is None:
+        with _controller_lock:
+            if _controller is None:
+                # Pin first so the default slot count matches the cores left.
+                _pin_process()
+                _controller = AdmissionController(
+                    settings.INFERENCE_MAX_CONCURRENCY or usable_cpus(),
+                    settings.INFERENCE_MAX_QUEUE,
+                    timeout=settings.INFERENCE_QUEUE_TIMEOUT or None,
+                    retry_after=settings.INFERENCE_RETRY_AFTER,
+                )
+    return _controller
+
+
+def controller_stats():
+    return _controller.stats() if _controller is not None else None
+
+
+def threads_per_forward():
+    """Intra-op threads for one forward pass.
+
+    Concurrent passes split the cores between them instead of each starting a
+    thread per core. With the micro-batcher only one pass runs at a time, so it
+    gets them all; otherwise every admission slot may be running one.
+    """
+    if settings.INFERENCE_THREADS:
+        return settings.INFERENCE_THREADS
+    controller = get_controller()
+    concurrent = 1 if settings.INFERENCE_BATCHING else controller.slots
+    return max(1, usable_cpus() // concurrent)
@@ -0,0 +1,12 @@
+from django.urls import path
+from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
+
+from .api_views import prediction_status, repredict, upload_batch
+
+urlpatterns = [
+    path('token/', TokenObtainPairView.as_view(), name='api_token'),
+    path('token/refresh/', TokenRefreshView.as_view(), name='api_token_refresh'),
+    path('uploads/', upload_batch, name='api_upload_batch'),
+    path('uploads/repredict/', repredict, name='api_repredict'),
+    path('uploads/status/', prediction_status, name='api_prediction_status'),
+]
@@ -0,0 +1,159 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from rest_framework import status
+from rest_framework.decorators import api_view, parser_classes
+from rest_framework.exceptions import APIException
+from rest_framework.parsers import FormParser, JSONParser, MultiPartParser
+from rest_framework.response import Response
+
+from .admission import InferenceBusy
+from .cache import find_stored_duplicate, hash_upload, prediction_cache
+from .inference import PredictionResult, model_version, predict_batch
+from .jobs import enqueue_prediction
+from .models import ImageUpload, Prediction
+from .page_cache import touch_uploads
+from .serializers import BatchUploadSerializer, ImageRepredictSerializer, ImageStatusSerializer, UploadResultSerializer
+from .thumbnails import generate_thumbnails
+
+
+class InferenceUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'The analyzer is busy; retry later.'
+    default_code = 'busy'
+
+    def __init__(self, wait):
+        super().__init__()
+        # Sent as Retry-After by DRF's exception handler.
+        self.wait = wait
+
+
+def _predict(sources):
+    try:
+        return predict_batch(sources)
+    except InferenceBusy as e:
+        raise InferenceUnavailable(e.retry_after)
+
+
+def _results_response(request, image_ids, code=status.HTTP_200_OK, **extra):
+    """Serialize the uploads in ``image_ids`` (in that order) with their newest prediction."""
+    latest = Prediction.objects.filter(image=OuterRef('pk')).order_by('-created_at', '-pk').values('pk')[:1]
+    images = ImageUpload.objects.filter(pk__in=image_ids).annotate(latest_prediction_id=Subquery(latest)).in_bulk()
+    predictions = Prediction.objects.in_bulk([image.latest_prediction_id for image in images.values() if image.latest_prediction_id])
+    ordered = []
+    for pk in image_ids:
+        if pk in images:
+            image = images[pk]
+            image.latest_prediction = predictions.get(image.latest_prediction_id)
+            ordered.append(image)
+    data = UploadResultSerializer(ordered, many=True, context={'request': request}).data
+    return Response({'results': data, **extra}, status=code)
+
+
+def _record_results(pairs, version):
+    """Apply ``(image, PredictionResult)`` pairs to their uploads; returns unsaved Prediction rows."""
+    predictions = []
+    for image, result in pairs:
+        image.disease_predict = result.label
+        image.prediction_status = 'done' if result.ok else 'failed'
+        predictions.append(Prediction.from_result(image, result, version))
+    return predictions
+
+
+def _cache_results(pairs, version):
+    for image, result in pairs:
+        if result.ok:
+            prediction_cache.set(image.content_hash, version, result.label, result.probabilities)
+
+
+@api_view(['POST'])
+@parser_classes([MultiPartParser, FormParser])
+def upload_batch(request):
+    """Upload several scans in one multipart request (repeated ``images`` field).
+
+    Scans without a cached prediction are preprocessed together and classified
+    in a single forward pass. With ``PREDICTION_QUEUE`` enabled they are queued
+    instead and the response is ``202`` with ``pending`` statuses.
+    """
+    serializer = BatchUploadSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    version = model_version()
+
+    images, predictions, misses = [], [], []
+    for uploaded_file in serializer.validated_data['images']:
+        digest = hash_upload(uploaded_file)
+        image = ImageUpload(user=request.user, content_hash=digest)
+        # Same bytes already stored: point at that file instead of writing a copy.
+        image.image = find_stored_duplicate(digest) or uploaded_file
+        images.append(image)
+        cached = prediction_cache.get(digest, version)
+        if cached is not None:
+            label, probabilities = cached
+            image.disease_predict = label
+            image.prediction_status = 'done'
+            predictions.append(Prediction.from_result(image, PredictionResult(label=label, probabilities=probabilities), version, cached=True))
+        else:
+            misses.append((image, uploaded_file))
+
+    pairs = []
+    if misses and not settings.PREDICTION_QUEUE:
+        sources = []
+        for _, uploaded_file in misses:
+            sources.append(uploaded_file.read())
+            uploaded_file.seek(0)
+        pairs = list(zip([image for image, _ in misses], _predict(sources)))
+        predictions += _record_results(pairs, version)
+
+    with transaction.atomic():
+        ImageUpload.objects.bulk_create(images)
+        Prediction.objects.bulk_create(predictions)
+        touch_uploads([request.user.pk])
+        if settings.PREDICTION_QUEUE:
+            for image, _ in misses:
+                enqueue_prediction(image)
+    _cache_results(pairs, version)
+    if settings.THUMBNAIL_ON_UPLOAD:
+        for image in images:
+            generate_thumbnails(image)
+
+    code = status.HTTP_202_ACCEPTED if settings.PREDICTION_QUEUE and misses else status.HTTP_201_CREATED
+    return _results_response(request, [image.pk for image in images], code)
+
+
+@api_view(['POST'])
+@parser_classes([JSONParser, FormParser])
+def repredict(request):
+    """Run the current model again on the caller's uploads in ``ids``, as one batch."""
+    serializer = ImageRepredictSerializer(data=request.data)
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    images = list(ImageUpload.objects.filter(user=request.user, pk__in=ids).order_by('pk'))
+    found = {image.pk for image in images}
+    missing = [pk for pk in ids if pk not in found]
+
+    if settings.PREDICTION_QUEUE:
+        with transaction.atomic():
+            for image in images:
+                enqueue_prediction(image)
+        return _results_response(request, [pk for pk in ids if pk in found], status.HTTP_202_ACCEPTED, not_found=missing)
+
+    version = model_version()
+    pairs = list(zip(images, _predict([image.image.path for image in images])))
+    predictions = _record_results(pairs, version)
+    with transaction.atomic():
+        ImageUpload.objects.bulk_update(images, ['disease_predict', 'prediction_status'])
+        Prediction.objects.bulk_create(predictions)
+        touch_uploads([request.user.pk])
+    _cache_results(pairs, version)
+    return _results_response(request, [pk for pk in ids if pk in found], not_found=missing)
+
+
+@api_view(['GET'])
+def prediction_status(request):
+    """Status and newest prediction for the caller's uploads, e.g. ``?ids=1,2,3``."""
+    ids = [value for item in request.query_params.getlist('ids') for value in item.split(',') if value]
+    serializer = ImageStatusSerializer(data={'ids': ids})
+    serializer.is_valid(raise_exception=True)
+    ids = serializer.validated_data['ids']
+    owned = set(ImageUpload.objects.filter(user=request.user, pk__in=ids).values_list('pk', flat=True))
+    return _results_response(request, [pk for pk in ids if pk in owned], not_found=[pk for pk in ids if pk not in owned])
@@ -1,6 +1,21 @@
+import logging
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from . import signals  # noqa: F401
+
+        if settings.INFERENCE_PRELOAD:
+            from .inference import registry
+            try:
+                registry.get()
+            except Exception:
+                logger.exception("Could not preload the inference model")
@@ -0,0 +1,63 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F
+
+from accounts.models import DoctorProfile, PatientProfile
+
+from .models import RecommendationRequest
+
+
+def assign_doctor(patient):
+    """Doctor who should review ``patient``'s next request, or ``None``.
+
+    The patient's own doctor is kept while they have fewer than
+    ``DOCTOR_MAX_OPEN_REQUESTS`` open requests; otherwise the least loaded
+    doctor is chosen. Either way it is at most two indexed single-row queries.
+    """
+    profile = PatientProfile.objects.select_related('doctor__user').filter(user=patient).first()
+    if profile and profile.doctor and profile.doctor.open_requests < settings.DOCTOR_MAX_OPEN_REQUESTS:
+        return profile.doctor
+    return DoctorProfile.objects.select_related('user').order_by('open_requests', 'pk').first()
+
+
+def open_request(doctor_id):
+    DoctorProfile.objects.filter(pk=doctor_id).update(open_requests=F('open_requests') + 1)
+
+
+def close_requests(doctor_id, count=1):
+    DoctorProfile.objects.filter(pk=doctor_id, open_requests__gte=count).update(open_requests=F('open_requests') - count)
+
+
+def mark_reviewed(recommendation):
+    """Flag ``recommendation`` as reviewed, releasing its slot the first time only."""
+    with transaction.atomic():
+        changed = RecommendationRequest.objects.filter(pk=recommendation.pk, is_reviewed=False).update(is_reviewed=True)
+        if changed:
+            close_requests(recommendation.doctor_id)
+    recommendation.is_reviewed = True
+    return bool(changed)
+
+
+def release_open_requests(queryset):
+    """Give back the slots of the unreviewed requests in ``queryset`` before it is deleted."""
+    counts = queryset.filter(is_reviewed=False).values('doctor_id').annotate(open=Count('pk')).order_by()
+    for row in counts:
+        close_requests(row['doctor_id'], row['open'])
+
+
+def recount_open_requests():
+    """Recompute every doctor's counter from the requests table."""
+    counts = dict(
+        RecommendationRequest.objects.filter(is_reviewed=False)
+        .values('doctor_id').annotate(open=Count('pk')).order_by()
+        .values_list('doctor_id', 'open')
+    )
+    changed = 0
+    with transaction.atomic():
+        for doctor in DoctorProfile.objects.select_for_update().only('open_requests'):
+            expected = counts.get(doctor.pk, 0)
+            if doctor.open_requests != expected:
+                doctor.open_requests = expected
+                doctor.save(update_fields=['open_requests'])
+                changed += 1
+    return changed
@@ -0,0 +1,129 @@
+"""Async versions of the patient upload, result and history views.
+
+Enabled with ``ASYNC_VIEWS`` for ASGI deployments. Database work goes
+through the async ORM (or ``sync_to_async`` where a transaction is needed)
+and decoding, preprocessing, inference and file writes run on bounded thread
+pools, so the event loop keeps serving other requests while a scan is scored.
+"""
+import asyncio
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib import messages
+from django.contrib.auth.decorators import login_required
+from django.shortcuts import aget_object_or_404, redirect, render
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+
+from .cache import find_stored_duplicate, prediction_cache
+from .forms import ImageUploadForm
+from django.utils.functional import SimpleLazyObject
+
+from .admission import InferenceBusy
+from .inference import PredictionResult, inference_executor, model_version
+from .models import ImageUpload
+from .page_cache import conditional_page, fragment_context
+from .pagination import keyset_paginate
+from .thumbnails import generate_thumbnails
+from .uploads import HashingUploadHandler, save_file_async, storage_executor
+from .views import busy_message, mark_busy, predict_disease, report_prediction, save_and_enqueue, save_with_prediction
+
+arender = sync_to_async(render)
+
+
+def _bind_form(request):
+    form = ImageUploadForm(request.POST, request.FILES)
+    form.is_valid()
+    return form
+
+
+@csrf_exempt
+@login_required
+async def upload_image(request):
+    request.upload_handlers = [HashingUploadHandler(request)]
+    return await _upload_image(request)
+
+@csrf_protect
+async def _upload_image(request):
+    request.user = await request.auser()
+    detection_result = None
+    busy = None
+    if request.method == 'POST':
+        # Validating the image decodes it with PIL; keep that off the loop.
+        form = await sync_to_async(_bind_form, thread_sensitive=False)(request)
+        upload_errors = getattr(request, 'upload_errors', {})
+        if upload_errors:
+            for message in upload_errors.values():
+                messages.error(request, message)
+        elif form.is_valid():
+            try:
+                image_upload = form.save(commit=False)
+                image_upload.user = request.user
+                digest = image_upload.content_hash
+                duplicate = await sync_to_async(find_stored_duplicate)(digest)
+                if duplicate:
+                    image_upload.image = duplicate
+                version = await sync_to_async(model_version, thread_sensitive=False)()
+                cached = await sync_to_async(prediction_cache.get)(digest, version)
+                if cached is not None:
+                    label, probabilities = cached
+                    result = PredictionResult(label=label, probabilities=probabilities)
+                    await sync_to_async(save_with_prediction)(image_upload, result, version, cached=True)
+                    messages.success(request, 'Image uploaded and prediction completed.')
+                    detection_result = image_upload
+                elif settings.PREDICTION_QUEUE:
+                    await sync_to_async(save_and_enqueue)(image_upload)
+                    messages.success(request, 'Image uploaded. Your scan is being analyzed.')
+                    return redirect('result', image_id=image_upload.id)
+                else:
+                    uploaded = form.cleaned_data['image']
+                    data = uploaded.read()
+                    loop = asyncio.get_running_loop()
+                    predicting = loop.run_in_executor(inference_executor(), predict_disease, data)
+                    if duplicate:
+                        prediction = await predicting
+                    else:
+                        storing = asyncio.wrap_future(save_file_async(image_upload.image, uploaded.name, data))
+                        try:
+                            image_upload.image, prediction = await asyncio.gather(storing, predicting)
+                        except InferenceBusy:
+                            # Nothing will reference the copy written meanwhile.
+                            name = await storing
+                            await sync_to_async(image_upload.image.storage.delete, thread_sensitive=False)(name)
+                            raise
+                    await sync_to_async(save_with_prediction)(image_upload, prediction, version)
+                    report_prediction(request, prediction)
+                    detection_result = image_upload
+                if settings.THUMBNAIL_ON_UPLOAD and image_upload.pk:
+                    await asyncio.get_running_loop().run_in_executor(storage_executor(), generate_thumbnails, image_upload)
+            except InferenceBusy as e:
+                busy = e
+                busy_message(request, busy)
+            except Exception as e:
+                messages.error(request, f"Error: {str(e)}")
+    else:
+        form = ImageUploadForm()
+    response = await arender(request, 'patient/dashboard.html', {'form': form, 'detection_result': detection_result})
+    return mark_busy(response, busy)
+
+@login_required
+@conditional_page
+async def history(request):
+    request.user = await request.auser()
+    # Evaluated by the template (on the render thread) only when the table
+    # fragment is not cached.
+    uploaded_images = SimpleLazyObject(
+        lambda: keyset_paginate(request, ImageUpload.objects.filter(user=request.user), 'uploaded_at')
+    )
+    context = await sync_to_async(fragment_context)(request)
+    return await arender(request, 'patient/history.html', {'uploaded_images': uploaded_images, **context})
+
+@login_required
+@conditional_page
+async def result(request, image_id):
+    request.user = await request.auser()
+    detection_result = await aget_object_or_404(ImageUpload, id=image_id, user=request.user)
+    prediction = SimpleLazyObject(lambda: detection_result.predictions.order_by('-created_at').first())
+    context = await sync_to_async(fragment_context)(request)
+    return await arender(request, 'patient/result.html', {
+        'detection_result': detection_result, 'prediction': prediction, **context,
+    })
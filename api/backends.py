@@ -0,0 +1,125 @@
+import logging
+import os
+
+import numpy as np
+from django.conf import settings
+
+from .admission import threads_per_forward
+from .optimization import artifact_path
+from .preprocessing import INPUT_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+class InferenceBackend:
+    """Runs the classifier on a preprocessed ``N x 3 x 224 x 224`` float32 batch.
+
+    Subclasses import their runtime lazily in ``load()`` so that selecting one
+    backend never imports the others' dependencies.
+    """
+
+    name = None
+
+    def __init__(self, model_path):
+        self.model_path = model_path
+
+    @classmethod
+    def default_model_path(cls):
+        raise NotImplementedError
+
+    def load(self):
+        raise NotImplementedError
+
+    def run(self, batch):
+        """Return an ``N x num_classes`` array of logits."""
+        raise NotImplementedError
+
+    def warmup(self, runs):
+        dummy = np.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        for _ in range(runs):
+            self.run(dummy)
+
+    def describe(self):
+        return {'backend': self.name, 'model_path': self.model_path}
+
+
+class TorchScriptBackend(InferenceBackend):
+    name = 'torchscript'
+
+    @classmethod
+    def default_model_path(cls):
+        return artifact_path(settings.INFERENCE_MODEL_PATH, settings.INFERENCE_MODE)
+
+    def load(self):
+        import torch
+
+        from .optimization import ModeRunner
+
+        self.mode = settings.INFERENCE_MODE
+        if not os.path.exists(self.model_path):
+            if self.mode != 'fp32':
+                raise FileNotFoundError(
+                    f"Model not found at {self.model_path}; create it with 'manage.py optimize_model --mode {self.mode}'"
+                )
+            raise FileNotFoundError(f"Model not found at {self.model_path}")
+        torch.set_num_threads(threads_per_forward())
+        try:
+            # Requests run side by side in admission slots; inter-op
+            # parallelism would oversubscribe the cores again.
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            # Can only be set once per process, before any parallel work.
+            pass
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self.model = torch.jit.load(self.model_path, map_location=self.device).eval()
+        self.runner = ModeRunner(self.mode, self.device)
+        self._torch = torch
+
+    def run(self, batch):
+        torch = self._torch
+        with torch.no_grad():
+            logits = self.runner(self.model, torch.from_numpy(batch).to(self.device))
+        return logits.cpu().numpy()
+
+    def describe(self):
+        return {**super().describe(), 'mode': self.mode, 'device': str(self.device)}
+
+
+class OnnxRuntimeBackend(InferenceBackend):
+    name = 'onnx'
+
+    @classmethod
+    def default_model_path(cls):
+        return str(settings.INFERENCE_ONNX_PATH)
+
+    def load(self):
+        import onnxruntime as ort
+
+        if not os.path.exists(self.model_path):
+            raise FileNotFoundError(f"Model not found at {self.model_path}; create it with 'manage.py export_onnx'")
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        options.intra_op_num_threads = settings.INFERENCE_ONNX_THREADS or threads_per_forward()
+        options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(self.model_path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def run(self, batch):
+        return self.session.run(None, {self.input_name: np.ascontiguousarray(batch, dtype=np.float32)})[0]
+
+
+BACKENDS = {backend.name: backend for backend in (TorchScriptBackend, OnnxRuntimeBackend)}
+
+
+def get_backend_class(name=None):
+    name = name or settings.INFERENCE_BACKEND
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown inference backend {name!r}; expected one of {', '.join(BACKENDS)}")
+
+
+def softmax(logits):
+    shifted = logits - logits.max(axis=1, keepdims=True)
+    exp = np.exp(shifted, dtype=np.float32)
+    return exp / exp.sum(axis=1, keepdims=True)
@@ -0,0 +1,122 @@
+import queue
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (0 if empty)."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered))) - 1))
+    return ordered[index]
+
+
+class MicroBatcher:
+    """Collects items from concurrent callers and runs them as one batch.
+
+    ``run_batch`` receives a list of items and must return a list of results in
+    the same order. A batch is dispatched as soon as ``max_batch_size`` items
+    are queued or the oldest item has waited ``max_wait_ms`` milliseconds.
+    """
+
+    def __init__(self, run_batch, max_batch_size=16, max_wait_ms=5.0, stats_window=1000):
+        self.run_batch = run_batch
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.max_wait = max(0.0, float(max_wait_ms)) / 1000.0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._batches = 0
+        self._items = 0
+        self._errors = 0
+        self._batch_sizes = deque(maxlen=stats_window)
+        self._queue_waits = deque(maxlen=stats_window)
+        self._run_times = deque(maxlen=stats_window)
+
+    def submit(self, item, timeout=None):
+        """Queue ``item`` and block until its result is available."""
+        future = Future()
+        self._ensure_worker()
+        self._queue.put((item, future, time.perf_counter()))
+        return future.result(timeout)
+
+    def stats(self):
+        with self._lock:
+            sizes = list(self._batch_sizes)
+            waits = list(self._queue_waits)
+            runs = list(self._run_times)
+            batches, items, errors = self._batches, self._items, self._errors
+        mean_size = sum(sizes) / len(sizes) if sizes else 0.0
+        return {
+            'max_batch_size': self.max_batch_size,
+            'max_wait_ms': self.max_wait * 1000.0,
+            'batches': batches,
+            'items': items,
+            'errors': errors,
+            'queue_depth': self._queue.qsize(),
+            'mean_batch_size': mean_size,
+            'mean_batch_fill': mean_size / self.max_batch_size,
+            'queue_wait_ms': {
+                'p50': percentile(waits, 50),
+                'p95': percentile(waits, 95),
+                'p99': percentile(waits, 99),
+            },
+            'batch_run_ms': {
+                'p50': percentile(runs, 50),
+                'p95': percentile(runs, 95),
+                'p99': percentile(runs, 99),
+            },
+        }
+
+    def _ensure_worker(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._worker, name='inference-batcher', daemon=True)
+                self._thread.start()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            try:
+                if remaining <= 0:
+                    batch.append(self._queue.get_nowait())
+                else:
+                    batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _worker(self):
+        while True:
+            batch = self._collect()
+            started = time.perf_counter()
+            items = [item for item, _, _ in batch]
+            try:
+                results = self.run_batch(items)
+                if len(results) != len(items):
+                    raise RuntimeError(f"run_batch returned {len(results)} results for {len(items)} items")
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                failed = True
+            else:
+                for (_, future, _), result in zip(batch, results):
+                    future.set_result(result)
+                failed = False
+            finished = time.perf_counter()
+
+            with self._lock:
+                self._batches += 1
+                self._items += len(batch)
+                self._errors += int(failed)
+                self._batch_sizes.append(len(batch))
+                self._run_times.append((finished - started) * 1000.0)
+                for _, _, enqueued in batch:
+                    self._queue_waits.append((started - enqueued) * 1000.0)
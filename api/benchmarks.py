@@ -0,0 +1,171 @@
+import os
+import platform
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .batching import percentile
+from .inference import CLASS_NAMES
+from .preprocessing import CLAHE_CLIP_LIMIT, CLAHE_TILE_GRID, INPUT_SIZE, normalize_batch
+
+STAGES = ['decode', 'clahe', 'transform', 'forward', 'softmax']
+
+
+def synthetic_scan(size, seed=0):
+    """PNG-encoded grayscale image that looks roughly like an axial MRI slice.
+
+    A bright elliptical skull ring around a mottled brain region and an
+    off-centre blob, plus noise, so CLAHE and the PNG codec do realistic work.
+    """
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:size, :size] / float(size) - 0.5
+    radius = np.sqrt((xx / 0.42) ** 2 + (yy / 0.48) ** 2)
+    img = np.where(radius < 1.0, 90 + 40 * np.sin(xx * 40) * np.cos(yy * 33), 0.0)
+    img += np.where((radius > 0.92) & (radius < 1.0), 120, 0)
+    img += 100 * np.exp(-((xx - 0.12) ** 2 + (yy + 0.08) ** 2) / 0.004)
+    img += rng.normal(0, 8, img.shape)
+    ok, encoded = cv2.imencode('.png', img.clip(0, 255).astype(np.uint8))
+    return encoded.tobytes()
+
+
+def load_benchmark_model(model_path=None):
+    """Load the real TorchScript model if present, else an untrained ResNet-50.
+
+    The fallback has the same architecture and output width as the production
+    model, so forward timings are representative without any weights download.
+    Returns ``None`` if torch is not installed.
+    """
+    try:
+        import torch
+    except ImportError:
+        return None
+    if model_path and os.path.exists(model_path):
+        model = torch.jit.load(model_path, map_location='cpu')
+    else:
+        import torchvision
+        model = torchvision.models.resnet50(weights=None, num_classes=len(CLASS_NAMES))
+    return model.eval()
+
+
+def summarize(samples_ms, batch_size):
+    p50 = percentile(samples_ms, 50)
+    return {
+        'p50_ms': round(p50, 4),
+        'p95_ms': round(percentile(samples_ms, 95), 4),
+        'p99_ms': round(percentile(samples_ms, 99), 4),
+        'images_per_sec': round(batch_size * 1000.0 / p50, 2) if p50 else None,
+    }
+
+
+def _timed(fn, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000.0)
+    return samples
+
+
+def benchmark_case(encoded, batch_size, threads, model=None, repeat=20, warmup=3):
+    """Time every pipeline stage for one (image, batch size, threads) case.
+
+    Preprocessing stages fan out over a pool of ``threads`` threads (OpenCV
+    releases the GIL); the forward pass uses ``threads`` intra-op threads.
+    Returns ``{stage: summary}``.
+    """
+    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    buffers = [np.frombuffer(encoded, dtype=np.uint8)] * batch_size
+    staging = np.empty((batch_size, INPUT_SIZE, INPUT_SIZE), dtype=np.uint8)
+    out = np.empty((batch_size, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+    results = {}
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        decode = lambda: list(pool.map(lambda buf: cv2.imdecode(buf, cv2.IMREAD_GRAYSCALE), buffers))
+        decoded = decode()
+        results['decode'] = summarize(_timed(decode, repeat, warmup), batch_size)
+
+        equalize = lambda: list(pool.map(clahe.apply, decoded))
+        equalized = equalize()
+        results['clahe'] = summarize(_timed(equalize, repeat, warmup), batch_size)
+
+        def transform():
+            def resize(i):
+                staging[i] = cv2.resize(equalized[i], (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_LINEAR)
+            list(pool.map(resize, range(batch_size)))
+            normalize_batch(staging, out)
+        results['transform'] = summarize(_timed(transform, repeat, warmup), batch_size)
+
+    if model is not None:
+        import torch
+
+        torch.set_num_threads(threads)
+        tensor = torch.from_numpy(out)
+        with torch.no_grad():
+            logits = model(tensor)
+            results['forward'] = summarize(_timed(lambda: model(tensor), repeat, warmup), batch_size)
+            results['softmax'] = summarize(_timed(lambda: torch.softmax(logits, dim=1), repeat, warmup), batch_size)
+
+    total = sum(stage['p50_ms'] for stage in results.values())
+    results['total'] = {'p50_ms': round(total, 4), 'images_per_sec': round(batch_size * 1000.0 / total, 2) if total else None}
+    return results
+
+
+def run_benchmarks(resolutions, batch_sizes, thread_counts, model=None, repeat=20, warmup=3, progress=None):
+    cases = []
+    for resolution in resolutions:
+        encoded = synthetic_scan(resolution, seed=resolution)
+        for batch_size in batch_sizes:
+            for threads in thread_counts:
+                stages = benchmark_case(encoded, batch_size, threads, model, repeat, warmup)
+                case = {'resolution': resolution, 'batch_size': batch_size, 'threads': threads, 'stages': stages}
+                cases.append(case)
+                if progress:
+                    progress(case)
+    return {'meta': environment_info(model), 'cases': cases}
+
+
+def environment_info(model):
+    info = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'model': type(model).__name__ if model is not None else None,
+    }
+    if model is not None:
+        import torch
+        info['torch'] = torch.__version__
+    return info
+
+
+def find_regressions(current, baseline, threshold):
+    """Compare p50 latencies against a previous run.
+
+    Returns human-readable descriptions of every (case, stage) that got slower
+    by more than ``threshold`` (a fraction, e.g. ``0.1`` for 10%).
+    """
+    def key(case):
+        return case['resolution'], case['batch_size'], case['threads']
+
+    previous = {key(case): case['stages'] for case in baseline.get('cases', [])}
+    regressions = []
+    for case in current['cases']:
+        old_stages = previous.get(key(case))
+        if not old_stages:
+            continue
+        for stage, summary in case['stages'].items():
+            old = old_stages.get(stage, {}).get('p50_ms')
+            new = summary.get('p50_ms')
+            if old and new and new > old * (1 + threshold):
+                resolution, batch_size, threads = key(case)
+                regressions.append(
+                    f"{stage} @ {resolution}px, batch {batch_size}, {threads} thread(s): "
+                    f"p50 {old:.3f}ms -> {new:.3f}ms (+{(new / old - 1) * 100:.1f}%)"
+                )
+    return regressions
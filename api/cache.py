@@ -0,0 +1,121 @@
+import hashlib
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+
+from .models import ImageUpload, PredictionCache, pack_probabilities, unpack_probabilities
+
+
+def hash_upload(uploaded_file):
+    """SHA-256 hex digest of an uploaded file, read chunk by chunk.
+
+    Files from ``api.uploads.HashingUploadHandler`` were hashed while the
+    request streamed in and are not read again.
+    """
+    if getattr(uploaded_file, 'content_hash', None):
+        return uploaded_file.content_hash
+    digest = hashlib.sha256()
+    for chunk in uploaded_file.chunks():
+        digest.update(chunk)
+    uploaded_file.seek(0)
+    return digest.hexdigest()
+
+
+def find_stored_duplicate(digest):
+    """Name of an already stored upload with the same content, if any."""
+    names = (
+        ImageUpload.objects.filter(content_hash=digest)
+        .exclude(image='')
+        .order_by('pk')
+        .values_list('image', flat=True)
+    )
+    for name in names[:5]:
+        if default_storage.exists(name):
+            return name
+    return None
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping with a fixed number of entries."""
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                self._data.move_to_end(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return self._data[key]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class PredictionCacheStore:
+    """Predictions keyed by ``(content digest, model version)``.
+
+    Lookups hit an in-process LRU first and fall back to the
+    ``PredictionCache`` table, so duplicate scans are answered without
+    touching torch even after a restart.
+    """
+
+    def __init__(self, maxsize):
+        self.memory = LRUCache(maxsize)
+
+    def get(self, digest, model_version):
+        """``(label, probabilities)`` for a cached prediction, else ``None``."""
+        if not digest or not model_version:
+            return None
+        key = (digest, model_version)
+        entry = self.memory.get(key)
+        if entry is None:
+            row = (
+                PredictionCache.objects.filter(digest=digest, model_version=model_version)
+                .values_list('disease_predict', 'probabilities')
+                .first()
+            )
+            if row is None:
+                return None
+            entry = (row[0], unpack_probabilities(row[1]))
+            self.memory.set(key, entry)
+        return entry
+
+    def set(self, digest, model_version, label, probabilities=None):
+        if not digest or not model_version:
+            return
+        self.memory.set((digest, model_version), (label, probabilities))
+        # Two workers can score the same scan at once; the model version is
+        # part of the key, so whichever row lands first is as good as the other.
+        PredictionCache.objects.bulk_create([
+            PredictionCache(
+                digest=digest, model_version=model_version,
+                disease_predict=label, probabilities=pack_probabilities(probabilities),
+            )
+        ], ignore_conflicts=True)
+
+    def stats(self):
+        return {'size': len(self.memory), 'hits': self.memory.hits, 'misses': self.memory.misses}
+
+
+prediction_cache = PredictionCacheStore(settings.PREDICTION_CACHE_SIZE)
@@ -0,0 +1,117 @@
+import logging
+import os
+import time
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import router, transaction
+
+from .assignment import release_open_requests
+from .models import ImageUpload, PendingFileDeletion, Prediction, PredictionJob, RecommendationRequest
+from .page_cache import touch_uploads
+from .thumbnails import delete_thumbnails, name_key
+
+logger = logging.getLogger(__name__)
+
+# Rows that reference ImageUpload and are deleted along with it.
+DEPENDENT_MODELS = (RecommendationRequest, Prediction, PredictionJob)
+
+
+def _raw_delete(queryset):
+    # A plain DELETE ... WHERE: no objects are loaded and no signals are sent.
+    return queryset._raw_delete(router.db_for_write(queryset.model))
+
+
+def delete_uploads(queryset, chunk_size=None):
+    """Delete the uploads in ``queryset`` in primary-key chunks.
+
+    Each chunk is one transaction that issues a raw DELETE per dependent table
+    and queues the stored files for ``manage.py sweep_deleted_files``, so
+    memory use and lock time stay bounded however many rows match. Returns the
+    number of uploads deleted.
+    """
+    chunk_size = chunk_size or settings.DELETE_CHUNK_SIZE
+    deleted = 0
+    last_pk = 0
+    while True:
+        rows = list(
+            queryset.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('pk', 'image', 'content_hash', 'user_id')[:chunk_size]
+        )
+        if not rows:
+            return deleted
+        pks = [pk for pk, _, _, _ in rows]
+        with transaction.atomic():
+            release_open_requests(RecommendationRequest.objects.filter(image_id__in=pks))
+            for model in DEPENDENT_MODELS:
+                _raw_delete(model.objects.filter(image_id__in=pks))
+            deleted += _raw_delete(ImageUpload.objects.filter(pk__in=pks))
+            PendingFileDeletion.objects.bulk_create(
+                PendingFileDeletion(name=name, content_hash=content_hash)
+                for _, name, content_hash, _ in rows if name
+            )
+            touch_uploads(user_id for _, _, _, user_id in rows)
+        last_pk = pks[-1]
+
+
+def sweep_deleted_files(limit=500):
+    """Remove queued files that no remaining upload still uses.
+
+    Duplicate uploads share one stored file (and their thumbnails share a
+    content hash), so a file is only unlinked once nothing references it.
+    Returns ``(entries processed, files removed)``.
+    """
+    entries = list(PendingFileDeletion.objects.order_by('pk')[:limit])
+    if not entries:
+        return 0, 0
+    names = {entry.name for entry in entries}
+    hashes = {entry.content_hash for entry in entries if entry.content_hash}
+    live_names = set(ImageUpload.objects.filter(image__in=names).values_list('image', flat=True))
+    live_hashes = set(ImageUpload.objects.filter(content_hash__in=hashes).values_list('content_hash', flat=True))
+
+    removed = 0
+    for name in names - live_names:
+        try:
+            default_storage.delete(name)
+            removed += 1
+        except OSError:
+            logger.exception("Could not delete %s", name)
+        delete_thumbnails(name_key(name))
+    for content_hash in hashes - live_hashes:
+        delete_thumbnails(content_hash)
+    PendingFileDeletion.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+    return len(entries), removed
+
+
+def find_orphaned_files(min_age=3600):
+    """Yield paths under the uploads and thumbnail folders that no upload references.
+
+    Files younger than ``min_age`` seconds are skipped so uploads that are
+    still being written are never reported.
+    """
+    upload_dir = ImageUpload._meta.get_field('image').upload_to
+    names = set()
+    keys = set()
+    for name, content_hash in ImageUpload.objects.values_list('image', 'content_hash').iterator(chunk_size=5000):
+        names.add(name)
+        keys.add(content_hash or name_key(name))
+    cutoff = time.time() - min_age
+
+    def old_files(root):
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    if os.stat(path).st_mtime < cutoff:
+                        yield path
+                except FileNotFoundError:
+                    continue
+
+    media_root = str(settings.MEDIA_ROOT)
+    for path in old_files(os.path.join(media_root, upload_dir)):
+        if os.path.relpath(path, media_root).replace(os.sep, '/') not in names:
+            yield path
+    for path in old_files(settings.THUMBNAIL_ROOT):
+        # Derivatives are named <key>_<width>.<ext>.
+        if os.path.basename(path).split('_', 1)[0] not in keys:
+            yield path
@@ -1,7 +1,13 @@
 from django import forms
 from .models import ImageUpload
+from .cache import hash_upload
 
 class ImageUploadForm(forms.ModelForm):
     class Meta:
         model = ImageUpload
         fields = ['image']  # Exclude 'user'
+
+    def clean_image(self):
+        image = self.cleaned_data['image']
+        self.instance.content_hash = hash_upload(image)
+        return image
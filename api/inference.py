@@ -0,0 +1,310 @@
+import hashlib
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+from django.conf import settings
+
+from .admission import controller_stats, get_controller
+from .batching import MicroBatcher
+from .inference_server import RemoteInferenceError, ServerUnavailable, get_client
+from .backends import get_backend_class, softmax
+from .preprocessing import preprocess_batch
+
+logger = logging.getLogger(__name__)
+
+CLASS_NAMES = ['glioma', 'meningioma', 'notumor', 'pituitary']
+
+
+class ModelRegistry:
+    """Process-wide holder for the inference backend.
+
+    The backend named by ``INFERENCE_BACKEND`` is loaded lazily behind a lock
+    the first time it is needed (or eagerly from ``ApiConfig.ready()``), warmed
+    up with dummy forward passes and then shared by every request in the
+    process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._backend = None
+        self._mtime = None
+        self._checked_at = 0.0
+
+    @property
+    def model_path(self):
+        """Model file the configured backend (and, for TorchScript, mode) loads."""
+        return get_backend_class().default_model_path()
+
+    @property
+    def loaded(self):
+        return self._backend is not None
+
+    def get(self):
+        """Return the loaded ``InferenceBackend``, loading it on first use."""
+        if self._backend is None:
+            with self._lock:
+                if self._backend is None:
+                    self._load()
+        elif settings.INFERENCE_AUTO_RELOAD:
+            self.reload_if_changed()
+        return self._backend
+
+    def run(self, batch):
+        """Logits for an ``N x 3 x H x W`` float32 array."""
+        return self.get().run(batch)
+
+    def reload(self):
+        """Unconditionally reload the model from disk."""
+        with self._lock:
+            self._load()
+
+    def reload_if_changed(self):
+        """Reload the model if the file on disk has a newer mtime.
+
+        The ``stat`` call is throttled to once per
+        ``INFERENCE_RELOAD_CHECK_SECONDS`` so it stays off the hot path.
+        """
+        now = time.monotonic()
+        if now - self._checked_at < settings.INFERENCE_RELOAD_CHECK_SECONDS:
+            return False
+        self._checked_at = now
+        try:
+            mtime = os.path.getmtime(self.model_path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        with self._lock:
+            if mtime == self._mtime:
+                return False
+            logger.info("Model file %s changed on disk, reloading", self.model_path)
+            self._load()
+        return True
+
+    def _load(self):
+        backend_class = get_backend_class()
+        model_path = backend_class.default_model_path()
+        backend = backend_class(model_path)
+        backend.load()
+        mtime = os.path.getmtime(model_path)
+        # The TorchScript profiling executor specialises the graph over the
+        # first few calls and ONNX Runtime allocates its arenas lazily; run
+        # them here instead of on the first upload.
+        backend.warmup(settings.INFERENCE_WARMUP_RUNS)
+
+        # Swap in the new backend only once it is fully warmed up so concurrent
+        # callers never see a half-initialised instance.
+        self._backend, self._mtime = backend, mtime
+        self._checked_at = time.monotonic()
+        logger.info("Loaded %s", backend.describe())
+
+
+registry = ModelRegistry()
+
+_version_cache = {}
+
+
+def model_version():
+    """Identifier of the model currently on disk, used to key cached predictions.
+
+    ``INFERENCE_MODEL_VERSION`` wins if set; otherwise it is the SHA-256 of the
+    model file for the active inference mode, recomputed only when the file's
+    size or mtime changes. This never imports torch. Returns ``None`` if the
+    model file is missing.
+    """
+    if settings.INFERENCE_MODEL_VERSION:
+        return settings.INFERENCE_MODEL_VERSION
+    path = registry.model_path
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    key = (path, stat.st_mtime_ns, stat.st_size)
+    version = _version_cache.get(key)
+    if version is None:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+        version = digest.hexdigest()
+        _version_cache.clear()
+        _version_cache[key] = version
+    return version
+
+_batcher = None
+_batcher_lock = threading.Lock()
+
+
+def forward_batch(batch):
+    """Run one forward pass over preprocessed images.
+
+    ``batch`` is an ``N x 3 x H x W`` float32 array or a list of ``3 x H x W``
+    arrays. Returns an ``N x len(CLASS_NAMES)`` array of softmax rows.
+    """
+    if not isinstance(batch, np.ndarray):
+        batch = np.stack(batch)
+    client = get_client()
+    if client is not None:
+        try:
+            return client.forward(batch)
+        except ServerUnavailable:
+            pass
+    return softmax(registry.run(batch))
+
+
+def get_batcher():
+    global _batcher
+    if _batcher is None:
+        with _batcher_lock:
+            if _batcher is None:
+                _batcher = MicroBatcher(
+                    forward_batch,
+                    max_batch_size=settings.INFERENCE_MAX_BATCH_SIZE,
+                    max_wait_ms=settings.INFERENCE_MAX_WAIT_MS,
+                )
+    return _batcher
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def inference_executor():
+    """Bounded thread pool for running predictions off the ASGI event loop.
+
+    Threads rather than processes: OpenCV, PyTorch and ONNX Runtime release
+    the GIL in their kernels, and every thread shares the one loaded model.
+
+    Admission happens in these threads, so there is one for every admission
+    slot and queue place plus a spare: a prediction beyond the queue then
+    reaches the controller and gets its ``InferenceBusy`` straight away
+    instead of waiting for a free thread in the pool's unbounded work queue.
+    """
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            controller = get_controller()
+            workers = max(settings.INFERENCE_EXECUTOR_WORKERS, controller.slots + controller.max_queue + 1)
+            _executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='inference')
+        return _executor
+
+
+def predict_probabilities(image):
+    """Softmax row for a single preprocessed ``3 x H x W`` image.
+
+    Goes through the micro-batcher when ``INFERENCE_BATCHING`` is on so that
+    concurrent requests share a forward pass.
+    """
+    if settings.INFERENCE_BATCHING:
+        return get_batcher().submit(image)
+    return forward_batch(image[np.newaxis])[0]
+
+
+def inference_stats():
+    client = get_client()
+    return {
+        'model_loaded': registry.loaded,
+        'backend': registry.get().describe() if registry.loaded else {'backend': settings.INFERENCE_BACKEND},
+        'batching': get_batcher().stats() if _batcher is not None else None,
+        'admission': controller_stats(),
+        'server': client.stats() if client is not None else None,
+    }
+
+
+@dataclass
+class PredictionResult:
+    label: str = None
+    probabilities: np.ndarray = None
+    error: str = None
+    decode_ms: float = None
+    preprocess_ms: float = None
+    inference_ms: float = None
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def confidence(self):
+        if self.probabilities is None:
+            return None
+        return float(np.max(self.probabilities))
+
+
+def _result(probabilities, timing, inference_ms):
+    probabilities = np.asarray(probabilities, dtype=np.float32)
+    return PredictionResult(
+        label=CLASS_NAMES[int(probabilities.argmax())],
+        probabilities=probabilities,
+        inference_ms=inference_ms,
+        **timing,
+    )
+
+
+def predict_image(source):
+    """Predict a single image given as a path or encoded bytes.
+
+    Failures come back as a ``PredictionResult`` with ``error`` set; only
+    ``InferenceBusy`` is raised, when admission control turns the request
+    away. Runs on the inference server when one is configured and reachable.
+    """
+    client = get_client()
+    if client is not None:
+        try:
+            return client.predict([source])[0]
+        except ServerUnavailable:
+            pass
+        except RemoteInferenceError as e:
+            return PredictionResult(error=str(e))
+    with get_controller().slot():
+        errors, timings = {}, {}
+        batch = preprocess_batch([source], errors=errors, timings=timings)
+        if errors:
+            return PredictionResult(error=errors[0])
+        started = time.perf_counter()
+        try:
+            probabilities = predict_probabilities(batch[0])
+        except Exception as e:
+            return PredictionResult(error=str(e), **timings[0])
+        return _result(probabilities, timings[0], (time.perf_counter() - started) * 1000.0)
+
+
+def predict_batch(sources):
+    """Predict several images with a single forward pass.
+
+    Returns one ``PredictionResult`` per source, in input order. An image that
+    cannot be read fails on its own without failing the rest of the batch;
+    ``inference_ms`` is the duration of the shared forward pass. The batch
+    takes one admission slot and raises ``InferenceBusy`` if it gets none.
+    """
+    client = get_client()
+    if client is not None:
+        try:
+            return client.predict(sources)
+        except ServerUnavailable:
+            pass
+        except RemoteInferenceError as e:
+            return [PredictionResult(error=str(e)) for _ in sources]
+    with get_controller().slot():
+        errors, timings = {}, {}
+        batch = preprocess_batch(sources, errors=errors, timings=timings)
+        results = [PredictionResult(error=errors[i]) if i in errors else None for i in range(len(sources))]
+        indices = [i for i in range(len(sources)) if i not in errors]
+
+        if indices:
+            started = time.perf_counter()
+            try:
+                probs = forward_batch(batch)
+            except Exception as e:
+                for i in indices:
+                    results[i] = PredictionResult(error=str(e), **timings[i])
+            else:
+                inference_ms = (time.perf_counter() - started) * 1000.0
+                for i, prob in zip(indices, probs):
+                    results[i] = _result(prob, timings[i], inference_ms)
+    return results
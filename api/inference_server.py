@@ -0,0 +1,354 @@
+"""Shared inference daemon and its client.
+
+``manage.py inference_server`` loads the model once and serves every web
+worker on the host over a Unix domain socket, so the workers need neither
+the weights nor the runtime's thread pools of their own.
+
+Each message is a frame: two big-endian uint32 lengths, a JSON header and a
+binary payload. Payloads of at least ``INFERENCE_SERVER_SHM_THRESHOLD`` bytes
+(preprocessed batches, most encoded scans) are not sent over the socket: the
+client copies them into a ``multiprocessing.shared_memory`` segment it keeps
+per connection and the header names the segment instead.
+
+Requests:
+
+* ``{"op": "predict", "sizes": [...]}`` with the encoded images concatenated
+  in the payload; answered with per-image errors and timings, and the
+  probability rows as float32 in the payload.
+* ``{"op": "forward", "shape": [...], "dtype": "float32"}`` with a
+  preprocessed batch; answered with the softmax rows.
+* ``{"op": "stats"}``.
+
+A request turned away by the server's admission control is answered with
+``{"ok": false, "busy": true, "retry_after": ...}``, which the client raises
+as ``InferenceBusy``.
+"""
+import atexit
+import json
+import logging
+import os
+import socket
+import socketserver
+import struct
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+from django.conf import settings
+
+from .admission import InferenceBusy
+
+logger = logging.getLogger(__name__)
+
+FRAME = struct.Struct('!II')
+
+
+class ServerUnavailable(Exception):
+    """The daemon cannot be reached; the caller should run inference itself."""
+
+
+class RemoteInferenceError(Exception):
+    """The daemon was reached but the request failed there."""
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:])
+        if not n:
+            raise ConnectionError("connection closed")
+        received += n
+    return bytes(buf)
+
+
+def send_frame(sock, header, payload=b''):
+    raw = json.dumps(header).encode()
+    sock.sendall(FRAME.pack(len(raw), len(payload)) + raw)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_frame(sock):
+    header_size, payload_size = FRAME.unpack(_recv_exactly(sock, FRAME.size))
+    header = json.loads(_recv_exactly(sock, header_size))
+    return header, _recv_exactly(sock, payload_size) if payload_size else b''
+
+
+def _attach(name):
+    shm = shared_memory.SharedMemory(name=name)
+    # Before Python 3.13 attaching registers the segment with this process's
+    # resource tracker, which would unlink it (the client owns it) on exit.
+    resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def setup(self):
+        self.shm = None
+
+    def finish(self):
+        if self.shm is not None:
+            self.shm.close()
+
+    def handle(self):
+        while True:
+            try:
+                header, payload = recv_frame(self.request)
+            except OSError:
+                return
+            try:
+                if header.get('shm'):
+                    payload = self.read_shm(header['shm'], header['nbytes'])
+                response, body = self.dispatch(header, payload)
+            except InferenceBusy as e:
+                response, body = {'ok': False, 'busy': True, 'error': str(e), 'retry_after': e.retry_after}, b''
+            except Exception as e:
+                logger.exception("Inference request failed")
+                response, body = {'ok': False, 'error': str(e)}, b''
+            try:
+                send_frame(self.request, response, body)
+            except OSError:
+                return
+
+    def read_shm(self, name, nbytes):
+        if self.shm is None or self.shm.name != name:
+            # The client replaced its segment with a larger one.
+            if self.shm is not None:
+                self.shm.close()
+            self.shm = _attach(name)
+        return bytes(self.shm.buf[:nbytes])
+
+    def dispatch(self, header, payload):
+        from . import inference
+
+        op = header.get('op')
+        if op == 'predict':
+            sources, offset = [], 0
+            for size in header['sizes']:
+                sources.append(payload[offset:offset + size])
+                offset += size
+            # Single images go through the micro-batcher, so concurrent
+            # requests from different workers share a forward pass.
+            results = [inference.predict_image(sources[0])] if len(sources) == 1 else inference.predict_batch(sources)
+            rows = [
+                result.probabilities if result.ok else np.zeros(len(inference.CLASS_NAMES), dtype=np.float32)
+                for result in results
+            ]
+            meta = [
+                {'error': result.error, 'decode_ms': result.decode_ms,
+                 'preprocess_ms': result.preprocess_ms, 'inference_ms': result.inference_ms}
+                for result in results
+            ]
+            return {'ok': True, 'results': meta}, np.asarray(rows, dtype=np.float32).tobytes()
+        if op == 'forward':
+            batch = np.frombuffer(payload, dtype=header['dtype']).reshape(header['shape'])
+            probs = inference.predict_probabilities(batch[0])[np.newaxis] if len(batch) == 1 else inference.forward_batch(batch)
+            probs = np.ascontiguousarray(probs, dtype=np.float32)
+            return {'ok': True, 'shape': list(probs.shape)}, probs.tobytes()
+        if op == 'stats':
+            return {'ok': True, 'stats': inference.inference_stats()}, b''
+        raise ValueError(f"Unknown op {op!r}")
+
+
+class InferenceServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def make_server(path):
+    """A server for the Unix socket ``path``, with the model loaded; call ``serve_forever()``."""
+    from . import inference
+
+    disable_client()
+    inference.registry.get()
+    if os.path.exists(path):
+        os.unlink(path)
+    server = InferenceServer(path, _Handler)
+    os.chmod(path, 0o660)
+    return server
+
+
+class _Connection:
+    def __init__(self, path, timeout):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(timeout)
+        try:
+            self.sock.connect(path)
+        except OSError:
+            self.sock.close()
+            raise
+        self.shm = None
+
+    def segment(self, nbytes):
+        if self.shm is None or self.shm.size < nbytes:
+            self.release_segment()
+            # Grow in powers of two so a steady workload settles on one segment.
+            self.shm = shared_memory.SharedMemory(create=True, size=1 << max(nbytes - 1, 1).bit_length())
+        return self.shm
+
+    def release_segment(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm.unlink()
+            self.shm = None
+
+    def request(self, header, payload):
+        if len(payload) >= settings.INFERENCE_SERVER_SHM_THRESHOLD:
+            shm = self.segment(len(payload))
+            shm.buf[:len(payload)] = payload
+            header = {**header, 'shm': shm.name, 'nbytes': len(payload)}
+            payload = b''
+        send_frame(self.sock, header, payload)
+        return recv_frame(self.sock)
+
+    def close(self):
+        self.sock.close()
+        self.release_segment()
+
+
+class InferenceClient:
+    """Talks to ``manage.py inference_server``, one reused connection per thread.
+
+    Raises ``ServerUnavailable`` when the daemon cannot be reached; after that
+    it does not try again for ``retry_after`` seconds.
+    """
+
+    def __init__(self, path, timeout=30.0, retry_after=5.0):
+        self.path = path
+        self.timeout = timeout
+        self.retry_after = retry_after
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._down_until = 0.0
+        self.requests = 0
+        self.unavailable = 0
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            if time.monotonic() < self._down_until:
+                raise ServerUnavailable(f"inference server at {self.path} is down")
+            try:
+                conn = _Connection(self.path, self.timeout)
+            except OSError as e:
+                self._mark_down()
+                raise ServerUnavailable(str(e)) from e
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _drop(self, conn):
+        self._local.conn = None
+        with self._lock:
+            if conn in self._connections:
+                self._connections.remove(conn)
+        conn.close()
+
+    def _mark_down(self):
+        with self._lock:
+            self.unavailable += 1
+            self._down_until = time.monotonic() + self.retry_after
+        logger.warning("Inference server at %s is unavailable; running inference in-process for %ss", self.path, self.retry_after)
+
+    def request(self, header, payload=b''):
+        # A reused connection may have been closed by a restarted server, so
+        # a request that fails before any reply is retried once on a new one.
+        for attempt in range(2):
+            conn = self._connection()
+            try:
+                response, body = conn.request(header, payload)
+            except socket.timeout:
+                self._drop(conn)
+                raise RemoteInferenceError(f"inference server did not answer within {self.timeout}s")
+            except OSError as e:
+                self._drop(conn)
+                if attempt:
+                    self._mark_down()
+                    raise ServerUnavailable(str(e)) from e
+                continue
+            with self._lock:
+                self.requests += 1
+            if response.get('busy'):
+                raise InferenceBusy(response['error'], response['retry_after'])
+            if not response.get('ok'):
+                raise RemoteInferenceError(response.get('error', 'inference failed'))
+            return response, body
+
+    def predict(self, sources):
+        """``PredictionResult`` per encoded image (bytes) or file path in ``sources``."""
+        from .inference import PredictionResult, _result
+
+        blobs = []
+        for source in sources:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                blobs.append(bytes(source))
+            else:
+                with open(source, 'rb') as f:
+                    blobs.append(f.read())
+        response, body = self.request({'op': 'predict', 'sizes': [len(blob) for blob in blobs]}, b''.join(blobs))
+        rows = np.frombuffer(body, dtype=np.float32).reshape(len(blobs), -1)
+        results = []
+        for meta, row in zip(response['results'], rows):
+            if meta['error'] is not None:
+                results.append(PredictionResult(**meta))
+            else:
+                results.append(_result(row.copy(), {
+                    'decode_ms': meta['decode_ms'], 'preprocess_ms': meta['preprocess_ms'],
+                }, meta['inference_ms']))
+        return results
+
+    def forward(self, batch):
+        """Softmax rows for a preprocessed ``N x 3 x H x W`` batch."""
+        batch = np.ascontiguousarray(batch, dtype=np.float32)
+        response, body = self.request(
+            {'op': 'forward', 'shape': list(batch.shape), 'dtype': 'float32'}, memoryview(batch).cast('B'),
+        )
+        return np.frombuffer(body, dtype=np.float32).reshape(response['shape']).copy()
+
+    def stats(self):
+        return {
+            'socket': self.path,
+            'connections': len(self._connections),
+            'requests': self.requests,
+            'unavailable': self.unavailable,
+            'down': time.monotonic() < self._down_until,
+        }
+
+    def close(self):
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for conn in connections:
+            conn.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+_disabled = False
+
+
+def get_client():
+    """The process's ``InferenceClient``, or ``None`` when no server is configured."""
+    global _client
+    if _disabled or not settings.INFERENCE_SERVER_SOCKET:
+        return None
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                _client = InferenceClient(
+                    settings.INFERENCE_SERVER_SOCKET,
+                    timeout=settings.INFERENCE_SERVER_TIMEOUT,
+                    retry_after=settings.INFERENCE_SERVER_RETRY_SECONDS,
+                )
+                # Unlinks the shared memory segments when the worker exits.
+                atexit.register(_client.close)
+    return _client
+
+
+def disable_client():
+    """Run inference in this process (the server itself must never call out)."""
+    global _disabled
+    _disabled = True
@@ -0,0 +1,158 @@
+import logging
+import os
+import socket
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .admission import InferenceBusy
+from .cache import prediction_cache
+from .inference import model_version, predict_batch
+from .models import ImageUpload, Prediction, PredictionJob
+from .page_cache import touch_uploads
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_prediction(image_upload):
+    """Mark ``image_upload`` as pending and queue a job for it."""
+    with transaction.atomic():
+        if image_upload.prediction_status != 'pending':
+            image_upload.prediction_status = 'pending'
+            ImageUpload.objects.filter(pk=image_upload.pk).update(prediction_status='pending')
+            touch_uploads([image_upload.user_id])
+        job, created = PredictionJob.objects.get_or_create(image=image_upload)
+        if not created and job.status != 'pending':
+            job.status = 'pending'
+            job.error = ''
+            job.save(update_fields=['status', 'error'])
+    return job
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+
+def claim_jobs(worker, limit):
+    """Atomically claim up to ``limit`` pending jobs for ``worker``.
+
+    On PostgreSQL the candidate rows are locked with ``SKIP LOCKED`` so workers
+    never block each other. SQLite has no row locks (Django ignores
+    ``select_for_update`` there), but the conditional ``UPDATE ... WHERE
+    status = 'pending'`` still guarantees a job is claimed by one worker only.
+    """
+    with transaction.atomic():
+        ids = list(
+            PredictionJob.objects.select_for_update(skip_locked=True)
+            .filter(status='pending')
+            .order_by('created_at')
+            .values_list('pk', flat=True)[:limit]
+        )
+        if not ids:
+            return []
+        PredictionJob.objects.filter(pk__in=ids, status='pending').update(
+            status='running', worker=worker, claimed_at=timezone.now(), attempts=F('attempts') + 1,
+        )
+        jobs = list(
+            PredictionJob.objects.select_related('image')
+            .filter(pk__in=ids, status='running', worker=worker)
+        )
+        ImageUpload.objects.filter(pk__in=[job.image_id for job in jobs]).update(prediction_status='running')
+        touch_uploads(job.image.user_id for job in jobs)
+    return jobs
+
+
+def requeue_stale_jobs(older_than, max_attempts=3):
+    """Return jobs stuck in ``running`` (e.g. after a worker crash) to the queue.
+
+    A job that has already used ``max_attempts`` is marked failed instead, so
+    an image that kills the worker is not retried forever. Returns the number
+    of jobs requeued.
+    """
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=older_than)
+    with transaction.atomic():
+        stale = PredictionJob.objects.filter(status='running', claimed_at__lt=cutoff)
+        rows = list(stale.values_list('image_id', 'image__user_id', 'attempts'))
+        exhausted = [image_id for image_id, _, attempts in rows if attempts >= max_attempts]
+        stale.filter(attempts__gte=max_attempts).update(
+            status='failed', worker='', error='Worker stopped while running this job', finished_at=now,
+        )
+        count = stale.filter(attempts__lt=max_attempts).update(status='pending', worker='')
+        ImageUpload.objects.filter(pk__in=exhausted).update(prediction_status='failed')
+        ImageUpload.objects.filter(
+            pk__in=[image_id for image_id, _, _ in rows if image_id not in exhausted]
+        ).update(prediction_status='pending')
+        touch_uploads(user_id for _, user_id, _ in rows)
+    return count
+
+
+def _predict_when_admitted(paths):
+    # Background work yields to uploads: wait for a free slot rather than
+    # failing the jobs.
+    while True:
+        try:
+            return predict_batch(paths)
+        except InferenceBusy as e:
+            time.sleep(e.retry_after)
+
+
+def _finish_job(job, status, error='', finished_at=None, **image_fields):
+    """Record the outcome of ``job`` if this worker still holds it.
+
+    Returns False when the job row is gone (its upload was deleted while the
+    model ran) or was requeued to another worker in the meantime.
+    """
+    updated = PredictionJob.objects.filter(pk=job.pk, status='running', worker=job.worker).update(
+        status=status, error=error, finished_at=finished_at,
+    )
+    if updated:
+        ImageUpload.objects.filter(pk=job.image_id).update(prediction_status=status, **image_fields)
+        touch_uploads([job.image.user_id])
+    return bool(updated)
+
+
+def _record_result(job, result, version, max_attempts, now):
+    if result.ok:
+        status, fields = 'done', {'disease_predict': result.label}
+    else:
+        status, fields = ('pending' if job.attempts < max_attempts else 'failed'), {}
+    with transaction.atomic():
+        if not _finish_job(job, status, result.error or '', now if status != 'pending' else None, **fields):
+            return None
+        Prediction.from_result(job.image, result, version).save()
+    if result.ok:
+        prediction_cache.set(job.image.content_hash, version, result.label, result.probabilities)
+    return status
+
+
+def run_jobs(jobs, max_attempts=3):
+    """Run inference for claimed ``jobs`` in one batch and record the outcome.
+
+    Each job is recorded on its own: one whose upload was deleted meanwhile is
+    skipped, and one that cannot be recorded is marked failed without
+    affecting the rest of the batch.
+    """
+    version = model_version()
+    results = _predict_when_admitted([job.image.image.path for job in jobs])
+    now = timezone.now()
+    done = failed = 0
+    for job, result in zip(jobs, results):
+        try:
+            status = _record_result(job, result, version, max_attempts, now)
+        except Exception as e:
+            logger.exception("Could not record prediction job %s", job.pk)
+            try:
+                status = 'failed' if _finish_job(job, 'failed', str(e), now) else None
+            except Exception:
+                logger.exception("Could not mark prediction job %s failed", job.pk)
+                status = None
+        if status == 'done':
+            done += 1
+        elif status == 'failed':
+            failed += 1
+    return done, failed
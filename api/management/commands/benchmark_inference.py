@@ -0,0 +1,72 @@
+import json
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmarks import find_regressions, load_benchmark_model, run_benchmarks
+
+
+def int_list(value):
+    return [int(part) for part in value.split(',') if part]
+
+
+def default_thread_counts():
+    cores = os.cpu_count() or 1
+    counts = [1]
+    while counts[-1] * 2 <= cores:
+        counts.append(counts[-1] * 2)
+    if counts[-1] != cores:
+        counts.append(cores)
+    return counts
+
+
+class Command(BaseCommand):
+    help = "Benchmark MRI preprocessing and model latency on synthetic images (no GPU or network needed)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--resolutions', type=int_list, default=[256, 512, 1024], help="Comma-separated source image sizes in pixels.")
+        parser.add_argument('--batch-sizes', type=int_list, default=[1, 2, 4, 8, 16, 32, 64], help="Comma-separated batch sizes.")
+        parser.add_argument('--threads', type=int_list, default=default_thread_counts(), help="Comma-separated thread counts.")
+        parser.add_argument('--repeat', type=int, default=20, help="Timed iterations per stage.")
+        parser.add_argument('--warmup', type=int, default=3, help="Untimed iterations per stage.")
+        parser.add_argument('--model', default=str(settings.INFERENCE_MODEL_PATH), help="TorchScript model; an untrained ResNet-50 is used if it does not exist.")
+        parser.add_argument('--no-model', action='store_true', help="Only benchmark preprocessing.")
+        parser.add_argument('--output', help="Write the JSON report here instead of stdout.")
+        parser.add_argument('--baseline', help="Previous JSON report to compare p50 latencies against.")
+        parser.add_argument('--threshold', type=float, default=0.10, help="Allowed p50 slowdown versus the baseline, as a fraction.")
+
+    def handle(self, *args, **options):
+        model = None
+        if not options['no_model']:
+            model = load_benchmark_model(options['model'])
+            if model is None:
+                self.stderr.write("torch is not installed; skipping forward and softmax stages")
+
+        def progress(case):
+            total = case['stages']['total']
+            self.stderr.write(
+                f"{case['resolution']}px batch={case['batch_size']} threads={case['threads']}: "
+                f"{total['p50_ms']:.2f}ms p50, {total['images_per_sec']} images/s"
+            )
+
+        report = run_benchmarks(
+            options['resolutions'], options['batch_sizes'], options['threads'],
+            model=model, repeat=options['repeat'], warmup=options['warmup'], progress=progress,
+        )
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                f.write(output)
+            self.stderr.write(f"Wrote {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options['baseline']:
+            with open(options['baseline']) as f:
+                baseline = json.load(f)
+            regressions = find_regressions(report, baseline, options['threshold'])
+            if regressions:
+                raise CommandError("Performance regressions:\n  " + "\n  ".join(regressions))
+            self.stderr.write(self.style.SUCCESS("No regressions against baseline"))
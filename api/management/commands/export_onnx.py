@@ -0,0 +1,70 @@
+import os
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.backends import softmax
+from api.optimization import iter_batches, list_images
+from api.preprocessing import INPUT_SIZE
+
+
+class Command(BaseCommand):
+    help = "Export the TorchScript model to ONNX and check that ONNX Runtime gives the same outputs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--model', default=str(settings.INFERENCE_MODEL_PATH), help="fp32 TorchScript model to export.")
+        parser.add_argument('--output', default=str(settings.INFERENCE_ONNX_PATH))
+        parser.add_argument('--opset', type=int, default=17)
+        parser.add_argument('--check-dir', help="Also compare predictions on the images in this folder.")
+        parser.add_argument('--samples', type=int, default=8, help="Random inputs used for the equivalence check.")
+        parser.add_argument('--atol', type=float, default=1e-3, help="Maximum allowed absolute difference in logits.")
+
+    def handle(self, *args, **options):
+        import onnxruntime as ort
+        import torch
+
+        if not os.path.exists(options['model']):
+            raise CommandError(f"Model not found at {options['model']}")
+        model = torch.jit.load(options['model'], map_location='cpu').eval()
+
+        dummy = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+        torch.onnx.export(
+            model, (dummy,), options['output'],
+            input_names=['input'], output_names=['logits'],
+            dynamic_axes={'input': {0: 'batch'}, 'logits': {0: 'batch'}},
+            opset_version=options['opset'],
+            dynamo=False,
+        )
+        self.stdout.write(f"Wrote {options['output']} ({os.path.getsize(options['output']) / 1e6:.1f} MB)")
+
+        session = ort.InferenceSession(options['output'], providers=['CPUExecutionProvider'])
+        input_name = session.get_inputs()[0].name
+
+        def compare(batch):
+            with torch.no_grad():
+                expected = model(torch.from_numpy(batch)).numpy()
+            actual = session.run(None, {input_name: batch})[0]
+            top1 = softmax(expected).argmax(1) == softmax(actual).argmax(1)
+            return float(np.abs(expected - actual).max()), int(top1.sum()), len(batch)
+
+        rng = np.random.default_rng(0)
+        random_batch = rng.standard_normal((options['samples'], 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        max_diff, agree, total = compare(random_batch)
+        self.stdout.write(f"Random inputs: max logit difference {max_diff:.2e}")
+
+        if options['check_dir']:
+            paths = list_images(options['check_dir'])
+            if not paths:
+                raise CommandError(f"No images found in {options['check_dir']}")
+            agree = total = 0
+            for _, batch in iter_batches(paths, 16):
+                diff, batch_agree, batch_total = compare(batch)
+                max_diff = max(max_diff, diff)
+                agree += batch_agree
+                total += batch_total
+            self.stdout.write(f"Images: top-1 agreement {agree}/{total}, max logit difference {max_diff:.2e}")
+
+        if max_diff > options['atol'] or agree != total:
+            raise CommandError(f"ONNX output differs from TorchScript (max logit difference {max_diff:.2e}, top-1 {agree}/{total})")
+        self.stdout.write(self.style.SUCCESS("ONNX Runtime output matches TorchScript"))
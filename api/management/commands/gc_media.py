@@ -0,0 +1,29 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from api.cleanup import find_orphaned_files
+
+
+class Command(BaseCommand):
+    help = "Delete uploaded images and thumbnails under MEDIA_ROOT that no upload row references."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=3600, help="Only consider files older than this many seconds.")
+        parser.add_argument('--dry-run', action='store_true', help="List orphaned files without deleting them.")
+
+    def handle(self, *args, **options):
+        count = size = 0
+        for path in find_orphaned_files(options['min_age']):
+            try:
+                file_size = os.path.getsize(path)
+                if options['dry_run']:
+                    self.stdout.write(path)
+                else:
+                    os.unlink(path)
+            except FileNotFoundError:
+                continue
+            count += 1
+            size += file_size
+        verb = "Would remove" if options['dry_run'] else "Removed"
+        self.stdout.write(f"{verb} {count} orphaned file(s), {size / 1e6:.1f} MB")
@@ -0,0 +1,37 @@
+import os
+import signal
+import threading
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.inference_server import make_server
+
+
+class Command(BaseCommand):
+    help = "Load the model once and serve inference to the web workers over a Unix domain socket."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--socket', default=settings.INFERENCE_SERVER_SOCKET, help="Socket path (default: INFERENCE_SERVER_SOCKET).")
+
+    def handle(self, *args, **options):
+        path = options['socket']
+        if not path:
+            raise CommandError("No socket path: pass --socket or set INFERENCE_SERVER_SOCKET.")
+        server = make_server(path)
+
+        def stop(signum, frame):
+            # shutdown() blocks until serve_forever() returns, so not from this thread.
+            threading.Thread(target=server.shutdown).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        self.stdout.write(f"Inference server listening on {path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if os.path.exists(path):
+                os.unlink(path)
+        self.stdout.write("Inference server stopped")
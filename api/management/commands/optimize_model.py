@@ -0,0 +1,66 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.optimization import INFERENCE_MODES, artifact_path, compare_top1, convert, list_images
+
+
+class Command(BaseCommand):
+    help = "Write an optimised CPU inference artifact next to the fp32 model and check its accuracy parity."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', required=True, choices=[mode for mode in INFERENCE_MODES if mode != 'fp32'])
+        parser.add_argument('--model', default=str(settings.INFERENCE_MODEL_PATH), help="fp32 TorchScript model to convert.")
+        parser.add_argument('--calibration-dir', help="Images used to calibrate activation ranges (required for int8_static).")
+        parser.add_argument('--calibration-images', type=int, default=200, help="Maximum calibration images.")
+        parser.add_argument('--check-dir', help="Images to compare top-1 predictions on against the fp32 model.")
+        parser.add_argument('--min-agreement', type=float, default=0.99, help="Fail if top-1 agreement on --check-dir is below this fraction.")
+        parser.add_argument('--check-only', action='store_true', help="Only run the parity check against an existing artifact.")
+        parser.add_argument('--batch-size', type=int, default=16)
+
+    def handle(self, *args, **options):
+        import torch
+
+        mode = options['mode']
+        model_path = options['model']
+        output = artifact_path(model_path, mode)
+        if not os.path.exists(model_path):
+            raise CommandError(f"Model not found at {model_path}")
+        reference = torch.jit.load(model_path, map_location='cpu').eval()
+
+        if options['check_only']:
+            if not os.path.exists(output):
+                raise CommandError(f"No {mode} artifact at {output}")
+            optimized = torch.jit.load(output, map_location='cpu').eval()
+        else:
+            calibration = None
+            if mode == 'int8_static':
+                if not options['calibration_dir']:
+                    raise CommandError("--calibration-dir is required for int8_static")
+                calibration = list_images(options['calibration_dir'], options['calibration_images'])
+                if not calibration:
+                    raise CommandError(f"No images found in {options['calibration_dir']}")
+                self.stdout.write(f"Calibrating on {len(calibration)} image(s)")
+
+            # Convert a separate copy so the reference stays untouched fp32.
+            try:
+                optimized = convert(torch.jit.load(model_path, map_location='cpu'), mode, calibration, options['batch_size'])
+            except (ImportError, ValueError) as e:
+                raise CommandError(f"Could not convert to {mode}: {e}")
+            torch.jit.save(optimized, output)
+            size_mb = os.path.getsize(output) / 1e6
+            self.stdout.write(self.style.SUCCESS(f"Wrote {mode} model to {output} ({size_mb:.1f} MB)"))
+
+        if options['check_dir']:
+            paths = list_images(options['check_dir'])
+            if not paths:
+                raise CommandError(f"No images found in {options['check_dir']}")
+            agreement, total, max_diff, disagreements = compare_top1(reference, optimized, mode, paths, options['batch_size'])
+            for path, expected, actual in disagreements:
+                self.stdout.write(f"  {path}: fp32={expected} {mode}={actual}")
+            self.stdout.write(f"Top-1 agreement {agreement:.2%} on {total} image(s), max probability difference {max_diff:.4f}")
+            if agreement < options['min_agreement']:
+                raise CommandError(f"Top-1 agreement {agreement:.2%} is below {options['min_agreement']:.2%}")
+        elif not options['check_only']:
+            self.stdout.write("Skipping parity check; pass --check-dir to compare against the fp32 model.")
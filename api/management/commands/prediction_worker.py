@@ -0,0 +1,38 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.jobs import claim_jobs, requeue_stale_jobs, run_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = "Claim queued prediction jobs and run them through the model in batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=8, help="Jobs claimed and predicted per forward pass.")
+        parser.add_argument('--poll-interval', type=float, default=1.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--max-attempts', type=int, default=3, help="Attempts before a job is marked failed.")
+        parser.add_argument('--stale-after', type=int, default=600, help="Requeue running jobs claimed longer ago than this many seconds.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit instead of polling.")
+
+    def handle(self, *args, **options):
+        worker = worker_name()
+        self.stdout.write(f"Prediction worker {worker} started")
+        try:
+            while True:
+                requeued = requeue_stale_jobs(options['stale_after'], options['max_attempts'])
+                if requeued:
+                    self.stdout.write(f"Requeued {requeued} stale job(s)")
+
+                jobs = claim_jobs(worker, options['batch_size'])
+                if jobs:
+                    done, failed = run_jobs(jobs, max_attempts=options['max_attempts'])
+                    self.stdout.write(f"Processed {len(jobs)} job(s): {done} done, {failed} failed")
+                    continue
+
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(f"Prediction worker {worker} stopped")
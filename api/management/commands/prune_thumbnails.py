@@ -0,0 +1,15 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from api.thumbnails import evict
+
+
+class Command(BaseCommand):
+    help = "Evict least recently used thumbnails until the derivative cache fits its size limit."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--max-bytes', type=int, default=settings.THUMBNAIL_CACHE_MAX_BYTES)
+
+    def handle(self, *args, **options):
+        removed, removed_bytes = evict(options['max_bytes'])
+        self.stdout.write(f"Removed {removed} thumbnail(s), {removed_bytes / 1e6:.1f} MB")
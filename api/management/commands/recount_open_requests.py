@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from api.assignment import recount_open_requests
+
+
+class Command(BaseCommand):
+    help = "Recompute each doctor's open request counter from the recommendation requests table."
+
+    def handle(self, *args, **options):
+        changed = recount_open_requests()
+        self.stdout.write(f"Corrected {changed} doctor counter(s)")
@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time as dt_time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from api.inference import CLASS_NAMES, PredictionResult, forward_batch, model_version
+from api.models import ImageUpload, Prediction, PredictionCache, pack_probabilities
+from api.page_cache import touch_uploads
+from api.preprocessing import preprocess_batch
+
+
+def _preprocess(paths):
+    # Runs in a worker process; must stay importable at module level.
+    errors, timings = {}, {}
+    batch = preprocess_batch(paths, errors=errors, timings=timings)
+    return batch, errors, timings
+
+
+def _chunks(iterable, size):
+    chunk = []
+    for item in iterable:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+class Command(BaseCommand):
+    help = "Re-run the current model over stored uploads and write the new predictions back."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help="Only uploads on or after this date (YYYY-MM-DD).")
+        parser.add_argument('--until', help="Only uploads on or before this date (YYYY-MM-DD).")
+        parser.add_argument('--user', action='append', default=[], help="Only uploads by this username. Repeatable.")
+        parser.add_argument('--prediction', action='append', default=[], help="Only uploads whose current prediction is this label. Repeatable.")
+        parser.add_argument('--chunk-size', type=int, default=256, help="Rows fetched, written and checkpointed per chunk.")
+        parser.add_argument('--batch-size', type=int, default=32, help="Images per forward pass.")
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="Preprocessing processes.")
+        parser.add_argument('--checkpoint', default=os.path.join(settings.BASE_DIR, 'repredict.checkpoint.json'), help="Checkpoint file used to resume an interrupted run.")
+        parser.add_argument('--resume', action='store_true', help="Continue after the last checkpointed upload.")
+        parser.add_argument('--dry-run', action='store_true', help="Predict and report changes without writing anything.")
+
+    def handle(self, *args, **options):
+        filters = {key: options[key] for key in ('since', 'until', 'user', 'prediction')}
+        queryset = self.build_queryset(filters)
+
+        last_pk, processed = 0, 0
+        if options['resume']:
+            last_pk, processed = self.load_checkpoint(options['checkpoint'], filters)
+            queryset = queryset.filter(pk__gt=last_pk)
+            self.stdout.write(f"Resuming after upload {last_pk} ({processed} already processed)")
+
+        version = model_version()
+        total = queryset.count()
+        self.stdout.write(f"Re-predicting {total} upload(s) with model {version or 'unknown'}")
+
+        started = time.perf_counter()
+        changed = failed = done = 0
+        rows = queryset.only('pk', 'user_id', 'image', 'disease_predict', 'prediction_status', 'content_hash').iterator(chunk_size=options['chunk_size'])
+        with ProcessPoolExecutor(max_workers=max(1, options['workers'])) as pool:
+            for chunk in _chunks(rows, options['chunk_size']):
+                batches = list(_chunks(chunk, options['batch_size']))
+                updates, records, cache_entries = [], [], []
+                # The pool preprocesses later batches while earlier ones run through the model.
+                paths = [[image.image.path for image in images] for images in batches]
+                for images, (batch, errors, timings) in zip(batches, pool.map(_preprocess, paths)):
+                    ok = [(i, image) for i, image in enumerate(images) if i not in errors]
+                    for i in errors:
+                        failed += 1
+                        self.stderr.write(f"Upload {images[i].pk}: {errors[i]}")
+                        records.append(Prediction.from_result(images[i], PredictionResult(error=errors[i]), version))
+                    if not ok:
+                        continue
+                    forward_started = time.perf_counter()
+                    probs = forward_batch(batch)
+                    inference_ms = (time.perf_counter() - forward_started) * 1000.0
+                    for (i, image), prob in zip(ok, probs):
+                        label = CLASS_NAMES[int(prob.argmax())]
+                        result = PredictionResult(label=label, probabilities=prob, inference_ms=inference_ms, **timings[i])
+                        records.append(Prediction.from_result(image, result, version))
+                        if label != image.disease_predict or image.prediction_status != 'done':
+                            changed += 1
+                            image.disease_predict = label
+                            image.prediction_status = 'done'
+                            updates.append(image)
+                        if image.content_hash and version:
+                            cache_entries.append(PredictionCache(
+                                digest=image.content_hash, model_version=version,
+                                disease_predict=label, probabilities=pack_probabilities(prob),
+                            ))
+
+                done += len(chunk)
+                if not options['dry_run']:
+                    ImageUpload.objects.bulk_update(updates, ['disease_predict', 'prediction_status'])
+                    Prediction.objects.bulk_create(records)
+                    PredictionCache.objects.bulk_create(cache_entries, ignore_conflicts=True)
+                    touch_uploads(record.image.user_id for record in records)
+                    self.save_checkpoint(options['checkpoint'], filters, chunk[-1].pk, processed + done)
+
+                elapsed = time.perf_counter() - started
+                self.stdout.write(f"{done}/{total} processed, {changed} changed, {failed} failed ({done / elapsed:.1f} images/s)")
+
+        elapsed = time.perf_counter() - started
+        rate = done / elapsed if elapsed else 0.0
+        verb = "would change" if options['dry_run'] else "changed"
+        self.stdout.write(self.style.SUCCESS(
+            f"Done: {done} processed, {verb} {changed}, {failed} failed in {elapsed:.1f}s ({rate:.1f} images/s)"
+        ))
+        if not options['dry_run'] and os.path.exists(options['checkpoint']):
+            os.remove(options['checkpoint'])
+
+    def build_queryset(self, filters):
+        queryset = ImageUpload.objects.exclude(image='').order_by('pk')
+        tz = timezone.get_current_timezone()
+        if filters['since']:
+            queryset = queryset.filter(uploaded_at__gte=datetime.combine(self.parse_date(filters['since']), dt_time.min, tz))
+        if filters['until']:
+            queryset = queryset.filter(uploaded_at__lte=datetime.combine(self.parse_date(filters['until']), dt_time.max, tz))
+        if filters['user']:
+            missing = set(filters['user']) - set(User.objects.filter(username__in=filters['user']).values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Unknown user(s): {', '.join(sorted(missing))}")
+            queryset = queryset.filter(user__username__in=filters['user'])
+        if filters['prediction']:
+            queryset = queryset.filter(disease_predict__in=filters['prediction'])
+        return queryset
+
+    def parse_date(self, value):
+        parsed = parse_date(value)
+        if parsed is None:
+            raise CommandError(f"Invalid date: {value}")
+        return parsed
+
+    def load_checkpoint(self, path, filters):
+        try:
+            with open(path) as f:
+                checkpoint = json.load(f)
+        except FileNotFoundError:
+            raise CommandError(f"No checkpoint found at {path}")
+        if checkpoint.get('filters') != filters:
+            raise CommandError("Checkpoint was written with different filters; rerun with the same options or start over without --resume.")
+        return checkpoint['last_pk'], checkpoint['processed']
+
+    def save_checkpoint(self, path, filters, last_pk, processed):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'filters': filters, 'last_pk': last_pk, 'processed': processed}, f)
+        os.replace(tmp_path, path)
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.cleanup import sweep_deleted_files
+
+
+class Command(BaseCommand):
+    help = "Delete media files queued by upload deletions once nothing references them."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500, help="Queued files handled per pass.")
+        parser.add_argument('--poll-interval', type=float, default=30.0, help="Seconds to sleep when the queue is empty.")
+        parser.add_argument('--once', action='store_true', help="Drain the queue once and exit instead of polling.")
+
+    def handle(self, *args, **options):
+        try:
+            while True:
+                processed, removed = sweep_deleted_files(options['batch_size'])
+                if processed:
+                    self.stdout.write(f"Processed {processed} queued file(s), removed {removed}")
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+        except KeyboardInterrupt:
+            pass
@@ -0,0 +1,45 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:24
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_prediction_status(apps, schema_editor):
+    # Rows created before the queue existed were predicted inline.
+    ImageUpload = apps.get_model('api', 'ImageUpload')
+    uploads = ImageUpload.objects.using(schema_editor.connection.alias)
+    uploads.filter(disease_predict__startswith='Error').update(prediction_status='failed')
+    uploads.exclude(prediction_status='failed').update(prediction_status='done')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='imageupload',
+            name='prediction_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10),
+        ),
+        migrations.RunPython(backfill_prediction_status, migrations.RunPython.noop),
+        migrations.CreateModel(
+            name='PredictionJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('claimed_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('image', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='prediction_job', to='api.imageupload')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'created_at'], name='api_predict_status_23922d_idx')],
+            },
+        ),
+    ]
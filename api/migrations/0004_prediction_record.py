@@ -0,0 +1,54 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:29
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def move_error_labels(apps, schema_editor):
+    # Failures used to be stored as "Error: ..." in the label column.
+    ImageUpload = apps.get_model('api', 'ImageUpload')
+    Prediction = apps.get_model('api', 'Prediction')
+    db_alias = schema_editor.connection.alias
+    failed = ImageUpload.objects.using(db_alias).filter(disease_predict__startswith='Error')
+    Prediction.objects.using(db_alias).bulk_create(
+        Prediction(image_id=pk, status='error', error=label.removeprefix('Error: '))
+        for pk, label in failed.values_list('pk', 'disease_predict').iterator()
+    )
+    failed.update(disease_predict=None, prediction_status='failed')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_prediction_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='predictioncache',
+            name='probabilities',
+            field=models.BinaryField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name='Prediction',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('ok', 'OK'), ('error', 'Error')], max_length=10)),
+                ('label', models.CharField(blank=True, max_length=100, null=True)),
+                ('confidence', models.FloatField(blank=True, null=True)),
+                ('probabilities', models.BinaryField(blank=True, null=True)),
+                ('model_version', models.CharField(blank=True, default='', max_length=64)),
+                ('decode_ms', models.FloatField(blank=True, null=True)),
+                ('preprocess_ms', models.FloatField(blank=True, null=True)),
+                ('inference_ms', models.FloatField(blank=True, null=True)),
+                ('cached', models.BooleanField(default=False)),
+                ('error', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('image', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='predictions', to='api.imageupload')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['image', '-created_at'], name='api_predict_image_i_e0bc0a_idx'), models.Index(fields=['model_version', 'created_at'], name='api_predict_model_v_9f81a9_idx')],
+            },
+        ),
+        migrations.RunPython(move_error_labels, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.9 on 2026-10-18 02:35
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0001_initial'),
+        ('api', '0004_prediction_record'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='imageupload',
+            index=models.Index(fields=['user', 'uploaded_at'], name='api_imageup_user_id_c920df_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationrequest',
+            index=models.Index(fields=['doctor', 'created_at'], name='api_recomme_doctor__55b888_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recommendationrequest',
+            index=models.Index(fields=['doctor', 'is_reviewed'], name='api_recomme_doctor__747707_idx'),
+        ),
+    ]
@@ -1,7 +1,23 @@
+import numpy as np
 from django.db import models
 from django.contrib.auth.models import User
 from accounts.models import DoctorProfile
 
+def pack_probabilities(probabilities):
+    """Class probabilities as little-endian float32 bytes (16 bytes for 4 classes)."""
+    if probabilities is None:
+        return None
+    return np.asarray(probabilities, dtype='<f4').tobytes()
+
+
+def unpack_probabilities(data):
+    if data is None:
+        return None
+    return np.frombuffer(bytes(data), dtype='<f4')
+
+
+PREDICTION_STATUS_CHOICES = [('pending', 'Pending'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')]
+
 class ImageUpload(models.Model):
     STATUS_CHOICES = [('none', 'None'), ('requested', 'Requested'), ('reviewed', 'Reviewed')]
     image = models.ImageField(upload_to='uploads/')
@@ -10,10 +26,34 @@ class ImageUpload(models.Model):
     doctor_comment = models.TextField(null=True, blank=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, null=True)
     request_status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='none')
+    prediction_status = models.CharField(max_length=10, choices=PREDICTION_STATUS_CHOICES, default='pending')
+    content_hash = models.CharField(max_length=64, blank=True, null=True, db_index=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['user', 'uploaded_at'])]
+
+    @property
+    def prediction_in_progress(self):
+        return self.prediction_status in ('pending', 'running')
 
     def __str__(self):
         return f"{self.user.username} - {self.disease_predict}"
 
+class RecommendationRequestQuerySet(models.QuerySet):
+    # Columns the doctor pages render for each request.
+    LISTING_FIELDS = (
+        'image_id', 'patient_id', 'doctor_id', 'message', 'is_reviewed', 'created_at',
+        'patient__first_name', 'patient__last_name',
+        'image__disease_predict', 'image__doctor_comment',
+    )
+
+    def for_doctor(self, user):
+        return self.filter(doctor__user=user)
+
+    def for_listing(self):
+        """Patient and image fetched in the same query, loading only what the lists show."""
+        return self.select_related('patient', 'image').only(*self.LISTING_FIELDS)
+
 class RecommendationRequest(models.Model):
     image = models.ForeignKey(ImageUpload, on_delete=models.CASCADE)
     patient = models.ForeignKey(User, related_name='recommendation_requests', on_delete=models.CASCADE)
@@ -23,5 +63,103 @@ class RecommendationRequest(models.Model):
     is_reviewed = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    objects = RecommendationRequestQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['doctor', 'created_at']),
+            models.Index(fields=['doctor', 'is_reviewed']),
+        ]
+
+    def __str__(self):
+        return f"Recommendation {self.patient.username} → {self.doctor.user.username}"
+
+class PredictionJob(models.Model):
+    image = models.OneToOneField(ImageUpload, related_name='prediction_job', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=PREDICTION_STATUS_CHOICES, default='pending')
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, default='')
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f"Prediction job {self.pk} ({self.status})"
+
+class PredictionCache(models.Model):
+    digest = models.CharField(max_length=64)
+    model_version = models.CharField(max_length=64)
+    disease_predict = models.CharField(max_length=100)
+    probabilities = models.BinaryField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['digest', 'model_version'], name='unique_prediction_per_digest_and_model')]
+
+    def __str__(self):
+        return f"{self.digest[:12]} @ {self.model_version[:12]} - {self.disease_predict}"
+
+class Prediction(models.Model):
+    STATUS_CHOICES = [('ok', 'OK'), ('error', 'Error')]
+    image = models.ForeignKey(ImageUpload, related_name='predictions', on_delete=models.CASCADE)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    label = models.CharField(max_length=100, blank=True, null=True)
+    confidence = models.FloatField(null=True, blank=True)
+    # Softmax output in CLASS_NAMES order, packed with pack_probabilities().
+    probabilities = models.BinaryField(null=True, blank=True)
+    model_version = models.CharField(max_length=64, blank=True, default='')
+    decode_ms = models.FloatField(null=True, blank=True)
+    preprocess_ms = models.FloatField(null=True, blank=True)
+    inference_ms = models.FloatField(null=True, blank=True)
+    cached = models.BooleanField(default=False)
+    error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['image', '-created_at']),
+            models.Index(fields=['model_version', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Prediction {self.pk} ({self.status}) - {self.label}"
+
+    @classmethod
+    def from_result(cls, image, result, model_version='', cached=False):
+        """Unsaved record for an ``api.inference.PredictionResult``."""
+        return cls(
+            image=image,
+            status='ok' if result.ok else 'error',
+            label=result.label,
+            confidence=result.confidence,
+            probabilities=pack_probabilities(result.probabilities),
+            model_version=model_version or '',
+            decode_ms=result.decode_ms,
+            preprocess_ms=result.preprocess_ms,
+            inference_ms=result.inference_ms,
+            cached=cached,
+            error=result.error or '',
+        )
+
+    @property
+    def class_probabilities(self):
+        """``[(class name, probability), ...]`` in model output order."""
+        from .inference import CLASS_NAMES
+
+        probabilities = unpack_probabilities(self.probabilities)
+        if probabilities is None:
+            return []
+        return list(zip(CLASS_NAMES, probabilities.tolist()))
+
+class PendingFileDeletion(models.Model):
+    """Media left behind by deleted uploads, removed by ``manage.py sweep_deleted_files``."""
+    name = models.CharField(max_length=255)
+    content_hash = models.CharField(max_length=64, blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
     def __str__(self):
-        return f"Recommendation {self.patient.username} → {self.doctor.user.username}"
\ No newline at end of file
+        return self.name
@@ -0,0 +1,210 @@
+import contextlib
+import copy
+import logging
+import os
+
+import numpy as np
+
+from .preprocessing import INPUT_SIZE, preprocess_batch
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp', '.tif', '.tiff', '.webp')
+
+# fp32 runs the original TorchScript file; every other mode loads an artifact
+# written next to it by ``manage.py optimize_model``.
+INFERENCE_MODES = ['fp32', 'frozen', 'int8_dynamic', 'int8_static', 'channels_last', 'bf16']
+
+
+def artifact_path(model_path, mode):
+    """``models/brain_resnet50.pt`` -> ``models/brain_resnet50.<mode>.pt``."""
+    if mode == 'fp32':
+        return str(model_path)
+    root, ext = os.path.splitext(str(model_path))
+    return f"{root}.{mode}{ext}"
+
+
+def bf16_supported():
+    import torch
+
+    for probe in ('_is_avx512_bf16_supported', '_is_amx_tile_supported'):
+        check = getattr(torch.cpu, probe, None)
+        if check is not None and check():
+            return True
+    return False
+
+
+class ModeRunner:
+    """Applies the per-call part of an inference mode around ``model(x)``.
+
+    Most modes are baked into the artifact at conversion time; channels-last
+    also needs its inputs in NHWC layout and bf16 runs under CPU autocast.
+    """
+
+    def __init__(self, mode, device):
+        import torch
+
+        if mode not in INFERENCE_MODES:
+            raise ValueError(f"Unknown inference mode: {mode}")
+        self.mode = mode
+        self.channels_last = mode == 'channels_last'
+        self.autocast = mode == 'bf16' and device.type == 'cpu' and bf16_supported()
+        if mode == 'bf16' and not self.autocast:
+            logger.warning("bf16 autocast is not supported on this CPU; running the bf16 artifact in fp32")
+        self._torch = torch
+
+    def __call__(self, model, tensor):
+        torch = self._torch
+        if self.channels_last:
+            tensor = tensor.contiguous(memory_format=torch.channels_last)
+        context = torch.autocast('cpu', dtype=torch.bfloat16) if self.autocast else contextlib.nullcontext()
+        with context:
+            return model(tensor).float()
+
+
+def list_images(directory, limit=None):
+    paths = sorted(
+        os.path.join(root, name)
+        for root, _, names in os.walk(directory)
+        for name in names
+        if name.lower().endswith(IMAGE_EXTENSIONS)
+    )
+    return paths[:limit] if limit else paths
+
+
+def iter_batches(paths, batch_size):
+    """Yield ``(paths, batch)`` for decodable images, ``batch_size`` at a time."""
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        errors = {}
+        batch = preprocess_batch(chunk, errors=errors)
+        if len(batch):
+            yield [path for i, path in enumerate(chunk) if i not in errors], batch
+
+
+def _freeze(model):
+    import torch
+
+    frozen = torch.jit.freeze(model.eval())
+    return torch.jit.optimize_for_inference(frozen)
+
+
+def eager_resnet50(scripted):
+    """Quantizable torchvision ResNet-50 carrying the weights of the TorchScript ``scripted``.
+
+    Eager-mode quantization swaps ``nn.Module`` instances, which a loaded
+    TorchScript model does not have, so the int8 modes rebuild the network.
+    """
+    from torchvision.models.quantization import resnet50
+
+    state = scripted.state_dict()
+    model = resnet50(weights=None, quantize=False, num_classes=state['fc.weight'].shape[0])
+    try:
+        model.load_state_dict(state)
+    except RuntimeError as e:
+        raise ValueError(f"The int8 modes need a torchvision ResNet-50 checkpoint: {e}")
+    return model.eval()
+
+
+def quantize_dynamic_int8(model):
+    """Copy of eager ``model`` with int8 Linear weights; activations are quantized per call."""
+    import torch
+    from torch.ao.quantization import quantize_dynamic
+
+    return quantize_dynamic(model.eval(), {torch.nn.Linear}, dtype=torch.qint8)
+
+
+def quantize_static_int8(model, calibrate):
+    """Copy of eager ``model`` with int8 weights and activations.
+
+    ``model`` must wrap its forward in ``QuantStub``/``DeQuantStub`` and may
+    offer ``fuse_model()``, as torchvision's quantizable models do.
+    ``calibrate(prepared)`` runs representative inputs through the observed
+    copy to record activation ranges.
+    """
+    import torch
+    from torch.ao.quantization import convert as convert_observed, get_default_qconfig, prepare
+
+    backend = 'x86' if 'x86' in torch.backends.quantized.supported_engines else 'fbgemm'
+    torch.backends.quantized.engine = backend
+    model = copy.deepcopy(model).eval()
+    if hasattr(model, 'fuse_model'):
+        model.fuse_model()
+    model.qconfig = get_default_qconfig(backend)
+    prepared = prepare(model)
+    with torch.no_grad():
+        calibrate(prepared)
+    return convert_observed(prepared)
+
+
+def to_torchscript(model, example=None):
+    """Trace eager ``model`` into the TorchScript form the inference backend loads."""
+    import torch
+
+    if example is None:
+        example = torch.zeros(1, 3, INPUT_SIZE, INPUT_SIZE)
+    with torch.no_grad():
+        return torch.jit.trace(model.eval(), example)
+
+
+def convert(model, mode, calibration_paths=None, batch_size=16):
+    """Return an optimised copy of the fp32 TorchScript ``model`` for ``mode``."""
+    import torch
+
+    model = model.eval()
+    if mode == 'frozen':
+        return _freeze(model)
+
+    if mode == 'channels_last':
+        model = model.to(memory_format=torch.channels_last)
+        return _freeze(model)
+
+    if mode == 'bf16':
+        # Weights stay fp32; autocast picks bf16 kernels at run time.
+        return _freeze(model)
+
+    if mode == 'int8_dynamic':
+        return to_torchscript(quantize_dynamic_int8(eager_resnet50(model)))
+
+    if mode == 'int8_static':
+        if not calibration_paths:
+            raise ValueError("int8_static needs calibration images")
+
+        def calibrate(prepared):
+            for _, batch in iter_batches(calibration_paths, batch_size):
+                prepared(torch.from_numpy(batch))
+
+        return to_torchscript(quantize_static_int8(eager_resnet50(model), calibrate))
+
+    raise ValueError(f"Unknown inference mode: {mode}")
+
+
+def compare_top1(reference, candidate, mode, paths, batch_size=16):
+    """Top-1 agreement between the fp32 ``reference`` and an optimised model.
+
+    Returns ``(agreement, images, max_abs_prob_diff, disagreements)`` where
+    ``disagreements`` lists ``(path, reference_class, candidate_class)``.
+    """
+    import torch
+
+    from .inference import CLASS_NAMES
+
+    fp32 = ModeRunner('fp32', torch.device('cpu'))
+    runner = ModeRunner(mode, torch.device('cpu'))
+    total = agree = 0
+    max_diff = 0.0
+    disagreements = []
+    with torch.no_grad():
+        for batch_paths, batch in iter_batches(paths, batch_size):
+            tensor = torch.from_numpy(batch)
+            ref = torch.softmax(fp32(reference, tensor), dim=1).numpy()
+            out = torch.softmax(runner(candidate, tensor), dim=1).numpy()
+            max_diff = max(max_diff, float(np.abs(ref - out).max()))
+            for path, r, c in zip(batch_paths, ref.argmax(1), out.argmax(1)):
+                total += 1
+                if r == c:
+                    agree += 1
+                else:
+                    disagreements.append((path, CLASS_NAMES[r], CLASS_NAMES[c]))
+    return (agree / total if total else 0.0), total, max_diff, disagreements
+
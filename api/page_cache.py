@@ -0,0 +1,124 @@
+"""Versioned caching for the patient history and result pages.
+
+Every change to a patient's uploads bumps a version kept in the cache: the
+model signals in ``api.signals`` do it on save and delete, and bulk queryset
+writes (which send no signals) call ``touch_uploads`` themselves. The version
+is part of both the template fragment keys and the ETag, so a stale fragment
+is never served and an unchanged page is answered with 304 Not Modified.
+"""
+import hashlib
+import time
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction, sync_to_async
+from django.conf import settings
+from django.contrib.messages import get_messages
+from django.core.cache import cache
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.utils.functional import SimpleLazyObject
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+
+
+def _version_key(user_id):
+    return f"uploads-version:{user_id}"
+
+
+def uploads_version(user_id):
+    """Nanosecond timestamp of the last change to ``user_id``'s uploads."""
+    key = _version_key(user_id)
+    version = cache.get(key)
+    if version is None:
+        # First use, or evicted: start a fresh version so nothing cached under
+        # an older one can be served.
+        now = time.time_ns()
+        version = now if cache.add(key, now, None) else cache.get(key, now)
+    return version
+
+
+def touch_uploads(user_ids):
+    """Bump the version of every user in ``user_ids`` once the transaction commits."""
+    user_ids = {pk for pk in user_ids if pk}
+    if user_ids:
+        transaction.on_commit(
+            lambda: cache.set_many({_version_key(pk): time.time_ns() for pk in user_ids}, None)
+        )
+
+
+def _page_state(request):
+    if not hasattr(request, '_page_state'):
+        # The page's forms carry CSRF tokens, so the fragment has to be keyed
+        # by the secret they are derived from; get_token() creates it if needed.
+        get_token(request)
+        version = uploads_version(request.user.pk)
+        parts = [
+            request.user.pk, version, request.get_full_path(),
+            request.user.first_name, request.META['CSRF_COOKIE'],
+        ]
+        request._page_state = hashlib.sha256(repr(parts).encode()).hexdigest(), version
+    return request._page_state
+
+
+def page_key(request):
+    """Digest of everything a patient page depends on, for fragment keys and the ETag."""
+    return _page_state(request)[0]
+
+
+def _nav_key(request):
+    # The navbars greet the user by name and carry a CSRF-protected logout form.
+    get_token(request)
+    parts = [request.user.pk, request.user.first_name, request.META['CSRF_COOKIE']]
+    return hashlib.sha256(repr(parts).encode()).hexdigest()
+
+
+def fragments(request):
+    """Context processor for the navbar and footer ``{% cache %}`` blocks on every page."""
+    return {
+        'fragment_timeout': settings.FRAGMENT_CACHE_SECONDS,
+        'nav_key': SimpleLazyObject(lambda: _nav_key(request)),
+    }
+
+
+def fragment_context(request):
+    """Template context for the ``{% cache %}`` blocks of the patient pages."""
+    return {'page_key': page_key(request), 'fragment_timeout': settings.FRAGMENT_CACHE_SECONDS}
+
+
+def conditional_page(view):
+    """Send ETag/Last-Modified for a patient page and answer revalidations with 304.
+
+    Skipped while flash messages are pending, as those are shown only once.
+    Wraps sync and async views.
+    """
+    def validators(request):
+        if len(get_messages(request)):
+            return None, None
+        key, version = _page_state(request)
+        return f'"{key}"', version // 10**9
+
+    def finish(request, response, etag, last_modified):
+        # Always revalidate; the browser's copy is then reused through a 304.
+        patch_cache_control(response, private=True, no_cache=True)
+        if etag and response.status_code in (200, 304):
+            response.headers.setdefault('ETag', etag)
+            response.headers.setdefault('Last-Modified', http_date(last_modified))
+        return response
+
+    if iscoroutinefunction(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            etag, last_modified = await sync_to_async(validators)(request)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = await view(request, *args, **kwargs)
+            return finish(request, response, etag, last_modified)
+    else:
+        @wraps(view)
+        def wrapper(request, *args, **kwargs):
+            etag, last_modified = validators(request)
+            response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+            if response is None:
+                response = view(request, *args, **kwargs)
+            return finish(request, response, etag, last_modified)
+    return wrapper
@@ -0,0 +1,114 @@
+import base64
+import json
+from datetime import datetime
+
+from django.conf import settings
+from django.db.models import Q
+
+
+class KeysetPage:
+    """One page of a newest-first list plus opaque cursors for its neighbours.
+
+    Iterates and tests truthy like the list it wraps, so templates can use it
+    in place of the queryset.
+    """
+
+    def __init__(self, items, next_cursor=None, previous_cursor=None):
+        self.items = items
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.items)
+
+    def __len__(self):
+        return len(self.items)
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    @property
+    def has_other_pages(self):
+        return self.has_next or self.has_previous
+
+
+def encode_cursor(value, pk):
+    raw = json.dumps([value.isoformat(), pk]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        value, pk = json.loads(raw)
+        return datetime.fromisoformat(value), int(pk)
+    except (TypeError, ValueError):
+        return None
+
+
+def _seek(field, op, value, pk):
+    """Rows past ``(value, pk)`` in ``op`` ('lt' or 'gt') order.
+
+    The redundant ``field <= value`` (or ``>=``) outside the OR is what lets
+    the database seek into the ``(..., field)`` index instead of filtering
+    every row on one side of the cursor.
+    """
+    bound = Q(**{f'{field}__{op}e': value})
+    return bound & (Q(**{f'{field}__{op}': value}) | Q(**{field: value, f'id__{op}': pk}))
+
+
+def _page_query(request, queryset, field, page_size):
+    """The bounded queryset for the requested page and how to turn it into one."""
+    page_size = page_size or settings.HISTORY_PAGE_SIZE
+    after = decode_cursor(request.GET.get('after', ''))
+    before = None if after else decode_cursor(request.GET.get('before', ''))
+
+    if before:
+        value, pk = before
+        rows = (
+            queryset.filter(_seek(field, 'gt', value, pk))
+            .order_by(field, 'id')[:page_size + 1]
+        )
+    else:
+        if after:
+            value, pk = after
+            queryset = queryset.filter(_seek(field, 'lt', value, pk))
+        rows = queryset.order_by(f'-{field}', '-id')[:page_size + 1]
+
+    def build(rows):
+        if before:
+            items = rows[:page_size][::-1]
+            has_newer, has_older = len(rows) > page_size, True
+        else:
+            items = rows[:page_size]
+            has_newer, has_older = bool(after), len(rows) > page_size
+        if not items:
+            return KeysetPage(items)
+
+        def cursor(obj):
+            return encode_cursor(getattr(obj, field), obj.pk)
+
+        return KeysetPage(
+            items,
+            next_cursor=cursor(items[-1]) if has_older else None,
+            previous_cursor=cursor(items[0]) if has_newer else None,
+        )
+
+    return rows, build
+
+
+def keyset_paginate(request, queryset, field, page_size=None):
+    """Newest-first page of ``queryset`` ordered by ``(field, id)``.
+
+    ``?after=<cursor>`` moves to older rows and ``?before=<cursor>`` back to
+    newer ones. Each page is a single indexed range scan with a LIMIT, so its
+    cost does not depend on how deep into the history it is. Invalid cursors
+    fall back to the first page.
+    """
+    rows, build = _page_query(request, queryset, field, page_size)
+    return build(list(rows))
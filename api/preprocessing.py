@@ -0,0 +1,96 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+INPUT_SIZE = 224
+MEAN = 0.4815
+STD = 0.2235
+CLAHE_CLIP_LIMIT = 2.0
+CLAHE_TILE_GRID = (8, 8)
+
+# Normalisation folded into a single multiply-add: (x / 255 - mean) / std.
+_SCALE = np.float32(1.0 / (255.0 * STD))
+_OFFSET = np.float32(MEAN / STD)
+
+
+class ImageDecodeError(ValueError):
+    pass
+
+
+def decode_gray(source):
+    """Decode an image straight to a single-channel ``uint8`` array.
+
+    ``source`` may be a filesystem path, raw encoded bytes (``bytes``,
+    ``bytearray``, ``memoryview``) or a binary file-like object.
+    """
+    if isinstance(source, (str, os.PathLike)):
+        img = cv2.imread(os.fspath(source), cv2.IMREAD_GRAYSCALE)
+    else:
+        if hasattr(source, 'read'):
+            source = source.read()
+        img = cv2.imdecode(np.frombuffer(source, dtype=np.uint8), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        name = os.fspath(source) if isinstance(source, (str, os.PathLike)) else 'buffer'
+        raise ImageDecodeError(f"Could not decode image: {name}")
+    return img
+
+
+def preprocess_batch(sources, size=INPUT_SIZE, errors=None, timings=None):
+    """Preprocess ``sources`` into one ``N x 3 x size x size`` float32 array.
+
+    Each image is decoded directly to grayscale, CLAHE-equalised once and
+    resized into a shared ``uint8`` staging buffer; normalisation and the
+    grayscale-to-3-channel expansion are then done for the whole batch with
+    NumPy broadcasting into a single preallocated output array.
+
+    If ``errors`` is a dict, images that fail to decode are recorded there as
+    ``{index: message}`` and left out of the batch; otherwise the first failure
+    raises ``ImageDecodeError``. If ``timings`` is a dict, it receives
+    ``{index: {'decode_ms': ..., 'preprocess_ms': ...}}`` for every image, with
+    the batch normalisation cost shared evenly between them.
+    """
+    clahe = cv2.createCLAHE(clipLimit=CLAHE_CLIP_LIMIT, tileGridSize=CLAHE_TILE_GRID)
+    staging = np.empty((len(sources), size, size), dtype=np.uint8)
+    count = 0
+    for index, source in enumerate(sources):
+        started = time.perf_counter()
+        try:
+            gray = decode_gray(source)
+            decoded = time.perf_counter()
+            staging[count] = cv2.resize(clahe.apply(gray), (size, size), interpolation=cv2.INTER_LINEAR)
+        except (ImageDecodeError, cv2.error) as e:
+            if errors is None:
+                raise ImageDecodeError(str(e)) from e
+            errors[index] = str(e)
+            continue
+        if timings is not None:
+            timings[index] = {
+                'decode_ms': (decoded - started) * 1000.0,
+                'preprocess_ms': (time.perf_counter() - decoded) * 1000.0,
+            }
+        count += 1
+
+    started = time.perf_counter()
+    batch = normalize_batch(staging[:count])
+    if timings and count:
+        shared_ms = (time.perf_counter() - started) * 1000.0 / count
+        for timing in timings.values():
+            timing['preprocess_ms'] += shared_ms
+    return batch
+
+
+def normalize_batch(staging, out=None):
+    """Normalise ``N x H x W`` uint8 images into ``N x 3 x H x W`` float32.
+
+    The first channel is computed with one broadcast multiply-subtract over the
+    whole batch and copied into the other two.
+    """
+    count, height, width = staging.shape
+    if out is None:
+        out = np.empty((count, 3, height, width), dtype=np.float32)
+    np.multiply(staging, _SCALE, out=out[:, 0], casting='unsafe')
+    np.subtract(out[:, 0], _OFFSET, out=out[:, 0])
+    out[:, 1:] = out[:, :1]
+    return out
@@ -1,13 +1,64 @@
+from django.conf import settings
+from django.urls import reverse
 from rest_framework import serializers
-from .models import ImageUpload
+from .models import ImageUpload, Prediction
 
 class ImageUploadSerializer(serializers.ModelSerializer):
     class Meta:
         model = ImageUpload
         fields = ['image', 'user']
 
-class ImageRepredictSerializer(serializers.Serializer):
-    id = serializers.IntegerField()
+class BatchUploadSerializer(serializers.Serializer):
+    images = serializers.ListField(child=serializers.ImageField(), allow_empty=False)
+
+    def validate_images(self, images):
+        if len(images) > settings.API_MAX_BATCH_SIZE:
+            raise serializers.ValidationError(f"At most {settings.API_MAX_BATCH_SIZE} images per request.")
+        return images
+
+class ImageIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False)
+
+    def validate_ids(self, ids):
+        if len(ids) > settings.API_MAX_BATCH_SIZE:
+            raise serializers.ValidationError(f"At most {settings.API_MAX_BATCH_SIZE} ids per request.")
+        return list(dict.fromkeys(ids))
+
+class ImageRepredictSerializer(ImageIdsSerializer):
+    pass
+
+class ImageStatusSerializer(ImageIdsSerializer):
+    pass
 
 class SearchUserSerializer(serializers.Serializer):
     user = serializers.CharField(max_length=100)
+
+class PredictionSerializer(serializers.ModelSerializer):
+    probabilities = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Prediction
+        fields = ['status', 'label', 'confidence', 'probabilities', 'model_version', 'cached', 'error',
+                  'decode_ms', 'preprocess_ms', 'inference_ms', 'created_at']
+
+    def get_probabilities(self, obj):
+        return {name: float(probability) for name, probability in obj.class_probabilities}
+
+class UploadResultSerializer(serializers.ModelSerializer):
+    """An upload with its latest prediction, attached by the view as ``latest_prediction``."""
+    image = serializers.SerializerMethodField()
+    prediction = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ImageUpload
+        fields = ['id', 'image', 'uploaded_at', 'prediction_status', 'disease_predict', 'prediction']
+
+    def get_image(self, obj):
+        # Scans are served through the permission-checked view, not MEDIA_URL.
+        url = reverse('image_file', args=[obj.pk])
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+    def get_prediction(self, obj):
+        prediction = getattr(obj, 'latest_prediction', None)
+        return PredictionSerializer(prediction).data if prediction else None
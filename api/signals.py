@@ -0,0 +1,21 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import ImageUpload, Prediction, RecommendationRequest
+from .page_cache import touch_uploads
+
+
+@receiver([post_save, post_delete], sender=ImageUpload)
+def upload_changed(sender, instance, **kwargs):
+    touch_uploads([instance.user_id])
+
+
+@receiver(post_save, sender=Prediction)
+def prediction_saved(sender, instance, **kwargs):
+    # Predictions are only deleted along with their upload, which bumps the version itself.
+    touch_uploads([instance.image.user_id])
+
+
+@receiver([post_save, post_delete], sender=RecommendationRequest)
+def recommendation_changed(sender, instance, **kwargs):
+    touch_uploads([instance.patient_id])
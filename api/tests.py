@@ -1,3 +1,1413 @@
-from django.test import TestCase
+import asyncio
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import cv2
+import numpy as np
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.cache.utils import make_template_fragment_key
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import CommandError, call_command
+from django.db import connection, connections, transaction
+from django.http import Http404
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import include, path, reverse
+from django.utils import timezone
+
+from accounts.models import DoctorProfile, PatientProfile
+from neuro.db import sqlite_config
+from neuro.serving import parse_range, serve_static
+
+from . import admission, async_views, inference, inference_server
+from . import jobs as jobs_module
+from . import thumbnails
+from .backends import InferenceBackend, OnnxRuntimeBackend, TorchScriptBackend, get_backend_class, softmax
+from .batching import MicroBatcher
+from .cache import prediction_cache
+from .assignment import assign_doctor, close_requests, mark_reviewed, open_request, release_open_requests
+from .cleanup import delete_uploads, sweep_deleted_files
+from .inference_server import InferenceClient, InferenceServer
+from .jobs import claim_jobs, enqueue_prediction, requeue_stale_jobs, run_jobs
+from .models import ImageUpload, Prediction, PredictionJob, RecommendationRequest
+from .pagination import _page_query, encode_cursor, keyset_paginate
+from .optimization import quantize_dynamic_int8, quantize_static_int8, to_torchscript
+from .preprocessing import INPUT_SIZE, preprocess_batch
+from .thumbnails import get_thumbnail
+from .uploads import sniff_image_type
+
+try:
+    import torch
+except ImportError:
+    torch = None
+
+try:
+    import onnx
+except ImportError:
+    onnx = None
+
+
+def legacy_preprocess(image_path):
+    """The original per-image pipeline from ``predict_disease``."""
+    import albumentations as A
+
+    img = cv2.imread(image_path)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    gray = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(gray)
+    img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
+    transform = A.Compose([
+        A.Resize(224, 224),
+        A.Normalize(mean=[0.4815, 0.4815, 0.4815], std=[0.2235, 0.2235, 0.2235]),
+    ])
+    return transform(image=img)['image'].transpose(2, 0, 1)
+
+
+def synthetic_mri(height, width, seed=0):
+    rng = np.random.default_rng(seed)
+    yy, xx = np.mgrid[:height, :width]
+    img = 128 + 100 * np.sin(xx / 17.0) * np.cos(yy / 23.0) + rng.normal(0, 10, (height, width))
+    return img.clip(0, 255).astype(np.uint8)
+
+
+class PreprocessingParityTests(SimpleTestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmpdir)
+
+    def write(self, name, img):
+        path = os.path.join(self.tmpdir, name)
+        cv2.imwrite(path, img)
+        return path
+
+    def test_grayscale_scans_match_legacy_pipeline(self):
+        paths = [
+            self.write('a.png', synthetic_mri(300, 260, seed=1)),
+            self.write('b.jpg', synthetic_mri(512, 512, seed=2)),
+            self.write('c.png', cv2.cvtColor(synthetic_mri(180, 200, seed=3), cv2.COLOR_GRAY2BGR)),
+        ]
+        batch = preprocess_batch(paths)
+        self.assertEqual(batch.shape, (3, 3, INPUT_SIZE, INPUT_SIZE))
+        self.assertEqual(batch.dtype, np.float32)
+        for i, path in enumerate(paths):
+            np.testing.assert_allclose(batch[i], legacy_preprocess(path), atol=1e-5)
+
+    def test_colour_image_within_tolerance(self):
+        # libpng's RGB->gray conversion rounds slightly differently from
+        # cv2.cvtColor, so true-colour inputs are only close, not identical.
+        gray = synthetic_mri(180, 200, seed=4)
+        path = self.write('colour.png', np.dstack([gray, (gray * 0.9).astype(np.uint8), gray]))
+        diff = np.abs(preprocess_batch([path])[0] - legacy_preprocess(path))
+        self.assertLess(diff.mean(), 0.02)
+        self.assertLess(diff.max(), 0.1)
+
+    def test_bytes_and_paths_are_equivalent(self):
+        path = self.write('a.png', synthetic_mri(240, 240))
+        with open(path, 'rb') as f:
+            data = f.read()
+        batch = preprocess_batch([path, data, memoryview(data)])
+        np.testing.assert_array_equal(batch[0], batch[1])
+        np.testing.assert_array_equal(batch[0], batch[2])
+
+    def test_undecodable_images_are_reported(self):
+        path = self.write('a.png', synthetic_mri(64, 64))
+        errors = {}
+        batch = preprocess_batch([b'not an image', path], errors=errors)
+        self.assertEqual(len(batch), 1)
+        self.assertEqual(list(errors), [0])
+
+
+def small_quantizable_model():
+    from torch import nn
+    from torch.ao.quantization import DeQuantStub, QuantStub, fuse_modules
+
+    class Small(nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.quant = QuantStub()
+            self.conv = nn.Conv2d(3, 8, 3, padding=1)
+            self.bn = nn.BatchNorm2d(8)
+            self.relu = nn.ReLU()
+            self.pool = nn.AdaptiveAvgPool2d(1)
+            self.fc = nn.Linear(8, 4)
+            self.dequant = DeQuantStub()
+
+        def forward(self, x):
+            x = self.pool(self.relu(self.bn(self.conv(self.quant(x)))))
+            return self.dequant(self.fc(torch.flatten(x, 1)))
+
+        def fuse_model(self):
+            fuse_modules(self, [['conv', 'bn', 'relu']], inplace=True)
+
+    torch.manual_seed(0)
+    return Small().eval()
+
+
+@unittest.skipUnless(torch, "requires torch")
+class QuantizationParityTests(SimpleTestCase):
+    """The int8 conversions keep a model's outputs and survive a TorchScript round trip."""
+
+    def setUp(self):
+        self.model = small_quantizable_model()
+        self.inputs = torch.rand(16, 3, 32, 32)
+        with torch.no_grad():
+            self.reference = torch.softmax(self.model(self.inputs), dim=1)
+
+    def assertParity(self, quantized, tolerance):
+        scripted = to_torchscript(quantized, self.inputs[:1])
+        with torch.no_grad():
+            probabilities = torch.softmax(scripted(self.inputs), dim=1)
+        self.assertLess(float((probabilities - self.reference).abs().max()), tolerance)
+
+    def test_dynamic(self):
+        self.assertParity(quantize_dynamic_int8(self.model), 0.02)
+
+    def test_static(self):
+        quantized = quantize_static_int8(self.model, lambda prepared: prepared(self.inputs))
+        self.assertParity(quantized, 0.05)
+        # The fp32 model handed in is left untouched.
+        self.assertIsInstance(self.model.conv, torch.nn.Conv2d)
+
+
+class MicroBatcherTests(SimpleTestCase):
+    """Concurrent submissions share a run, each caller gets its own result."""
+
+    def submit_concurrently(self, batcher, items, timeout=5):
+        results, errors = {}, {}
+
+        def submit(item):
+            try:
+                results[item] = batcher.submit(item, timeout)
+            except Exception as e:
+                errors[item] = e
+
+        threads = [threading.Thread(target=submit, args=(item,)) for item in items]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results, errors
+
+    def test_concurrent_items_are_grouped_and_answered_in_order(self):
+        sizes = []
+
+        def run_batch(items):
+            sizes.append(len(items))
+            return [item * 2 for item in items]
+
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=200)
+        results, errors = self.submit_concurrently(batcher, range(8))
+        self.assertEqual(errors, {})
+        self.assertEqual(results, {item: item * 2 for item in range(8)})
+        self.assertLess(len(sizes), 8)
+        self.assertLessEqual(max(sizes), 4)
+        self.assertEqual(batcher.stats()['items'], 8)
+
+    def test_failure_reaches_every_caller_in_the_batch(self):
+        def run_batch(items):
+            raise ValueError('model exploded')
+
+        batcher = MicroBatcher(run_batch, max_batch_size=4, max_wait_ms=50)
+        results, errors = self.submit_concurrently(batcher, range(3))
+        self.assertEqual(results, {})
+        self.assertEqual({str(e) for e in errors.values()}, {'model exploded'})
+        self.assertGreaterEqual(batcher.stats()['errors'], 1)
+
+    def test_submit_times_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        def run_batch(items):
+            release.wait(5)
+            return items
+
+        batcher = MicroBatcher(run_batch, max_batch_size=1, max_wait_ms=0)
+        with self.assertRaises(FutureTimeoutError):
+            batcher.submit('slow', timeout=0.05)
+
+
+class BenchmarkCommandTests(SimpleTestCase):
+    """``manage.py benchmark_inference`` reports every case and flags regressions."""
+
+    def benchmark(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('benchmark_inference', '--no-model', '--resolutions=64', '--batch-sizes=1,2',
+                     '--threads=1', '--repeat=2', '--warmup=0', *args, stdout=out, stderr=err)
+        return json.loads(out.getvalue())
+
+    def test_report_covers_every_case_and_stage(self):
+        report = self.benchmark()
+        self.assertEqual([(case['batch_size'], case['threads']) for case in report['cases']], [(1, 1), (2, 1)])
+        for case in report['cases']:
+            self.assertEqual(set(case['stages']), {'decode', 'clahe', 'transform', 'total'})
+            self.assertGreater(case['stages']['total']['p50_ms'], 0)
+        self.assertIsNone(report['meta']['model'])
+
+    def test_slower_than_baseline_fails(self):
+        baseline = self.benchmark()
+        for case in baseline['cases']:
+            for stage in case['stages'].values():
+                stage['p50_ms'] /= 1000.0
+        path = os.path.join(tempfile.mkdtemp(), 'baseline.json')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        with open(path, 'w') as f:
+            json.dump(baseline, f)
+        with self.assertRaisesMessage(CommandError, 'Performance regressions'):
+            self.benchmark(f'--baseline={path}')
+        self.assertEqual(self.benchmark(f'--baseline={path}', '--threshold=1e9')['meta']['cpu_count'], os.cpu_count())
+
+
+def tiny_onnx_model(path):
+    """Global-average-pool + linear classifier with the production input and output shapes."""
+    from onnx import TensorProto, helper, numpy_helper
+
+    weight = np.arange(12, dtype=np.float32).reshape(3, 4) / 10.0
+    graph = helper.make_graph(
+        [
+            helper.make_node('GlobalAveragePool', ['input'], ['pooled']),
+            helper.make_node('Flatten', ['pooled'], ['features']),
+            helper.make_node('MatMul', ['features', 'weight'], ['logits']),
+        ],
+        'tiny',
+        [helper.make_tensor_value_info('input', TensorProto.FLOAT, ['N', 3, INPUT_SIZE, INPUT_SIZE])],
+        [helper.make_tensor_value_info('logits', TensorProto.FLOAT, ['N', 4])],
+        [numpy_helper.from_array(weight, 'weight')],
+    )
+    model = helper.make_model(graph, opset_imports=[helper.make_opsetid('', 13)])
+    model.ir_version = 8
+    onnx.save(model, path)
+    return weight
+
+
+class ModelRegistryTests(SimpleTestCase):
+    """The model is loaded once per process, warmed up before use and reloaded when it changes."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        model_path = os.path.join(directory, 'model.bin')
+        open(model_path, 'wb').close()
+        self.model_path = model_path
+        self.loaded, self.warmups = [], []
+        self.registry = registry = inference.ModelRegistry()
+        test = self
+
+        class FakeBackend(InferenceBackend):
+            name = 'fake'
+
+            @classmethod
+            def default_model_path(cls):
+                return model_path
+
+            def load(self):
+                time.sleep(0.05)  # give concurrent callers time to pile up
+                test.loaded.append(self)
+
+            def warmup(self, runs):
+                test.warmups.append((self, runs, registry._backend is self))
+
+            def run(self, batch):
+                return np.zeros((len(batch), 4), dtype=np.float32)
+
+        self.enterContext(mock.patch.object(inference, 'get_backend_class', return_value=FakeBackend))
+        self.enterContext(override_settings(INFERENCE_WARMUP_RUNS=2, INFERENCE_AUTO_RELOAD=True, INFERENCE_RELOAD_CHECK_SECONDS=60))
+
+    def test_concurrent_first_callers_share_one_load(self):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            backends = list(pool.map(lambda _: self.registry.get(), range(8)))
+        self.assertEqual(len(self.loaded), 1)
+        self.assertEqual({id(backend) for backend in backends}, {id(self.loaded[0])})
+
+    def test_backend_is_published_only_after_warmup(self):
+        backend = self.registry.get()
+        self.assertEqual(self.warmups, [(backend, 2, False)])
+
+    def test_changed_model_file_is_reloaded(self):
+        first = self.registry.get()
+        mtime = os.path.getmtime(self.model_path) + 10
+        os.utime(self.model_path, (mtime, mtime))
+        # The file is not checked again within INFERENCE_RELOAD_CHECK_SECONDS.
+        self.assertIs(self.registry.get(), first)
+        with override_settings(INFERENCE_RELOAD_CHECK_SECONDS=0):
+            second = self.registry.get()
+            self.assertIsNot(second, first)
+            self.assertIs(self.registry.get(), second)
+        self.assertEqual(len(self.loaded), 2)
+        self.assertEqual([warmup[2] for warmup in self.warmups], [False, False])
+
+
+class InferenceBackendTests(SimpleTestCase):
+    """``INFERENCE_BACKEND`` selects the runtime the registry loads."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.onnx_path = os.path.join(directory, 'model.onnx')
+
+    def test_backend_lookup(self):
+        self.assertIs(get_backend_class('onnx'), OnnxRuntimeBackend)
+        self.assertIs(get_backend_class('torchscript'), TorchScriptBackend)
+        with override_settings(INFERENCE_BACKEND='onnx'):
+            self.assertIs(get_backend_class(), OnnxRuntimeBackend)
+        with self.assertRaisesMessage(ValueError, "Unknown inference backend 'tflite'"):
+            get_backend_class('tflite')
+
+    def test_softmax_rows_are_probabilities(self):
+        logits = np.array([[1000.0, 0.0, -1000.0, 5.0], [0.0, 0.0, 0.0, 0.0]], dtype=np.float32)
+        probabilities = softmax(logits)
+        np.testing.assert_allclose(probabilities.sum(axis=1), 1.0, rtol=1e-6)
+        self.assertEqual(probabilities[0].argmax(), 0)
+        np.testing.assert_allclose(probabilities[1], 0.25)
+
+    def test_missing_onnx_model(self):
+        with self.assertRaisesMessage(FileNotFoundError, 'export_onnx'):
+            OnnxRuntimeBackend(self.onnx_path).load()
+
+    @unittest.skipUnless(onnx, "building the test model needs the onnx package")
+    def test_registry_runs_the_onnx_backend(self):
+        weight = tiny_onnx_model(self.onnx_path)
+        batch = np.random.default_rng(0).random((2, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32)
+        with override_settings(INFERENCE_BACKEND='onnx', INFERENCE_ONNX_PATH=self.onnx_path,
+                               INFERENCE_ONNX_THREADS=1, INFERENCE_WARMUP_RUNS=1):
+            registry = inference.ModelRegistry()
+            logits = registry.run(batch)
+            self.assertEqual(registry.get().describe(), {'backend': 'onnx', 'model_path': self.onnx_path})
+        np.testing.assert_allclose(logits, batch.mean(axis=(2, 3)) @ weight, rtol=1e-4)
+
+
+class DoctorViewQueryCountTests(TestCase):
+    """Doctor pages run a fixed number of queries however many requests exist."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor_user = User.objects.create_user('doctor', password='x')
+        cls.doctor = DoctorProfile.objects.create(user=cls.doctor_user)
+        cls.patient = User.objects.create_user('patient', password='x', first_name='Pat', last_name='Ient')
+
+    def setUp(self):
+        self.client.force_login(self.doctor_user)
+
+    def add_requests(self, count, reviewed=False):
+        for i in range(count):
+            image = ImageUpload.objects.create(
+                user=self.patient, image=f'uploads/{i}.png', disease_predict='glioma', doctor_comment='ok'
+            )
+            RecommendationRequest.objects.create(
+                image=image, patient=self.patient, doctor=self.doctor, message='Please review', is_reviewed=reviewed
+            )
+        return RecommendationRequest.objects.latest('id')
+
+    def count_queries(self, method, url, data=None):
+        with CaptureQueriesContext(connection) as queries:
+            response = getattr(self.client, method)(url, data)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assertConstantQueries(self, method, url_for, expected, data=None):
+        self.add_requests(1)
+        small = self.count_queries(method, url_for(), data)
+        self.add_requests(15)
+        large = self.count_queries(method, url_for(), data)
+        self.assertEqual(small, large)
+        self.assertEqual(large, expected)
+
+    def test_recommendation_history(self):
+        self.assertConstantQueries('get', lambda: reverse('recommendation_history'), 3)
+
+    def test_doctor_dashboard(self):
+        self.assertConstantQueries('get', lambda: reverse('doctor_dashboard'), 4)
+
+    def test_respond_request(self):
+        url = lambda: reverse('respond_request', args=[RecommendationRequest.objects.latest('id').id])
+        self.assertConstantQueries('post', url, 9, {'doctor_comment': 'Follow up in 3 months'})
+
+    def test_edit_recommendation(self):
+        url = lambda: reverse('edit_recommendation', args=[RecommendationRequest.objects.latest('id').id])
+        self.assertConstantQueries('post', url, 9, {'comments': 'Updated'})
+
+    def test_delete_recommendation(self):
+        url = lambda: reverse('delete_recommendation', args=[RecommendationRequest.objects.latest('id').id])
+        self.assertConstantQueries('post', url, 8)
+
+    def test_listing_does_not_touch_related_rows_lazily(self):
+        self.add_requests(3)
+        response = self.client.get(reverse('recommendation_history'))
+        with self.assertNumQueries(0):
+            for recommendation in response.context['recommendations']:
+                recommendation.patient.first_name
+                recommendation.image.disease_predict
+                recommendation.image.doctor_comment
+
+
+@override_settings(DOCTOR_MAX_OPEN_REQUESTS=2)
+class DoctorAssignmentTests(TestCase):
+    """Doctors' open request counters drive assignment and stay in step with the requests."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.own = DoctorProfile.objects.create(user=User.objects.create_user('own', password='x'))
+        cls.busy = DoctorProfile.objects.create(user=User.objects.create_user('busy', password='x'), open_requests=5)
+        cls.idle = DoctorProfile.objects.create(user=User.objects.create_user('idle', password='x'), open_requests=1)
+        cls.patient = User.objects.create_user('patient', password='x')
+        PatientProfile.objects.create(user=cls.patient, doctor=cls.own)
+
+    def request_for(self, doctor):
+        image = ImageUpload.objects.create(user=self.patient, image='uploads/scan.png')
+        recommendation = RecommendationRequest.objects.create(image=image, patient=self.patient, doctor=doctor)
+        open_request(doctor.pk)
+        return recommendation
+
+    def counters(self):
+        return dict(DoctorProfile.objects.values_list('user__username', 'open_requests'))
+
+    def test_own_doctor_until_full_then_least_loaded(self):
+        self.assertEqual(assign_doctor(self.patient), self.own)
+        self.request_for(self.own)
+        self.request_for(self.own)
+        self.assertEqual(assign_doctor(self.patient), self.idle)
+        newcomer = User.objects.create_user('new', password='x')
+        with self.assertNumQueries(2):
+            self.assertEqual(assign_doctor(newcomer), self.idle)
+
+    def test_reviewing_releases_the_slot_once(self):
+        recommendation = self.request_for(self.own)
+        self.assertEqual(self.counters()['own'], 1)
+        self.assertTrue(mark_reviewed(recommendation))
+        self.assertFalse(mark_reviewed(recommendation))
+        self.assertEqual(self.counters()['own'], 0)
+
+    def test_deleting_releases_only_unreviewed_requests(self):
+        mark_reviewed(self.request_for(self.own))
+        self.request_for(self.own)
+        self.request_for(self.idle)
+        queryset = RecommendationRequest.objects.all()
+        release_open_requests(queryset)
+        queryset.delete()
+        self.assertEqual(self.counters(), {'own': 0, 'busy': 5, 'idle': 1})
+
+    def test_counters_never_go_negative(self):
+        close_requests(self.own.pk, 3)
+        self.assertEqual(self.counters()['own'], 0)
+
+    def test_recount_fixes_drift(self):
+        self.request_for(self.own)
+        out = io.StringIO()
+        call_command('recount_open_requests', stdout=out)
+        self.assertIn('Corrected 2', out.getvalue())
+        self.assertEqual(self.counters(), {'own': 1, 'busy': 0, 'idle': 0})
+
+
+class KeysetPaginationTests(TestCase):
+    """History pages seek on the (user, uploaded_at) index, however deep the cursor."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+        start = timezone.now()
+        for i in range(12):
+            image = ImageUpload.objects.create(user=cls.user, image=f'uploads/{i}.png')
+            # Pairs share a timestamp, so the id tiebreak is exercised too.
+            ImageUpload.objects.filter(pk=image.pk).update(uploaded_at=start + timedelta(minutes=i // 2))
+        cls.newest_first = list(
+            ImageUpload.objects.filter(user=cls.user).order_by('-uploaded_at', '-id').values_list('pk', flat=True)
+        )
+
+    def page(self, **params):
+        request = RequestFactory().get('/', params)
+        return keyset_paginate(request, ImageUpload.objects.filter(user=self.user), 'uploaded_at', page_size=5)
+
+    def test_walks_every_row_once_in_both_directions(self):
+        pages = [self.page()]
+        while pages[-1].has_next:
+            pages.append(self.page(after=pages[-1].next_cursor))
+        self.assertEqual([image.pk for page in pages for image in page], self.newest_first)
+        back = self.page(before=pages[-1].previous_cursor)
+        self.assertEqual([image.pk for image in back], [image.pk for image in pages[-2]])
+
+    @unittest.skipUnless(connection.vendor == 'sqlite', "asserts SQLite's EXPLAIN QUERY PLAN output")
+    def test_deep_cursor_seeks_on_the_index(self):
+        deep = ImageUpload.objects.get(pk=self.newest_first[-3])
+        cursor = encode_cursor(deep.uploaded_at, deep.pk)
+        for param, bound in (('after', 'uploaded_at<'), ('before', 'uploaded_at>')):
+            request = RequestFactory().get('/', {param: cursor})
+            rows, _ = _page_query(request, ImageUpload.objects.filter(user=self.user), 'uploaded_at', 5)
+            plan = rows.explain()
+            self.assertIn('USING INDEX', plan)
+            self.assertIn(bound, plan.replace(' ', ''))
+
+
+def ok_result(label='glioma'):
+    probabilities = np.zeros(4, dtype=np.float32)
+    probabilities[inference.CLASS_NAMES.index(label)] = 1.0
+    return inference.PredictionResult(label=label, probabilities=probabilities)
+
+
+@override_settings(INFERENCE_MODEL_VERSION='test')
+class PredictionJobTests(TestCase):
+    """The queue worker's claim, retry and failure bookkeeping."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        prediction_cache.memory.clear()
+        self.image = ImageUpload.objects.create(user=self.user, image='uploads/scan.png', content_hash='a' * 64)
+        enqueue_prediction(self.image)
+
+    def run_claimed(self, *results, max_attempts=3):
+        jobs = claim_jobs('worker-1', 10)
+        with mock.patch.object(jobs_module, 'predict_batch', return_value=list(results)):
+            return run_jobs(jobs, max_attempts=max_attempts)
+
+    def test_success_is_recorded(self):
+        self.assertEqual(self.run_claimed(ok_result('pituitary')), (1, 0))
+        self.image.refresh_from_db()
+        self.assertEqual((self.image.prediction_status, self.image.disease_predict), ('done', 'pituitary'))
+        self.assertEqual(PredictionJob.objects.get().status, 'done')
+        self.assertEqual(prediction_cache.get('a' * 64, 'test')[0], 'pituitary')
+
+    def test_errors_are_retried_until_max_attempts(self):
+        error = inference.PredictionResult(error='unreadable')
+        self.assertEqual(self.run_claimed(error, max_attempts=2), (0, 0))
+        job = PredictionJob.objects.get()
+        self.assertEqual((job.status, job.attempts, job.error), ('pending', 1, 'unreadable'))
+
+        self.assertEqual(self.run_claimed(error, max_attempts=2), (0, 1))
+        job.refresh_from_db()
+        self.image.refresh_from_db()
+        self.assertEqual((job.status, job.attempts), ('failed', 2))
+        self.assertEqual(self.image.prediction_status, 'failed')
+        self.assertEqual(Prediction.objects.filter(image=self.image, status='error').count(), 2)
+
+    def test_upload_deleted_while_running_is_skipped(self):
+        jobs = claim_jobs('worker-1', 10)
+        delete_uploads(ImageUpload.objects.filter(pk=self.image.pk))
+        with mock.patch.object(jobs_module, 'predict_batch', return_value=[ok_result()]):
+            self.assertEqual(run_jobs(jobs), (0, 0))
+        self.assertFalse(Prediction.objects.exists())
+
+    def test_a_job_that_cannot_be_recorded_fails_alone(self):
+        other = ImageUpload.objects.create(user=self.user, image='uploads/other.png')
+        enqueue_prediction(other)
+        broken = Prediction.from_result
+
+        def from_result(image, *args, **kwargs):
+            if image.pk == self.image.pk:
+                raise ValueError('boom')
+            return broken(image, *args, **kwargs)
+        with mock.patch.object(Prediction, 'from_result', side_effect=from_result), self.assertLogs('api.jobs', 'ERROR'):
+            self.assertEqual(self.run_claimed(ok_result(), ok_result()), (1, 1))
+        self.assertEqual(PredictionJob.objects.get(image=self.image).status, 'failed')
+        self.assertEqual(PredictionJob.objects.get(image=other).status, 'done')
+
+    def test_stale_jobs_are_requeued_until_attempts_run_out(self):
+        claim_jobs('crashed', 10)
+        PredictionJob.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(60, max_attempts=2), 1)
+        self.assertEqual(PredictionJob.objects.get().status, 'pending')
+
+        claim_jobs('crashed', 10)
+        PredictionJob.objects.update(claimed_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(requeue_stale_jobs(60, max_attempts=2), 0)
+        self.assertEqual(PredictionJob.objects.get().status, 'failed')
+        self.image.refresh_from_db()
+        self.assertEqual(self.image.prediction_status, 'failed')
+
+
+def scan_upload(seed=0, name=None):
+    ok, encoded = cv2.imencode('.png', synthetic_mri(96, 96, seed=seed))
+    return SimpleUploadedFile(name or f'scan{seed}.png', encoded.tobytes(), content_type='image/png')
+
+
+@override_settings(INFERENCE_MODEL_VERSION='test', PREDICTION_QUEUE=False, THUMBNAIL_ON_UPLOAD=False)
+class InlinePredictionTests(TestCase):
+    """The upload view stores what the inline prediction returned, failures included."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        prediction_cache.memory.clear()
+        self.client.force_login(self.user)
+
+    def test_failed_prediction_is_recorded_but_not_cached(self):
+        failure = inference.PredictionResult(error='cannot decode image', decode_ms=1.5)
+        with mock.patch('api.views.predict_image', return_value=failure):
+            response = self.client.post(reverse('upload_image'), {'image': scan_upload(1)})
+        self.assertIn('the prediction failed', str(list(response.context['messages'])[0]))
+        image = ImageUpload.objects.get()
+        self.assertEqual((image.prediction_status, image.disease_predict), ('failed', None))
+        self.assertTrue(default_storage.exists(image.image.name))
+        prediction = Prediction.objects.get(image=image)
+        self.assertEqual((prediction.status, prediction.error, prediction.label), ('error', 'cannot decode image', None))
+        prediction_cache.memory.clear()
+        self.assertIsNone(prediction_cache.get(image.content_hash, 'test'))
+
+    def test_successful_prediction_is_recorded_and_cached(self):
+        with mock.patch('api.views.predict_image', return_value=ok_result('notumor')):
+            self.client.post(reverse('upload_image'), {'image': scan_upload(1)})
+        image = ImageUpload.objects.get()
+        self.assertEqual((image.prediction_status, image.disease_predict), ('done', 'notumor'))
+        self.assertEqual(Prediction.objects.get(image=image).status, 'ok')
+        self.assertEqual(prediction_cache.get(image.content_hash, 'test')[0], 'notumor')
+
+
+@override_settings(INFERENCE_MODEL_VERSION='test', PREDICTION_QUEUE=False, THUMBNAIL_ON_UPLOAD=False)
+class PredictionCacheTests(TestCase):
+    """Repeat uploads of the same bytes are answered from the cache, not the model."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        prediction_cache.memory.clear()
+
+    def test_duplicate_upload_skips_inference(self):
+        self.client.force_login(self.user)
+        with mock.patch('api.views.predict_image', return_value=ok_result('meningioma')) as predict:
+            self.client.post(reverse('upload_image'), {'image': scan_upload(1)})
+            prediction_cache.memory.clear()  # the second lookup has to come from the table
+            self.client.post(reverse('upload_image'), {'image': scan_upload(1, 'again.png')})
+        self.assertEqual(predict.call_count, 1)
+        first, second = ImageUpload.objects.order_by('pk')
+        self.assertEqual((first.disease_predict, second.disease_predict), ('meningioma', 'meningioma'))
+        self.assertEqual(first.image.name, second.image.name)
+        self.assertTrue(Prediction.objects.get(image=second).cached)
+
+    def test_storing_a_key_another_process_wrote_is_harmless(self):
+        prediction_cache.set('c' * 64, 'test', 'glioma', ok_result('glioma').probabilities)
+        # Another process stored it first; this process only missed it in memory.
+        prediction_cache.memory.clear()
+        prediction_cache.set('c' * 64, 'test', 'glioma', ok_result('glioma').probabilities)
+        self.assertEqual(prediction_cache.get('c' * 64, 'test')[0], 'glioma')
+
+
+@override_settings(INFERENCE_MODEL_VERSION='test', PREDICTION_QUEUE=False, THUMBNAIL_ON_UPLOAD=False)
+class BatchUploadAPITests(TestCase):
+    """``/api/uploads/`` classifies many scans with one batched forward pass."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+        cls.other = User.objects.create_user('other', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        prediction_cache.memory.clear()
+        token = self.client.post(reverse('api_token'), {'username': 'patient', 'password': 'x'}).json()['access']
+        self.auth = {'HTTP_AUTHORIZATION': f'Bearer {token}'}
+
+    def upload(self, *files, **extra):
+        return self.client.post(reverse('api_upload_batch'), {'images': list(files)}, **{**self.auth, **extra})
+
+    def test_scans_are_classified_in_one_batch(self):
+        with mock.patch('api.api_views.predict_batch', return_value=[ok_result('glioma'), ok_result('pituitary')]) as predict:
+            response = self.upload(scan_upload(1), scan_upload(2))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(predict.call_count, 1)
+        self.assertEqual(len(predict.call_args.args[0]), 2)
+        results = response.json()['results']
+        self.assertEqual([result['disease_predict'] for result in results], ['glioma', 'pituitary'])
+        self.assertEqual(results[1]['prediction']['probabilities']['pituitary'], 1.0)
+        self.assertEqual(ImageUpload.objects.filter(user=self.user, prediction_status='done').count(), 2)
+
+        # The same bytes again are answered from the cache.
+        with mock.patch('api.api_views.predict_batch') as predict:
+            response = self.upload(scan_upload(2, 'again.png'))
+        predict.assert_not_called()
+        self.assertEqual(response.json()['results'][0]['disease_predict'], 'pituitary')
+
+    def test_busy_analyzer_answers_503(self):
+        with mock.patch('api.api_views.predict_batch', side_effect=admission.InferenceBusy(retry_after=4)):
+            response = self.upload(scan_upload(1))
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '4')
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_requires_authentication(self):
+        response = self.client.post(reverse('api_upload_batch'), {'images': [scan_upload(1)]})
+        self.assertEqual(response.status_code, 401)
+
+    @override_settings(API_MAX_BATCH_SIZE=1)
+    def test_batch_size_is_capped(self):
+        response = self.upload(scan_upload(1), scan_upload(2))
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('images', response.json())
+
+    def test_repredict_and_status_only_see_own_uploads(self):
+        mine = ImageUpload.objects.create(user=self.user, image=default_storage.save('uploads/a.png', scan_upload(1)))
+        theirs = ImageUpload.objects.create(user=self.other, image='uploads/b.png')
+        with mock.patch('api.api_views.predict_batch', return_value=[ok_result('notumor')]):
+            response = self.client.post(
+                reverse('api_repredict'), {'ids': [mine.pk, theirs.pk]}, content_type='application/json', **self.auth
+            )
+        self.assertEqual(response.json()['not_found'], [theirs.pk])
+        self.assertEqual([result['disease_predict'] for result in response.json()['results']], ['notumor'])
+
+        response = self.client.get(reverse('api_prediction_status'), {'ids': f'{mine.pk},{theirs.pk}'}, **self.auth)
+        self.assertEqual(response.json()['results'][0]['prediction_status'], 'done')
+        self.assertEqual(response.json()['not_found'], [theirs.pk])
+
+
+@override_settings(PREDICTION_QUEUE=True, THUMBNAIL_ON_UPLOAD=False)
+class UploadHandlerTests(TestCase):
+    """Uploads are hashed and vetted while the body is read."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client.force_login(self.user)
+
+    def upload(self, uploaded_file):
+        return self.client.post(reverse('upload_image'), {'image': uploaded_file})
+
+    def errors(self, response):
+        return [str(message) for message in response.context['messages']]
+
+    def test_valid_scan_keeps_its_digest(self):
+        uploaded_file = scan_upload(1)
+        digest = hashlib.sha256(uploaded_file.read()).hexdigest()
+        uploaded_file.seek(0)
+        response = self.upload(uploaded_file)
+        image = ImageUpload.objects.get()
+        self.assertRedirects(response, reverse('result', args=[image.pk]), fetch_redirect_response=False)
+        self.assertEqual(image.content_hash, digest)
+
+    def test_rejects_files_that_are_not_images(self):
+        # The name and declared type say PNG; the bytes do not.
+        response = self.upload(SimpleUploadedFile('scan.png', b'%PDF-1.7 not a scan', content_type='image/png'))
+        self.assertIn('Unsupported file type', self.errors(response)[0])
+        self.assertFalse(ImageUpload.objects.exists())
+
+    @override_settings(UPLOAD_MAX_BYTES=100)
+    def test_rejects_files_over_the_size_limit(self):
+        response = self.upload(scan_upload(1))
+        self.assertIn('File too large. The limit is 100\xa0bytes.', self.errors(response))
+        self.assertFalse(ImageUpload.objects.exists())
+
+    def test_sniffs_the_image_type(self):
+        self.assertEqual(sniff_image_type(b'\xff\xd8\xff\xe0'), 'image/jpeg')
+        self.assertEqual(sniff_image_type(b'RIFF\x00\x00\x00\x00WEBPVP8 '), 'image/webp')
+        self.assertIsNone(sniff_image_type(b'GIF89a'))
+
+
+class MediaServingTests(TestCase):
+    """Scans are served with validators and ranges, and only to whoever may see them."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.owner = User.objects.create_user('patient', password='x')
+        cls.stranger = User.objects.create_user('stranger', password='x')
+        cls.doctor = DoctorProfile.objects.create(user=User.objects.create_user('doctor', password='x'))
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=self.media_root, SENDFILE_BACKEND=''))
+        self.data = bytes(range(256)) * 4
+        self.image = ImageUpload.objects.create(
+            user=self.owner, image=default_storage.save('uploads/scan.png', ContentFile(self.data)),
+        )
+        self.url = reverse('image_file', args=[self.image.pk])
+
+    def get(self, user, **headers):
+        self.client.force_login(user)
+        return self.client.get(self.url, headers=headers)
+
+    def test_only_the_owner_and_assigned_doctor_see_a_scan(self):
+        response = self.get(self.owner)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('private', response['Cache-Control'])
+
+        self.assertEqual(self.get(self.stranger).status_code, 404)
+        self.assertEqual(self.get(self.doctor.user).status_code, 404)
+        RecommendationRequest.objects.create(image=self.image, patient=self.owner, doctor=self.doctor)
+        self.assertEqual(self.get(self.doctor.user).status_code, 200)
+
+    def test_matching_etag_is_not_modified(self):
+        etag = self.get(self.owner)['ETag']
+        response = self.get(self.owner, if_none_match=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_byte_ranges(self):
+        response = self.get(self.owner, range='bytes=10-19')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 10-19/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[10:20])
+
+        response = self.get(self.owner, range='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), self.data[-5:])
+
+        response = self.get(self.owner, range=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+        # A range for an older version of the file gets the whole current one.
+        response = self.get(self.owner, range='bytes=10-19', if_range='"stale"')
+        self.assertEqual(response.status_code, 200)
+
+    def test_parse_range(self):
+        self.assertEqual(parse_range('bytes=0-', 100), (0, 99))
+        self.assertEqual(parse_range('bytes=90-200', 100), (90, 99))
+        self.assertEqual(parse_range('bytes=-200', 100), (0, 99))
+        self.assertIsNone(parse_range('bytes=0-1,5-6', 100))
+        self.assertIsNone(parse_range('bytes=5-1', 100))
+        self.assertIs(parse_range('bytes=-0', 100), False)
+
+    def test_nginx_sendfile_handoff(self):
+        with override_settings(SENDFILE_BACKEND='nginx', SENDFILE_ROOT=self.media_root, SENDFILE_URL='/protected-media/'):
+            response = self.get(self.owner)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/uploads/scan.png')
+        self.assertEqual(response.content, b'')
+
+    def test_static_files_prefer_precompressed_variants(self):
+        static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_root)
+        for name, content in (('app.0123456789ab.css', b'body{}'), ('app.0123456789ab.css.br', b'brotli'), ('plain.css', b'p{}')):
+            with open(os.path.join(static_root, name), 'wb') as f:
+                f.write(content)
+        factory = RequestFactory()
+        with override_settings(STATIC_ROOT=static_root):
+            response = serve_static(factory.get('/', headers={'accept-encoding': 'gzip, br'}), 'app.0123456789ab.css')
+            self.assertEqual((response['Content-Encoding'], b''.join(response.streaming_content)), ('br', b'brotli'))
+            self.assertEqual(response['Content-Type'], 'text/css')
+            self.assertIn('immutable', response['Cache-Control'])
+            self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+            response = serve_static(factory.get('/', headers={'accept-encoding': 'br;q=0'}), 'app.0123456789ab.css')
+            self.assertNotIn('Content-Encoding', response)
+            self.assertIn('no-cache', serve_static(factory.get('/'), 'plain.css')['Cache-Control'])
+            with self.assertRaises(Http404):
+                serve_static(factory.get('/'), '../secret.txt')
+
+
+class DeleteUploadsTests(TestCase):
+    """Deleting uploads only touches the caller's rows and files nothing else uses."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user('patient', password='x')
+        cls.other = User.objects.create_user('other', password='x')
+        cls.doctor = DoctorProfile.objects.create(user=User.objects.create_user('doctor', password='x'))
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, THUMBNAIL_ROOT=os.path.join(media_root, 'derivatives')))
+        self.shared = default_storage.save('uploads/shared.png', ContentFile(b'scan'))
+
+    def upload(self, user, name=None, content_hash='a' * 64):
+        return ImageUpload.objects.create(user=user, image=name or self.shared, content_hash=content_hash)
+
+    def test_delete_all_removes_only_the_callers_uploads(self):
+        own = [self.upload(self.patient), self.upload(self.patient, 'uploads/mine.png', 'b' * 64)]
+        theirs = self.upload(self.other)
+        RecommendationRequest.objects.create(image=own[0], patient=self.patient, doctor=self.doctor)
+        open_request(self.doctor.pk)
+        self.client.force_login(self.patient)
+
+        self.client.post(reverse('delete_all_images'))
+
+        self.assertFalse(ImageUpload.objects.filter(user=self.patient).exists())
+        self.assertEqual(list(ImageUpload.objects.values_list('pk', flat=True)), [theirs.pk])
+        self.assertFalse(RecommendationRequest.objects.exists())
+        self.doctor.refresh_from_db()
+        self.assertEqual(self.doctor.open_requests, 0)
+
+    def test_shared_file_survives_until_its_last_upload_is_deleted(self):
+        first, second = self.upload(self.patient), self.upload(self.other)
+
+        delete_uploads(ImageUpload.objects.filter(pk=first.pk))
+        self.assertEqual(sweep_deleted_files(), (1, 0))
+        self.assertTrue(default_storage.exists(self.shared))
+
+        delete_uploads(ImageUpload.objects.filter(pk=second.pk))
+        self.assertEqual(sweep_deleted_files(), (1, 1))
+        self.assertFalse(default_storage.exists(self.shared))
+
+
+class ThumbnailTests(TestCase):
+    """Derivatives are served only to those allowed to see the scan and pruned off the request path."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.patient = User.objects.create_user('patient', password='x')
+        cls.other = User.objects.create_user('other', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.thumbnail_root = os.path.join(media_root, 'derivatives')
+        self.enterContext(override_settings(MEDIA_ROOT=media_root, THUMBNAIL_ROOT=self.thumbnail_root))
+        name = default_storage.save('uploads/scan.png', scan_upload(3))
+        self.image = ImageUpload.objects.create(user=self.patient, image=name, content_hash='d' * 64)
+
+    def test_only_the_owner_gets_the_thumbnail(self):
+        url = reverse('thumbnail', args=[self.image.pk, settings.THUMBNAIL_WIDTHS[0]])
+        self.client.force_login(self.other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.client.force_login(self.patient)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+    @override_settings(THUMBNAIL_EVICT_EVERY=1)
+    def test_eviction_runs_off_the_request_thread(self):
+        release, threads = threading.Event(), []
+
+        def slow_evict(max_bytes):
+            threads.append(threading.current_thread())
+            release.wait(5)
+
+        with mock.patch.object(thumbnails, 'evict', side_effect=slow_evict):
+            # Returns while the eviction is still blocked.
+            get_thumbnail(self.image, settings.THUMBNAIL_WIDTHS[0])
+            release.set()
+            for _ in range(50):
+                if threads:
+                    break
+                time.sleep(0.01)
+            threads[0].join(5)
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_evict_drops_least_recently_used_first(self):
+        old = get_thumbnail(self.image, settings.THUMBNAIL_WIDTHS[0])
+        new = get_thumbnail(self.image, settings.THUMBNAIL_WIDTHS[1])
+        os.utime(old, (1, 1))
+        self.assertEqual(thumbnails.evict(os.path.getsize(new))[0], 1)
+        self.assertFalse(os.path.exists(old))
+        self.assertTrue(os.path.exists(new))
+
+
+class PageCacheTests(TestCase):
+    """Patient pages revalidate with 304 and their cached fragments follow changes."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x', first_name='Pat')
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_login(self.user)
+
+    def test_history_revalidates_until_uploads_change(self):
+        url = reverse('history')
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.get(url)
+        etag = response['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ImageUpload.objects.create(user=self.user, image='uploads/new.png')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, reverse('result', args=[image.pk]))
+
+    def test_navbar_and_footer_are_cached_per_user(self):
+        self.assertContains(self.client.get(reverse('history')), 'Hi, Pat')
+        self.assertIsNotNone(cache.get(make_template_fragment_key('footer')))
+
+        User.objects.filter(pk=self.user.pk).update(first_name='Patricia')
+        self.assertContains(self.client.get(reverse('upload_image')), 'Hi, Patricia')
+
+
+@override_settings(INFERENCE_MODEL_VERSION='v2')
+class RepredictCommandTests(TestCase):
+    """``manage.py repredict`` rewrites predictions in chunks and can resume."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.checkpoint = os.path.join(media_root, 'checkpoint.json')
+        self.images = [
+            ImageUpload.objects.create(
+                user=self.user, image=default_storage.save(f'uploads/{i}.png', scan_upload(i)),
+                disease_predict='glioma', prediction_status='done',
+            )
+            for i in range(3)
+        ]
+        broken = default_storage.save('uploads/broken.png', ContentFile(b'not an image'))
+        self.broken = ImageUpload.objects.create(user=self.user, image=broken, disease_predict='glioma')
+        self.enterContext(mock.patch('api.management.commands.repredict.forward_batch', self.forward))
+
+    def forward(self, batch):
+        probabilities = np.zeros((len(batch), 4), dtype=np.float32)
+        probabilities[:, 3] = 1.0
+        return probabilities
+
+    def repredict(self, *args):
+        out, err = io.StringIO(), io.StringIO()
+        call_command('repredict', *args, '--workers=1', '--chunk-size=2', '--batch-size=2',
+                     f'--checkpoint={self.checkpoint}', stdout=out, stderr=err)
+        return out.getvalue(), err.getvalue()
+
+    def test_updates_predictions_and_reports_failures(self):
+        _, err = self.repredict()
+        labels = dict(ImageUpload.objects.values_list('pk', 'disease_predict'))
+        self.assertEqual({labels[image.pk] for image in self.images}, {'pituitary'})
+        self.assertEqual(labels[self.broken.pk], 'glioma')
+        self.assertIn(f'Upload {self.broken.pk}', err)
+        self.assertEqual(Prediction.objects.filter(model_version='v2', status='ok').count(), 3)
+        self.assertEqual(Prediction.objects.filter(model_version='v2', status='error').count(), 1)
+        self.assertFalse(os.path.exists(self.checkpoint))
+
+    def test_dry_run_writes_nothing(self):
+        out, _ = self.repredict('--dry-run')
+        self.assertIn('would change 3', out)
+        self.assertFalse(Prediction.objects.exists())
+        self.assertFalse(ImageUpload.objects.filter(disease_predict='pituitary').exists())
+
+    def test_resume_skips_checkpointed_uploads(self):
+        filters = {'since': None, 'until': None, 'user': [], 'prediction': []}
+        with open(self.checkpoint, 'w') as f:
+            json.dump({'filters': filters, 'last_pk': self.images[1].pk, 'processed': 2}, f)
+        self.repredict('--resume')
+        self.assertEqual(
+            set(Prediction.objects.values_list('image_id', flat=True)), {self.images[2].pk, self.broken.pk},
+        )
+
+
+class AdmissionControllerTests(SimpleTestCase):
+    """At most ``slots`` predictions run; a bounded queue waits and the rest are turned away."""
+
+    def hold_slot(self, controller):
+        release = threading.Event()
+
+        def hold():
+            with controller.slot():
+                release.wait(5)
+
+        thread = threading.Thread(target=hold)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(release.set)
+        while controller.active < 1:
+            time.sleep(0.001)
+        return release
+
+    def test_full_queue_is_rejected_straight_away(self):
+        controller = admission.AdmissionController(1, 0, retry_after=7)
+        self.hold_slot(controller)
+        with self.assertRaises(admission.InferenceBusy) as busy:
+            controller.acquire()
+        self.assertEqual(busy.exception.retry_after, 7)
+        self.assertEqual((controller.rejected, controller.timed_out), (1, 0))
+
+    def test_waiters_time_out(self):
+        controller = admission.AdmissionController(1, 1, timeout=0.05)
+        self.hold_slot(controller)
+        with self.assertRaisesMessage(admission.InferenceBusy, 'within 0.05s'):
+            controller.acquire()
+        self.assertEqual(controller.stats()['timed_out'], 1)
+        self.assertEqual(controller.stats()['queue_depth'], 0)
+
+    def test_waiter_gets_the_released_slot(self):
+        controller = admission.AdmissionController(1, 1, timeout=5)
+        release = self.hold_slot(controller)
+        threading.Timer(0.05, release.set).start()
+        with controller.slot():
+            self.assertEqual(controller.active, 1)
+        stats = controller.stats()
+        self.assertEqual((stats['admitted'], stats['active'], stats['peak_queue_depth']), (2, 0, 1))
+        self.assertGreater(stats['wait_ms_p95'], 0)
+
+    def test_parse_cpu_list(self):
+        self.assertEqual(admission.parse_cpu_list('0-3, 6,'), {0, 1, 2, 3, 6})
+        self.assertEqual(admission.parse_cpu_list(''), set())
+
+    @override_settings(INFERENCE_THREADS=0, INFERENCE_BATCHING=False)
+    def test_forward_passes_split_the_cores(self):
+        controller = admission.AdmissionController(2, 0)
+        with mock.patch.object(admission, 'get_controller', return_value=controller), \
+                mock.patch.object(admission, 'usable_cpus', return_value=8):
+            self.assertEqual(admission.threads_per_forward(), 4)
+            with override_settings(INFERENCE_BATCHING=True):
+                self.assertEqual(admission.threads_per_forward(), 8)
+
+
+@override_settings(PREDICTION_QUEUE=False, THUMBNAIL_ON_UPLOAD=False)
+class BusyUploadTests(TestCase):
+    """An upload turned away by admission control is answered with 503 and Retry-After."""
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.client.force_login(User.objects.create_user('patient', password='x'))
+        prediction_cache.memory.clear()
+
+    def test_busy_upload_is_not_kept(self):
+        with mock.patch('api.views.predict_disease', side_effect=admission.InferenceBusy(retry_after=9)):
+            response = self.client.post(reverse('upload_image'), {'image': scan_upload(1)})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '9')
+        self.assertIn('try again in 9 seconds', str(list(response.context['messages'])[0]))
+        self.assertFalse(ImageUpload.objects.exists())
+        self.assertEqual(os.listdir(os.path.join(settings.MEDIA_ROOT, 'uploads')), [])
+
+
+class AsyncURLConf:
+    """The async views mounted over the regular routes, whatever ASYNC_VIEWS says."""
+    urlpatterns = [
+        path('patient/upload/', async_views.upload_image, name='upload_image'),
+        path('patient/history/', async_views.history, name='history'),
+        path('patient/result/<int:image_id>/', async_views.result, name='result'),
+        path('', include('neuro.urls')),
+    ]
+
+
+@override_settings(
+    ROOT_URLCONF=AsyncURLConf, INFERENCE_MODEL_VERSION='test', INFERENCE_BATCHING=False,
+    INFERENCE_EXECUTOR_WORKERS=4, INFERENCE_MAX_CONCURRENCY=4, THUMBNAIL_ON_UPLOAD=False,
+)
+class AsyncUploadConcurrencyTests(TestCase):
+    """Scoring runs off the event loop, so concurrent uploads overlap under ASGI."""
+
+    INFERENCE_SECONDS = 0.3
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('patient', password='x')
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        self.enterContext(override_settings(MEDIA_ROOT=media_root))
+        self.enterContext(mock.patch.object(inference, 'forward_batch', self.slow_forward))
+        self.enterContext(mock.patch.object(inference, '_executor', None))
+        self.enterContext(mock.patch.object(admission, '_controller', None))
+        # Every upload must be scored, not served from an earlier test's cache.
+        prediction_cache.memory.clear()
+
+    def slow_forward(self, batch):
+        time.sleep(self.INFERENCE_SECONDS)  # stands in for a forward pass that releases the GIL
+        probabilities = np.zeros((len(batch), 4), dtype=np.float32)
+        probabilities[:, 2] = 1.0
+        return probabilities
+
+    def scan(self, seed):
+        ok, encoded = cv2.imencode('.png', synthetic_mri(96, 96, seed=seed))
+        return SimpleUploadedFile(f'scan{seed}.png', encoded.tobytes(), content_type='image/png')
+
+    async def upload(self, seed):
+        response = await self.async_client.post('/patient/upload/', {'image': self.scan(seed)})
+        self.assertEqual(response.status_code, 200)
+        return time.perf_counter()
+
+    async def test_concurrent_uploads_overlap(self):
+        await self.async_client.aforce_login(self.user)
+        await self.upload(0)  # first request pays for lazy setup
+
+        uploads = 4
+        started = time.perf_counter()
+        await asyncio.gather(*(self.upload(seed) for seed in range(1, uploads + 1)))
+        elapsed = time.perf_counter() - started
+
+        # Serialized scoring would take uploads * INFERENCE_SECONDS.
+        self.assertLess(elapsed, uploads * self.INFERENCE_SECONDS * 0.6)
+        self.assertEqual(await ImageUpload.objects.filter(user=self.user, prediction_status='done').acount(), uploads + 1)
+
+    async def test_other_requests_are_served_while_scoring(self):
+        await self.async_client.aforce_login(self.user)
+        await self.upload(0)
+        await self.async_client.get('/patient/history/')
+
+        async def history():
+            await asyncio.sleep(self.INFERENCE_SECONDS / 10)
+            response = await self.async_client.get('/patient/history/')
+            self.assertEqual(response.status_code, 200)
+            return time.perf_counter()
+
+        upload_done, history_done = await asyncio.gather(self.upload(1), history())
+        self.assertLess(history_done, upload_done)
+
+    @override_settings(INFERENCE_MAX_CONCURRENCY=1, INFERENCE_MAX_QUEUE=0, INFERENCE_RETRY_AFTER=7)
+    async def test_uploads_beyond_the_queue_are_turned_away(self):
+        await self.async_client.aforce_login(self.user)
+        responses = await asyncio.gather(*(
+            self.async_client.post('/patient/upload/', {'image': self.scan(seed)}) for seed in range(2)
+        ))
+
+        self.assertEqual(sorted(response.status_code for response in responses), [200, 503])
+        busy = next(response for response in responses if response.status_code == 503)
+        self.assertEqual(busy['Retry-After'], '7')
+        self.assertEqual(await ImageUpload.objects.filter(user=self.user).acount(), 1)
+        # The rejected upload's file is not left behind in storage.
+        stored = [name for _, _, names in os.walk(settings.MEDIA_ROOT) for name in names]
+        self.assertEqual(len(stored), 1)
+        stats = admission.controller_stats()
+        self.assertEqual((stats['admitted'], stats['rejected']), (1, 1))
+
+    @override_settings(INFERENCE_EXECUTOR_WORKERS=0, INFERENCE_MAX_CONCURRENCY=0, INFERENCE_MAX_QUEUE=1)
+    async def test_default_pool_lets_admission_turn_uploads_away(self):
+        await self.async_client.aforce_login(self.user)
+        with mock.patch.object(admission, 'usable_cpus', return_value=2):
+            responses = await asyncio.gather(*(
+                self.async_client.post('/patient/upload/', {'image': self.scan(seed)}) for seed in range(4)
+            ))
+            self.assertEqual(inference.inference_executor()._max_workers, 4)
+
+        self.assertEqual(sorted(response.status_code for response in responses), [200, 200, 200, 503])
+        stats = admission.controller_stats()
+        self.assertEqual((stats['admitted'], stats['rejected'], stats['peak_queue_depth']), (3, 1, 1))
+
+
+class InferenceServerTests(SimpleTestCase):
+    """Workers hand inference to the shared daemon and fall back when it is gone."""
+
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.socket_path = os.path.join(directory, 'inference.sock')
+
+    def start_server(self):
+        # Client and server share this process, so the server must not
+        # unregister the client's segments from the resource tracker.
+        self.enterContext(mock.patch.object(inference_server, 'resource_tracker'))
+        server = InferenceServer(self.socket_path, inference_server._Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        client = InferenceClient(self.socket_path, timeout=5)
+        self.addCleanup(client.close)
+        return client
+
+    def test_missing_server_falls_back_to_in_process_inference(self):
+        client = InferenceClient(self.socket_path, retry_after=60)
+        logits = np.array([[0.0, 0.0, 0.0, 9.0]], dtype=np.float32)
+        with mock.patch.object(inference, 'get_client', return_value=client), \
+                mock.patch.object(inference.registry, 'run', return_value=logits) as run, \
+                self.assertLogs('api.inference_server', 'WARNING'):
+            result = inference.predict_batch([scan_upload(1).read()])[0]
+            inference.forward_batch(np.zeros((1, 3, INPUT_SIZE, INPUT_SIZE), dtype=np.float32))
+        self.assertEqual(result.label, 'pituitary')
+        self.assertEqual(run.call_count, 2)
+        # The second call did not try to connect again.
+        self.assertEqual(client.stats()['unavailable'], 1)
+        self.assertTrue(client.stats()['down'])
+
+    def test_predictions_round_trip(self):
+        client = self.start_server()
+        results = [ok_result('meningioma'), inference.PredictionResult(error='cannot decode image')]
+        for threshold in (1 << 30, 0):  # over the socket, then through shared memory
+            with self.subTest(threshold=threshold), override_settings(INFERENCE_SERVER_SHM_THRESHOLD=threshold), \
+                    mock.patch.object(inference, 'predict_batch', return_value=results) as predict:
+                first, second = client.predict([b'scan one', b'scan two'])
+                self.assertEqual(predict.call_args.args[0], [b'scan one', b'scan two'])
+                self.assertEqual(first.label, 'meningioma')
+                np.testing.assert_array_equal(first.probabilities, results[0].probabilities)
+                self.assertEqual(second.error, 'cannot decode image')
+
+    def test_forward_and_busy(self):
+        client = self.start_server()
+        probabilities = np.full((2, 4), 0.25, dtype=np.float32)
+        with mock.patch.object(inference, 'forward_batch', return_value=probabilities) as forward:
+            batch = np.ones((2, 3, 4, 4), dtype=np.float32)
+            np.testing.assert_array_equal(client.forward(batch), probabilities)
+            np.testing.assert_array_equal(forward.call_args.args[0], batch)
+        with mock.patch.object(inference, 'predict_batch', side_effect=admission.InferenceBusy(retry_after=3)):
+            with self.assertRaises(admission.InferenceBusy) as busy:
+                client.predict([b'a', b'b'])
+        self.assertEqual(busy.exception.retry_after, 3)
+        self.assertEqual(client.stats()['requests'], 2)
+
+
+class SQLiteContentionTests(unittest.TestCase):
+    """Concurrent uploads against an on-disk SQLite database with the tuned settings.
+
+    A plain TestCase: the database is created here, not by the test runner.
+    """
+
+    alias = 'contention'
+    threads = 8
+    uploads_per_thread = 15
+
+    @classmethod
+    def setUpClass(cls):
+        # A real file, unlike the in-memory test database.
+        cls.tmpdir = tempfile.mkdtemp()
+        connections.settings[cls.alias] = connections.configure_settings(
+            {'default': sqlite_config(os.path.join(cls.tmpdir, 'db.sqlite3'), timeout=30)}
+        )['default']
+        super().setUpClass()
+        call_command('migrate', database=cls.alias, verbosity=0)
+        cls.user = User.objects.db_manager(cls.alias).create_user('patient', password='x')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        connections[cls.alias].close()
+        del connections[cls.alias]
+        del connections.settings[cls.alias]
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+
+    def upload(self, worker, errors):
+        try:
+            for i in range(self.uploads_per_thread):
+                # Like the upload view: look for a stored duplicate, then insert.
+                with transaction.atomic(using=self.alias):
+                    digest = f'{worker:04d}{i:04d}'
+                    ImageUpload.objects.using(self.alias).filter(content_hash=digest).exists()
+                    image = ImageUpload.objects.using(self.alias).create(
+                        user_id=self.user.pk, image=f'uploads/{digest}.png', content_hash=digest,
+                        disease_predict='No Tumor', prediction_status='done',
+                    )
+                    RecommendationRequest.objects.using(self.alias).filter(image=image).exists()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            connections[self.alias].close()
+
+    def test_concurrent_uploads_do_not_fail(self):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            self.assertEqual(cursor.fetchone()[0], 'wal')
+
+        errors = []
+        workers = [threading.Thread(target=self.upload, args=(n, errors)) for n in range(self.threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        self.assertEqual(errors, [])
+        self.assertEqual(ImageUpload.objects.using(self.alias).count(), self.threads * self.uploads_per_thread)
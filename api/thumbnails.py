@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+
+from django.conf import settings
+from PIL import Image, features
+
+logger = logging.getLogger(__name__)
+
+_generated = 0
+_generated_lock = threading.Lock()
+_evicting = False
+
+
+def thumbnail_format():
+    """``(PIL format, extension, content type)`` for derivatives."""
+    if features.check('webp'):
+        return 'WEBP', 'webp', 'image/webp'
+    return 'JPEG', 'jpg', 'image/jpeg'
+
+
+def cache_key(image_upload):
+    """Derivatives are keyed by content so duplicate uploads share them."""
+    return image_upload.content_hash or name_key(image_upload.image.name)
+
+
+def name_key(name):
+    """Key for uploads stored before content hashing existed."""
+    return hashlib.sha256(name.encode()).hexdigest()
+
+
+def key_dir(key):
+    # Two levels of 256-way sharding keep directories small at any scale.
+    return os.path.join(settings.THUMBNAIL_ROOT, key[:2], key[2:4])
+
+
+def thumbnail_path(image_upload, width):
+    key = cache_key(image_upload)
+    _, ext, _ = thumbnail_format()
+    return os.path.join(key_dir(key), f"{key}_{width}.{ext}")
+
+
+def render_thumbnail(source_path, target_path, width):
+    fmt, _, _ = thumbnail_format()
+    with Image.open(source_path) as img:
+        # For JPEGs, draft() lets the decoder downscale by up to 8x for free.
+        img.draft('L', (width, width))
+        img = img.convert('L')
+        img.thumbnail((width, width), Image.Resampling.LANCZOS)
+        os.makedirs(os.path.dirname(target_path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(target_path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                img.save(f, fmt, quality=settings.THUMBNAIL_QUALITY)
+            os.replace(tmp_path, target_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def get_thumbnail(image_upload, width):
+    """Path to the ``width`` px derivative, generating it on first request."""
+    path = thumbnail_path(image_upload, width)
+    if os.path.exists(path):
+        # Bump mtime so size-bounded eviction drops least recently used files first.
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    render_thumbnail(image_upload.image.path, path, width)
+    _after_generate()
+    return path
+
+
+def generate_thumbnails(image_upload):
+    """Pre-render every configured width, e.g. right after an upload."""
+    for width in settings.THUMBNAIL_WIDTHS:
+        try:
+            get_thumbnail(image_upload, width)
+        except Exception:
+            logger.exception("Could not generate %spx thumbnail for upload %s", width, image_upload.pk)
+
+
+def delete_thumbnails(key):
+    """Remove every derivative stored under ``key``; returns how many were removed."""
+    directory = key_dir(key)
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return 0
+    removed = 0
+    for name in names:
+        if name.startswith(f"{key}_"):
+            try:
+                os.unlink(os.path.join(directory, name))
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
+
+
+def _after_generate():
+    # Walking the cache takes time proportional to its size, so it runs on a
+    # background thread (one at a time) instead of in the request.
+    global _generated, _evicting
+    if not settings.THUMBNAIL_EVICT_EVERY:
+        return
+    with _generated_lock:
+        _generated += 1
+        due = _generated % settings.THUMBNAIL_EVICT_EVERY == 0 and not _evicting
+        if due:
+            _evicting = True
+    if due:
+        threading.Thread(target=_evict_in_background, name='thumbnail-evict', daemon=True).start()
+
+
+def _evict_in_background():
+    global _evicting
+    try:
+        evict(settings.THUMBNAIL_CACHE_MAX_BYTES)
+    except Exception:
+        logger.exception("Thumbnail cache eviction failed")
+    finally:
+        with _generated_lock:
+            _evicting = False
+
+
+def evict(max_bytes, root=None):
+    """Delete least recently used derivatives until the cache fits in ``max_bytes``.
+
+    Returns ``(files_removed, bytes_removed)``.
+    """
+    root = root or settings.THUMBNAIL_ROOT
+    entries = []
+    total = 0
+    for dirpath, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(dirpath, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+    removed = removed_bytes = 0
+    if total <= max_bytes:
+        return removed, removed_bytes
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.unlink(path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+        removed_bytes += size
+    return removed, removed_bytes
@@ -0,0 +1,102 @@
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadedfile import InMemoryUploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+from django.template.defaultfilters import filesizeformat
+
+# Leading bytes of the formats the model pipeline can decode.
+IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+
+
+def sniff_image_type(header):
+    """Content type implied by the first bytes of a file, or ``None``."""
+    for signature, content_type in IMAGE_SIGNATURES:
+        if header.startswith(signature):
+            return content_type
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    return None
+
+
+class HashingUploadHandler(FileUploadHandler):
+    """Buffers uploaded images in memory while hashing and vetting them.
+
+    The body is read once: every chunk feeds the SHA-256 digest and the
+    buffer, the first chunk's magic bytes must be a supported image format
+    and the size is capped at ``UPLOAD_MAX_BYTES``. The resulting file carries
+    its digest as ``content_hash`` so nothing needs to re-read it; the reason
+    a file was dropped is left in ``request.upload_errors``.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.digest = hashlib.sha256()
+        self.buffer = BytesIO()
+        self.size = 0
+        self.sniffed = False
+        self.request.upload_errors = getattr(self.request, 'upload_errors', {})
+
+    def reject(self, message):
+        self.request.upload_errors[self.field_name] = message
+        raise SkipFile(message)
+
+    def receive_data_chunk(self, raw_data, start):
+        if not self.sniffed:
+            self.sniffed = True
+            self.content_type = sniff_image_type(raw_data[:16])
+            if self.content_type is None:
+                self.reject("Unsupported file type. Please upload a PNG, JPEG, BMP, TIFF or WebP image.")
+        self.size += len(raw_data)
+        if self.size > settings.UPLOAD_MAX_BYTES:
+            self.reject(f"File too large. The limit is {filesizeformat(settings.UPLOAD_MAX_BYTES)}.")
+        self.digest.update(raw_data)
+        self.buffer.write(raw_data)
+        return None
+
+    def file_complete(self, file_size):
+        if not self.sniffed:
+            self.request.upload_errors[self.field_name] = "The uploaded file is empty."
+            return None
+        self.buffer.seek(0)
+        uploaded = InMemoryUploadedFile(
+            file=self.buffer, field_name=self.field_name, name=self.file_name,
+            content_type=self.content_type, size=file_size, charset=self.charset,
+            content_type_extra=self.content_type_extra,
+        )
+        uploaded.content_hash = self.digest.hexdigest()
+        return uploaded
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def storage_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.UPLOAD_STORAGE_THREADS, thread_name_prefix='upload-storage')
+        return _executor
+
+
+def save_file_async(field_file, filename, data):
+    """Write ``data`` to ``field_file``'s storage on a worker thread.
+
+    Returns a future with the stored name; assign it to the field once the
+    write is done so the model row is saved without writing the file again.
+    """
+    name = field_file.field.generate_filename(field_file.instance, filename)
+    return storage_executor().submit(
+        field_file.storage.save, name, ContentFile(data), max_length=field_file.field.max_length,
+    )
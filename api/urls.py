@@ -1,5 +1,9 @@
+from django.conf import settings
 from django.urls import path
-from .views import upload_image, history, result, request_recommendation, delete_image, respond_request, recommendation_history, edit_recommendation, delete_recommendation, delete_all_images
+from .views import upload_image, history, result, request_recommendation, delete_image, respond_request, recommendation_history, edit_recommendation, delete_recommendation, delete_all_images, inference_status, thumbnail, image_file
+
+if settings.ASYNC_VIEWS:
+    from .async_views import upload_image, history, result
 
 urlpatterns = [
     path('upload/', upload_image, name='upload_image'),
@@ -15,4 +19,7 @@ path('recommendation/delete/<int:recommendation_id>/', delete_recommendation, na
 
 
     path('delete_image/<int:image_id>/', delete_image, name='delete_image'),
+    path('image/<int:image_id>/', image_file, name='image_file'),
+    path('thumbnail/<int:image_id>/<int:width>/', thumbnail, name='thumbnail'),
+    path('inference/status/', inference_status, name='inference_status'),
 ]
\ No newline at end of file
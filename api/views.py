@@ -1,43 +1,153 @@
+import os
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from .forms import ImageUploadForm
-from .models import ImageUpload, RecommendationRequest
+from .models import ImageUpload, Prediction, RecommendationRequest
 from accounts.models import DoctorProfile
-from django.core.mail import send_mail
-import os
-from pathlib import Path
+from accounts.outbox import queue_mail
+from django.contrib.admin.views.decorators import staff_member_required
+from django.http import Http404, JsonResponse
+from django.utils.cache import patch_cache_control
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from PIL import UnidentifiedImageError
+from django.conf import settings
+from django.db import transaction
+from django.utils.functional import SimpleLazyObject
+from .admission import InferenceBusy
+from .assignment import assign_doctor, close_requests, mark_reviewed, open_request
+from .cache import find_stored_duplicate, prediction_cache
+from .cleanup import delete_uploads
+from .inference import PredictionResult, inference_stats, model_version, predict_image
+from .jobs import enqueue_prediction
+from .page_cache import conditional_page, fragment_context, touch_uploads
+from .pagination import keyset_paginate
+from .thumbnails import generate_thumbnails, get_thumbnail, thumbnail_format
+from .uploads import HashingUploadHandler, save_file_async
+from neuro.serving import serve_file
 
+@csrf_exempt
 @login_required
 def upload_image(request):
+    # The handler has to be in place before anything (including the CSRF
+    # check) parses the body, hence csrf_exempt here and csrf_protect below.
+    request.upload_handlers = [HashingUploadHandler(request)]
+    return _upload_image(request)
+
+def mark_busy(response, busy):
+    """Turn ``response`` into a 503 asking the client to retry after ``busy.retry_after`` seconds."""
+    if busy is not None:
+        response.status_code = 503
+        response.headers['Retry-After'] = str(busy.retry_after)
+    return response
+
+def busy_message(request, busy):
+    messages.error(request, f"The analyzer is busy right now. Please try again in {busy.retry_after} seconds.")
+
+@csrf_protect
+def _upload_image(request):
     detection_result = None
+    busy = None
     if request.method == 'POST':
         form = ImageUploadForm(request.POST, request.FILES)
-        if form.is_valid():
+        upload_errors = getattr(request, 'upload_errors', {})
+        if upload_errors:
+            for message in upload_errors.values():
+                messages.error(request, message)
+        elif form.is_valid():
             try:
                 image_upload = form.save(commit=False)
                 image_upload.user = request.user
-                image_upload.save()
-                image_path = image_upload.image.path
-                image_upload.disease_predict = predict_disease(image_path)
-                image_upload.save()
-                messages.success(request, 'Image uploaded and prediction completed.')
-                detection_result = image_upload
+                digest = image_upload.content_hash
+                duplicate = find_stored_duplicate(digest)
+                if duplicate:
+                    # Same bytes already stored: point at that file instead of writing a copy.
+                    image_upload.image = duplicate
+                version = model_version()
+                cached = prediction_cache.get(digest, version)
+                if cached is not None:
+                    label, probabilities = cached
+                    save_with_prediction(image_upload, PredictionResult(label=label, probabilities=probabilities), version, cached=True)
+                    messages.success(request, 'Image uploaded and prediction completed.')
+                    detection_result = image_upload
+                elif settings.PREDICTION_QUEUE:
+                    save_and_enqueue(image_upload)
+                    messages.success(request, 'Image uploaded. Your scan is being analyzed.')
+                    return redirect('result', image_id=image_upload.id)
+                else:
+                    # Run inference on the in-memory upload while the file is written to storage.
+                    uploaded = form.cleaned_data['image']
+                    data = uploaded.read()
+                    storing = None if duplicate else save_file_async(image_upload.image, uploaded.name, data)
+                    try:
+                        prediction = predict_disease(data)
+                    except InferenceBusy:
+                        if storing:
+                            # Nothing will reference the copy written meanwhile.
+                            image_upload.image.storage.delete(storing.result())
+                        raise
+                    if storing:
+                        image_upload.image = storing.result()
+                    save_with_prediction(image_upload, prediction, version)
+                    report_prediction(request, prediction)
+                    detection_result = image_upload
+                if settings.THUMBNAIL_ON_UPLOAD and image_upload.pk:
+                    generate_thumbnails(image_upload)
+            except InferenceBusy as e:
+                busy = e
+                busy_message(request, busy)
             except Exception as e:
                 messages.error(request, f"Error: {str(e)}")
     else:
         form = ImageUploadForm()
-    return render(request, 'patient/dashboard.html', {'form': form, 'detection_result': detection_result})
+    response = render(request, 'patient/dashboard.html', {'form': form, 'detection_result': detection_result})
+    return mark_busy(response, busy)
+
+def save_with_prediction(image_upload, result, version, cached=False):
+    """Insert ``image_upload`` with ``result`` applied, and record the Prediction."""
+    with transaction.atomic():
+        image_upload.disease_predict = result.label
+        image_upload.prediction_status = 'done' if result.ok else 'failed'
+        image_upload.save()
+        Prediction.from_result(image_upload, result, version, cached=cached).save()
+    if result.ok and not cached:
+        prediction_cache.set(image_upload.content_hash, version, result.label, result.probabilities)
+
+def save_and_enqueue(image_upload):
+    with transaction.atomic():
+        image_upload.save()
+        enqueue_prediction(image_upload)
+
+def report_prediction(request, prediction):
+    if prediction.ok:
+        messages.success(request, 'Image uploaded and prediction completed.')
+    else:
+        messages.error(request, 'Image uploaded, but the prediction failed. Please try again.')
+
+def _render_history(request):
+    # Lazy, so a cached table fragment costs no query.
+    uploaded_images = SimpleLazyObject(
+        lambda: keyset_paginate(request, ImageUpload.objects.filter(user=request.user), 'uploaded_at')
+    )
+    return render(request, 'patient/history.html', {'uploaded_images': uploaded_images, **fragment_context(request)})
+
+def _render_recommendation_history(request):
+    recommendations = keyset_paginate(request, RecommendationRequest.objects.for_doctor(request.user).for_listing(), 'created_at')
+    return render(request, 'doctor/doctor_recommendation_history.html', {'recommendations': recommendations})
 
 @login_required
+@conditional_page
 def history(request):
-    uploaded_images = ImageUpload.objects.filter(user=request.user).order_by('-uploaded_at')
-    return render(request, 'patient/history.html', {'uploaded_images': uploaded_images})
+    return _render_history(request)
 
 @login_required
+@conditional_page
 def result(request, image_id):
     detection_result = get_object_or_404(ImageUpload, id=image_id, user=request.user)
-    return render(request, 'patient/result.html', {'detection_result': detection_result})
+    prediction = SimpleLazyObject(lambda: detection_result.predictions.order_by('-created_at').first())
+    return render(request, 'patient/result.html', {
+        'detection_result': detection_result, 'prediction': prediction, **fragment_context(request),
+    })
 
 @login_required
 def request_recommendation(request, image_id):
@@ -46,140 +156,132 @@ def request_recommendation(request, image_id):
         messages.info(request, 'Recommendation request already sent.')
     else:
         try:
-            doctor = DoctorProfile.objects.first()
+            doctor = assign_doctor(request.user)
             if doctor:
-                RecommendationRequest.objects.create(
-                    image=image, patient=request.user, doctor=doctor,
-                    message="Please review this image.",
-                    disease_predict=image.disease_predict
-                )
-                send_mail(
-                    subject=f"Recommendation Request from {request.user.username}",
-                    message=f"Patient: {request.user.username}\nPrediction: {image.disease_predict}",
-                    from_email='noreply@neuroai.com',
-                    recipient_list=[doctor.user.email],
-                    fail_silently=True,
-                )
-                image.request_status = 'requested'
-                image.save()
+                with transaction.atomic():
+                    RecommendationRequest.objects.create(
+                        image=image, patient=request.user, doctor=doctor,
+                        message="Please review this image.",
+                        disease_predict=image.disease_predict
+                    )
+                    open_request(doctor.pk)
+                    queue_mail(
+                        subject=f"Recommendation Request from {request.user.username}",
+                        message=f"Patient: {request.user.username}\nPrediction: {image.disease_predict}",
+                        from_email='noreply@neuroai.com',
+                        recipient_list=[doctor.user.email],
+                    )
+                    image.request_status = 'requested'
+                    image.save()
                 messages.success(request, 'Request sent to doctor.')
             else:
                 messages.error(request, 'No doctor available.')
         except DoctorProfile.DoesNotExist:
             messages.error(request, 'Unable to find doctor.')
     
-    uploaded_images = ImageUpload.objects.filter(user=request.user).order_by('-uploaded_at')
-    return render(request, 'patient/history.html', {'uploaded_images': uploaded_images})
+    return _render_history(request)
 
 @login_required
 def respond_request(request, request_id):
-    rec_request = get_object_or_404(RecommendationRequest, id=request_id, doctor__user=request.user)
+    rec_request = get_object_or_404(RecommendationRequest.objects.for_doctor(request.user).only('image_id', 'patient_id', 'doctor_id', 'is_reviewed'), id=request_id)
     if request.method == 'POST':
-        rec_request.image.doctor_comment = request.POST.get('doctor_comment')
-        rec_request.image.request_status = 'reviewed'
-        rec_request.image.save()
-        rec_request.is_reviewed = True
-        rec_request.save()
+        ImageUpload.objects.filter(id=rec_request.image_id).update(
+            doctor_comment=request.POST.get('doctor_comment'), request_status='reviewed'
+        )
+        touch_uploads([rec_request.patient_id])
+        mark_reviewed(rec_request)
         messages.success(request, 'Recommendation sent.')
-        doctor = request.user.doctorprofile
-        recommendations = RecommendationRequest.objects.filter(doctor=doctor).order_by('-created_at')
-        return render(request, 'doctor/doctor_recommendation_history.html', {'recommendations': recommendations})
+        return _render_recommendation_history(request)
     return render(request, 'doctor/respond_request.html', {'request': rec_request})
 
 @login_required
 def edit_recommendation(request, recommendation_id):
-    rec = get_object_or_404(RecommendationRequest, id=recommendation_id, doctor__user=request.user)
+    rec = get_object_or_404(RecommendationRequest.objects.for_doctor(request.user).only('image_id', 'patient_id', 'doctor_id', 'is_reviewed'), id=recommendation_id)
     if request.method == 'POST':
-        rec.image.doctor_comment = request.POST.get('comments', '')
-        rec.image.save()
-        rec.is_reviewed = True
-        rec.save()
+        ImageUpload.objects.filter(id=rec.image_id).update(doctor_comment=request.POST.get('comments', ''))
+        touch_uploads([rec.patient_id])
+        mark_reviewed(rec)
         messages.success(request, 'Recommendation updated.')
-        doctor = request.user.doctorprofile
-        recommendations = RecommendationRequest.objects.filter(doctor=doctor).order_by('-created_at')
-        return render(request, 'doctor/doctor_recommendation_history.html', {'recommendations': recommendations})
+        return _render_recommendation_history(request)
     return render(request, 'doctor/edit_recommendation.html', {'recommendation': rec})
 
 @login_required
 def recommendation_history(request):
-    doctor = request.user.doctorprofile
-    recommendations = RecommendationRequest.objects.filter(doctor=doctor).order_by('-created_at')
-    return render(request, 'doctor/doctor_recommendation_history.html', {'recommendations': recommendations})
+    return _render_recommendation_history(request)
 
 @login_required
 def delete_recommendation(request, recommendation_id):
-    rec = get_object_or_404(RecommendationRequest, id=recommendation_id, doctor__user=request.user)
+    rec = get_object_or_404(RecommendationRequest.objects.for_doctor(request.user).only('patient_id', 'doctor_id', 'is_reviewed'), id=recommendation_id)
     if request.method == 'POST':
-        rec.delete()
+        with transaction.atomic():
+            rec.delete()
+            if not rec.is_reviewed:
+                close_requests(rec.doctor_id)
         messages.success(request, 'Recommendation deleted.')
-    doctor = request.user.doctorprofile
-    recommendations = RecommendationRequest.objects.filter(doctor=doctor).order_by('-created_at')
-    return render(request, 'doctor/doctor_recommendation_history.html', {'recommendations': recommendations})
+    return _render_recommendation_history(request)
 
 @login_required
 def delete_image(request, image_id):
-    image = get_object_or_404(ImageUpload, id=image_id, user=request.user)
+    get_object_or_404(ImageUpload.objects.only('id'), id=image_id, user=request.user)
     if request.method == 'POST':
-        image.delete()
+        delete_uploads(ImageUpload.objects.filter(id=image_id))
         messages.success(request, 'Image deleted.')
-    uploaded_images = ImageUpload.objects.filter(user=request.user).order_by('-uploaded_at')
-    return render(request, 'patient/history.html', {'uploaded_images': uploaded_images})
+    return _render_history(request)
 
 
-def predict_disease(image_path):
-    """Predict brain tumor class from MRI image using DenseNet121."""
-    try:
-        import torch
-        import cv2
-        import albumentations as A
-        from albumentations.pytorch import ToTensorV2
-        
-        CLASS_NAMES = ['glioma', 'meningioma', 'notumor', 'pituitary']
-        device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-        
-        transform = A.Compose([
-            A.Resize(224, 224),
-            A.Normalize(mean=[0.4815, 0.4815, 0.4815], std=[0.2235, 0.2235, 0.2235]),
-            ToTensorV2(),
-        ])
-        
-        model_path = Path(__file__).parent.parent / 'models' / 'brain_resnet50.pt'
-        if not os.path.exists(model_path):
-            raise FileNotFoundError(f"Model not found at {model_path}")
-        
-        model = torch.jit.load(str(model_path), map_location=device)
-        model.eval()
-        
-        img = cv2.imread(image_path)
-        if img is None:
-            raise FileNotFoundError(f"Image not found: {image_path}")
-        
-        if len(img.shape) == 3 and img.shape[2] == 3:
-            gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-            img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-        
-        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
-        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-        gray = clahe.apply(gray)
-        img = cv2.cvtColor(gray, cv2.COLOR_GRAY2BGR)
-        
-        transformed = transform(image=img)
-        tensor = transformed['image'].unsqueeze(0).to(device)
-        
-        with torch.no_grad():
-            output = model(tensor)
-            prob = torch.softmax(output, dim=1)
-            pred_class = torch.argmax(prob, dim=1).item()
-            confidence = prob[0][pred_class].item() * 100
-        
-        return CLASS_NAMES[pred_class]
-    except Exception as e:
-        return f"Error: {str(e)}"
+def predict_disease(source):
+    """Predict brain tumor class from MRI image using DenseNet121.
+
+    ``source`` is a file path or the encoded image bytes.
+
+    Returns an ``api.inference.PredictionResult`` carrying the label, the full
+    softmax vector and per-stage timings, or the error if prediction failed.
+    """
+    return predict_image(source)
 
 @login_required
 def delete_all_images(request):
     if request.method == 'POST':
-        ImageUpload.objects.all().delete()
+        delete_uploads(ImageUpload.objects.filter(user=request.user))
         messages.success(request, 'All images deleted.')
-    uploaded_images = ImageUpload.objects.filter(user=request.user).order_by('-uploaded_at')
-    return render(request, 'patient/history.html', {'uploaded_images': uploaded_images})
+    return _render_history(request)
+
+def _can_view_upload(user, image):
+    # Patients see their own scans, doctors the ones they were asked to review.
+    return (
+        image.user_id == user.id
+        or user.is_staff
+        or RecommendationRequest.objects.filter(image=image, doctor__user=user).exists()
+    )
+
+@login_required
+def image_file(request, image_id):
+    image = get_object_or_404(ImageUpload.objects.only('id', 'user_id', 'image'), id=image_id)
+    if not image.image or not _can_view_upload(request.user, image):
+        raise Http404
+    response = serve_file(request, image.image.path)
+    # An upload's pixels never change, so its URL is immutable.
+    patch_cache_control(response, private=True, max_age=settings.MEDIA_CACHE_SECONDS, immutable=True)
+    return response
+
+@login_required
+def thumbnail(request, image_id, width):
+    if width not in settings.THUMBNAIL_WIDTHS:
+        raise Http404
+    image = get_object_or_404(ImageUpload, id=image_id)
+    if not _can_view_upload(request.user, image):
+        raise Http404
+    try:
+        path = get_thumbnail(image, width)
+    except (FileNotFoundError, UnidentifiedImageError):
+        raise Http404
+    _, _, content_type = thumbnail_format()
+    # get_thumbnail() touches the file for LRU eviction, so the ETag comes
+    # from the content key rather than the mtime.
+    response = serve_file(request, path, content_type, etag=f'"{os.path.basename(path)}"')
+    patch_cache_control(response, private=True, max_age=settings.THUMBNAIL_CACHE_SECONDS, immutable=True)
+    return response
+
+@staff_member_required
+def inference_status(request):
+    return JsonResponse({**inference_stats(), 'prediction_cache': prediction_cache.stats()})
@@ -0,0 +1,164 @@
+"""File responses for collected static files and uploaded media.
+
+``serve_file`` answers conditional requests and single byte ranges itself,
+or hands the transfer to the front-end server (``X-Sendfile`` or nginx's
+``X-Accel-Redirect``) when ``SENDFILE_BACKEND`` is set. Permission checks are
+up to the calling view.
+"""
+import mimetypes
+import os
+import re
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse, StreamingHttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+from django.utils.http import http_date
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+# ManifestStaticFilesStorage inserts a 12 character hash before the extension.
+HASHED_NAME_RE = re.compile(r'\.[0-9a-f]{12}\.[^/.]+$')
+# Precompressed siblings written by neuro.storage, in order of preference.
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+CHUNK_SIZE = 64 * 1024
+
+
+def parse_range(header, size):
+    """``(start, end)`` for a single-range ``Range`` header.
+
+    ``None`` means the header is ignored and the whole file is sent (multiple
+    ranges or bad syntax); ``False`` means the range cannot be satisfied.
+    """
+    match = RANGE_RE.match(header.strip())
+    if not match or match.groups() == ('', ''):
+        return None
+    first, last = match.groups()
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+        if start >= size:
+            return False
+    else:
+        suffix = int(last)
+        if suffix == 0 or size == 0:
+            return False
+        start, end = max(size - suffix, 0), size - 1
+    return start, end
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            chunk = f.read(min(CHUNK_SIZE, length))
+            if not chunk:
+                break
+            length -= len(chunk)
+            yield chunk
+    finally:
+        f.close()
+
+
+def _sendfile_header(path):
+    backend = settings.SENDFILE_BACKEND
+    if backend == 'xsendfile':
+        return 'X-Sendfile', path
+    if backend == 'nginx':
+        relative = os.path.relpath(path, settings.SENDFILE_ROOT)
+        if relative.startswith(os.pardir):
+            return None
+        return 'X-Accel-Redirect', settings.SENDFILE_URL + quote(relative.replace(os.sep, '/'))
+    return None
+
+
+def serve_file(request, path, content_type=None, encoding=None, etag=None):
+    """Response for the file at ``path``.
+
+    The ETag defaults to one derived from the file's mtime and size. Requests
+    whose validators match get a 304 (or 412) without the file being opened.
+    """
+    try:
+        stat = os.stat(path)
+    except (FileNotFoundError, NotADirectoryError):
+        raise Http404
+    etag = etag or f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+    last_modified = int(stat.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        response = _file_response(request, path, stat.st_size, content_type, etag, last_modified)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(last_modified)
+    return response
+
+
+def _file_response(request, path, size, content_type, etag, last_modified):
+    content_type = content_type or mimetypes.guess_type(path)[0] or 'application/octet-stream'
+    handoff = _sendfile_header(path)
+    if handoff:
+        # The front-end server streams the file and handles ranges itself.
+        response = HttpResponse(content_type=content_type)
+        response.headers[handoff[0]] = handoff[1]
+        return response
+
+    byte_range = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and if_range in (None, etag, http_date(last_modified)):
+        byte_range = parse_range(request.headers['Range'], size)
+    if byte_range is False:
+        response = HttpResponse(status=416)
+        response.headers['Content-Range'] = f'bytes */{size}'
+        return response
+    if byte_range:
+        start, end = byte_range
+        response = StreamingHttpResponse(
+            _read_range(open(path, 'rb'), start, end - start + 1), status=206, content_type=content_type,
+        )
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response.headers['Content-Length'] = str(end - start + 1)
+    else:
+        response = FileResponse(open(path, 'rb'), content_type=content_type)
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _accepted_encodings(request):
+    accepted = set()
+    for token in request.headers.get('Accept-Encoding', '').split(','):
+        name, _, params = token.strip().partition(';')
+        if params.replace(' ', '') not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(name.strip().lower())
+    return accepted
+
+
+def serve_static(request, path):
+    """Serve a collected static file, preferring a precompressed variant.
+
+    For deployments without a front-end server (``SERVE_STATIC``). Hashed
+    names never change content, so they are cached for a year.
+    """
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path):
+        raise Http404
+    content_type = mimetypes.guess_type(full_path)[0]
+    accepted = _accepted_encodings(request)
+    chosen, encoding = full_path, None
+    for name, suffix in ENCODINGS:
+        if name in accepted and os.path.isfile(full_path + suffix):
+            chosen, encoding = full_path + suffix, name
+            break
+    response = serve_file(request, chosen, content_type, encoding)
+    patch_vary_headers(response, ['Accept-Encoding'])
+    if HASHED_NAME_RE.search(path):
+        patch_cache_control(response, public=True, max_age=settings.STATIC_CACHE_SECONDS, immutable=True)
+    else:
+        patch_cache_control(response, public=True, no_cache=True)
+    return response
@@ -11,8 +11,11 @@ https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
 from pathlib import Path
-from decouple import config
+from decouple import Csv, config
 import os
+from datetime import timedelta
+
+from .db import database_config
 
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -34,9 +37,9 @@ EMAIL_HOST_PASSWORD = config('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = config('DEFAULT_FROM_EMAIL')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = config('DEBUG', default=True, cast=bool)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = config('ALLOWED_HOSTS', default='', cast=Csv())
 
 
 # Application definition
@@ -48,6 +51,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'rest_framework',
     'api',
     'accounts',
     'user',
@@ -75,6 +79,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'api.page_cache.fragments',
             ],
         },
     },
@@ -86,11 +91,18 @@ WSGI_APPLICATION = 'neuro.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+# SQLite (tuned for concurrent writers, see neuro/db.py) unless DATABASE_URL
+# points at PostgreSQL. Connections are reused for CONN_MAX_AGE seconds and
+# health-checked first; DATABASE_POOL_SIZE enables Django's pool (psycopg 3 only).
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': database_config(
+        config('DATABASE_URL', default=''),
+        sqlite_path=BASE_DIR / 'db.sqlite3',
+        conn_max_age=config('CONN_MAX_AGE', default=60, cast=int),
+        health_checks=config('CONN_HEALTH_CHECKS', default=True, cast=bool),
+        pool_size=config('DATABASE_POOL_SIZE', default=0, cast=int),
+        sqlite_timeout=config('SQLITE_TIMEOUT', default=20, cast=int),
+    ),
 }
 
 
@@ -134,6 +146,29 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'assets')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+STORAGES = {
+    'default': {'BACKEND': 'django.core.files.storage.FileSystemStorage'},
+    # In production collectstatic writes content-hashed names with .gz (and,
+    # if brotli is installed, .br) siblings; see neuro/storage.py.
+    'staticfiles': {
+        'BACKEND': 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+        else 'neuro.storage.CompressedManifestStaticFilesStorage',
+    },
+}
+# Let Django serve STATIC_ROOT itself when nothing sits in front of it.
+# Hashed names are cached by browsers for STATIC_CACHE_SECONDS.
+SERVE_STATIC = config('SERVE_STATIC', default=False, cast=bool)
+STATIC_CACHE_SECONDS = 60 * 60 * 24 * 365
+
+# Uploaded scans are only served through the permission-checked views in
+# api/views.py. SENDFILE_BACKEND hands the transfer to the front-end server:
+# '' streams from Django, 'xsendfile' (Apache/lighttpd) or 'nginx'
+# (X-Accel-Redirect to SENDFILE_URL, an internal location for SENDFILE_ROOT).
+SENDFILE_BACKEND = config('SENDFILE_BACKEND', default='')
+SENDFILE_ROOT = config('SENDFILE_ROOT', default=MEDIA_ROOT)
+SENDFILE_URL = config('SENDFILE_URL', default='/protected-media/')
+MEDIA_CACHE_SECONDS = 60 * 60 * 24 * 365
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 MESSAGE_TAGS = {
@@ -142,3 +177,128 @@ MESSAGE_TAGS = {
     30: 'warning',
     20: 'info',
 }
+
+# Inference
+INFERENCE_MODEL_PATH = config('INFERENCE_MODEL_PATH', default=os.path.join(BASE_DIR, 'models', 'brain_resnet50.pt'))
+INFERENCE_PRELOAD = config('INFERENCE_PRELOAD', default=False, cast=bool)
+INFERENCE_WARMUP_RUNS = config('INFERENCE_WARMUP_RUNS', default=2, cast=int)
+INFERENCE_AUTO_RELOAD = config('INFERENCE_AUTO_RELOAD', default=True, cast=bool)
+INFERENCE_RELOAD_CHECK_SECONDS = config('INFERENCE_RELOAD_CHECK_SECONDS', default=30, cast=float)
+INFERENCE_BATCHING = config('INFERENCE_BATCHING', default=True, cast=bool)
+INFERENCE_MAX_BATCH_SIZE = config('INFERENCE_MAX_BATCH_SIZE', default=16, cast=int)
+INFERENCE_MAX_WAIT_MS = config('INFERENCE_MAX_WAIT_MS', default=5, cast=float)
+
+# Run predictions through the PredictionJob queue (``manage.py prediction_worker``)
+# instead of inline in the upload request.
+PREDICTION_QUEUE = config('PREDICTION_QUEUE', default=False, cast=bool)
+
+# Predictions cached by (upload SHA-256, model version); the in-memory LRU sits
+# in front of the PredictionCache table.
+PREDICTION_CACHE_SIZE = config('PREDICTION_CACHE_SIZE', default=1024, cast=int)
+INFERENCE_MODEL_VERSION = config('INFERENCE_MODEL_VERSION', default='')
+# One of api.optimization.INFERENCE_MODES; non-fp32 modes load the artifact
+# written by ``manage.py optimize_model`` next to INFERENCE_MODEL_PATH.
+INFERENCE_MODE = config('INFERENCE_MODE', default='fp32')
+# 'torchscript' or 'onnx'. The ONNX Runtime backend never imports torch, so web
+# workers using it start faster and use less memory.
+INFERENCE_BACKEND = config('INFERENCE_BACKEND', default='torchscript')
+INFERENCE_ONNX_PATH = config('INFERENCE_ONNX_PATH', default=os.path.join(BASE_DIR, 'models', 'brain_resnet50.onnx'))
+# 0 uses INFERENCE_THREADS (or the per-pass default below).
+INFERENCE_ONNX_THREADS = config('INFERENCE_ONNX_THREADS', default=0, cast=int)
+
+# Thumbnails for the history and doctor pages, stored in a sharded derivative
+# cache that is pruned (least recently used first) to THUMBNAIL_CACHE_MAX_BYTES
+# on a background thread every THUMBNAIL_EVICT_EVERY renders; with 0, only by
+# 'manage.py prune_thumbnails'.
+THUMBNAIL_ROOT = config('THUMBNAIL_ROOT', default=os.path.join(MEDIA_ROOT, 'derivatives'))
+THUMBNAIL_WIDTHS = (120, 240)
+THUMBNAIL_QUALITY = config('THUMBNAIL_QUALITY', default=80, cast=int)
+THUMBNAIL_ON_UPLOAD = config('THUMBNAIL_ON_UPLOAD', default=True, cast=bool)
+THUMBNAIL_CACHE_MAX_BYTES = config('THUMBNAIL_CACHE_MAX_BYTES', default=512 * 1024 * 1024, cast=int)
+THUMBNAIL_EVICT_EVERY = config('THUMBNAIL_EVICT_EVERY', default=100, cast=int)
+THUMBNAIL_CACHE_SECONDS = 60 * 60 * 24 * 365
+
+# Rows per page on the patient history and doctor request lists.
+HISTORY_PAGE_SIZE = config('HISTORY_PAGE_SIZE', default=20, cast=int)
+
+# Uploads deleted per transaction by bulk deletes; their files are removed
+# later by 'manage.py sweep_deleted_files'.
+DELETE_CHUNK_SIZE = config('DELETE_CHUNK_SIZE', default=500, cast=int)
+
+# A patient's own doctor keeps receiving their requests until this many are
+# open; beyond it requests go to the least loaded doctor.
+DOCTOR_MAX_OPEN_REQUESTS = config('DOCTOR_MAX_OPEN_REQUESTS', default=20, cast=int)
+
+# JSON API under /api/: JWT bearer tokens for clinic integrations, session
+# auth so the browsable API works for logged-in users.
+REST_FRAMEWORK = {
+    'DEFAULT_AUTHENTICATION_CLASSES': [
+        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'rest_framework.authentication.SessionAuthentication',
+    ],
+    'DEFAULT_PERMISSION_CLASSES': ['rest_framework.permissions.IsAuthenticated'],
+}
+SIMPLE_JWT = {
+    'ACCESS_TOKEN_LIFETIME': timedelta(minutes=config('JWT_ACCESS_MINUTES', default=30, cast=int)),
+    'REFRESH_TOKEN_LIFETIME': timedelta(days=config('JWT_REFRESH_DAYS', default=1, cast=int)),
+}
+# Images (or ids) accepted per API request; also the forward pass batch size.
+API_MAX_BATCH_SIZE = config('API_MAX_BATCH_SIZE', default=32, cast=int)
+
+# Scan uploads are streamed into memory (hashed and type-checked on the way),
+# so they are capped; storage writes run on a small thread pool.
+UPLOAD_MAX_BYTES = config('UPLOAD_MAX_BYTES', default=20 * 1024 * 1024, cast=int)
+UPLOAD_STORAGE_THREADS = config('UPLOAD_STORAGE_THREADS', default=4, cast=int)
+
+# Serve upload/result/history with the async views (for ASGI deployments);
+# scoring runs on a pool of INFERENCE_EXECUTOR_WORKERS threads, never fewer
+# than the admission slots and queue places below plus one.
+ASYNC_VIEWS = config('ASYNC_VIEWS', default=False, cast=bool)
+INFERENCE_EXECUTOR_WORKERS = config('INFERENCE_EXECUTOR_WORKERS', default=0, cast=int)
+
+# Password reset codes expire after this many seconds; 'manage.py purge_otps'
+# removes the expired rows.
+OTP_TTL_SECONDS = config('OTP_TTL_SECONDS', default=600, cast=int)
+
+# Page and fragment cache (also holds OTP codes). 'locmem' lives in each
+# process; when running several workers use 'file' so the invalidations done
+# on save are seen by all of them.
+CACHE_BACKEND = config('CACHE_BACKEND', default='locmem')
+CACHES = {
+    'default': {
+        'BACKEND': {
+            'locmem': 'django.core.cache.backends.locmem.LocMemCache',
+            'file': 'django.core.cache.backends.filebased.FileBasedCache',
+        }[CACHE_BACKEND],
+        'LOCATION': config('CACHE_LOCATION', default=os.path.join(BASE_DIR, 'cache') if CACHE_BACKEND == 'file' else 'neuro'),
+        'OPTIONS': {'MAX_ENTRIES': config('CACHE_MAX_ENTRIES', default=10000, cast=int)},
+    }
+}
+# Anonymous home/about pages are cached whole; the patient history and result
+# fragments are keyed by a per-user version bumped whenever their uploads change.
+PAGE_CACHE_SECONDS = config('PAGE_CACHE_SECONDS', default=600, cast=int)
+FRAGMENT_CACHE_SECONDS = config('FRAGMENT_CACHE_SECONDS', default=3600, cast=int)
+
+# Unix socket of 'manage.py inference_server'. When set, web workers send scans
+# to that one process instead of each loading the model, and fall back to
+# in-process inference (retrying every INFERENCE_SERVER_RETRY_SECONDS) while it
+# is unreachable. Payloads from INFERENCE_SERVER_SHM_THRESHOLD bytes up travel
+# through shared memory.
+INFERENCE_SERVER_SOCKET = config('INFERENCE_SERVER_SOCKET', default='')
+INFERENCE_SERVER_TIMEOUT = config('INFERENCE_SERVER_TIMEOUT', default=30, cast=float)
+INFERENCE_SERVER_RETRY_SECONDS = config('INFERENCE_SERVER_RETRY_SECONDS', default=5, cast=float)
+INFERENCE_SERVER_SHM_THRESHOLD = config('INFERENCE_SERVER_SHM_THRESHOLD', default=64 * 1024, cast=int)
+
+# Admission control for the process running the model (see api.admission):
+# INFERENCE_MAX_CONCURRENCY predictions at once (0: one per usable core), up to
+# INFERENCE_MAX_QUEUE more waiting at most INFERENCE_QUEUE_TIMEOUT seconds
+# (0: no limit); the rest get a 503 with Retry-After: INFERENCE_RETRY_AFTER.
+# Each forward pass uses INFERENCE_THREADS intra-op threads (0: the usable
+# cores divided between the passes that can run at once). INFERENCE_CPU_AFFINITY
+# (e.g. '0-3') pins the process to those CPUs.
+INFERENCE_MAX_CONCURRENCY = config('INFERENCE_MAX_CONCURRENCY', default=0, cast=int)
+INFERENCE_MAX_QUEUE = config('INFERENCE_MAX_QUEUE', default=32, cast=int)
+INFERENCE_QUEUE_TIMEOUT = config('INFERENCE_QUEUE_TIMEOUT', default=10, cast=float)
+INFERENCE_RETRY_AFTER = config('INFERENCE_RETRY_AFTER', default=5, cast=int)
+INFERENCE_THREADS = config('INFERENCE_THREADS', default=0, cast=int)
+INFERENCE_CPU_AFFINITY = config('INFERENCE_CPU_AFFINITY', default='')
@@ -0,0 +1,51 @@
+import gzip
+import os
+
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSIBLE_EXTENSIONS = ('.css', '.js', '.map', '.svg', '.txt', '.html', '.json', '.xml', '.ico', '.ttf', '.otf', '.eot')
+# Below this size the compressed copy saves less than the request overhead.
+MIN_COMPRESS_SIZE = 256
+
+
+def compress_file(path):
+    """Write ``path.gz`` (and ``path.br`` with brotli installed) next to ``path``.
+
+    A variant is only kept when it is noticeably smaller; stale ones are
+    removed. Returns the paths written.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    variants = [('.gz', lambda raw: gzip.compress(raw, compresslevel=9, mtime=0))]
+    if brotli is not None:
+        variants.append(('.br', lambda raw: brotli.compress(raw)))
+
+    written = []
+    for suffix, compress in variants:
+        target = path + suffix
+        compressed = compress(data) if len(data) >= MIN_COMPRESS_SIZE else None
+        if compressed is not None and len(compressed) < len(data) * 0.95:
+            with open(target, 'wb') as f:
+                f.write(compressed)
+            written.append(target)
+        elif os.path.exists(target):
+            os.unlink(target)
+    return written
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+    """Content-hashed static files with precompressed siblings, built by collectstatic."""
+
+    def post_process(self, paths, dry_run=False, **options):
+        yield from super().post_process(paths, dry_run, **options)
+        if dry_run:
+            return
+        names = set(paths) | set(self.hashed_files.values())
+        for name in sorted(names):
+            if name.endswith(COMPRESSIBLE_EXTENSIONS) and self.exists(name):
+                compress_file(self.path(name))
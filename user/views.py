@@ -4,11 +4,13 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages
 from django.contrib.auth import logout
 from django.contrib.auth import update_session_auth_hash
-from django.core.mail import send_mail
+from django.db import transaction
 from django.shortcuts import render, redirect
 from django.contrib import messages
 from accounts.models import *
+from accounts.outbox import queue_mail
 from api.models import RecommendationRequest
+from api.pagination import keyset_paginate
 from django.shortcuts import render, get_object_or_404, redirect
 import random
 from api.models import ImageUpload
@@ -46,14 +48,14 @@ def update_username(request):
         if new_username and new_username == confirm_username:
             old_username = user.username
             user.username = new_username
-            user.save()
-            send_mail(
-                'Username Changed',
-                f'Your username has been changed from {old_username} to {new_username}.',
-                'nayanai.innovate@gmail.com',
-                [user.email],
-                fail_silently=False,
-            )
+            with transaction.atomic():
+                user.save()
+                queue_mail(
+                    'Username Changed',
+                    f'Your username has been changed from {old_username} to {new_username}.',
+                    'nayanai.innovate@gmail.com',
+                    [user.email],
+                )
             messages.success(request, 'Username updated successfully.')
         else:
             messages.error(request, "Usernames do not match")
@@ -73,15 +75,15 @@ def update_password(request):
             messages.error(request, "Current password is incorrect")
         elif new_password and new_password == confirm_password:
             user.set_password(new_password)
-            user.save()
+            with transaction.atomic():
+                user.save()
+                queue_mail(
+                    'Password Changed',
+                    'Your password has been changed successfully.',
+                    'nayanai.innovate@gmail.com',
+                    [user.email],
+                )
             update_session_auth_hash(request, user)
-            send_mail(
-                'Password Changed',
-                'Your password has been changed successfully.',
-                'nayanai.innovate@gmail.com',
-                [user.email],
-                fail_silently=False,
-            )
             messages.success(request, "Password updated successfully")
         elif new_password and new_password != confirm_password:
             messages.error(request, "New passwords do not match")
@@ -120,14 +122,14 @@ def update_email(request):
             messages.error(request, "Current email is incorrect")
         elif new_email and new_email == confirm_email:
             user.email = new_email
-            user.save()
-            send_mail(
-                'Email Changed',
-                'Your email has been changed successfully.',
-                'nayanai.innovate@gmail.com',
-                [new_email],
-                fail_silently=False,
-            )
+            with transaction.atomic():
+                user.save()
+                queue_mail(
+                    'Email Changed',
+                    'Your email has been changed successfully.',
+                    'nayanai.innovate@gmail.com',
+                    [new_email],
+                )
             messages.success(request, "Email updated successfully")
         elif new_email and new_email != confirm_email:
             messages.error(request, "New emails do not match")
@@ -138,7 +140,9 @@ def update_email(request):
 @login_required
 def doctor_dashboard(request):
     doctor_profile = get_object_or_404(DoctorProfile, user=request.user)
-    notifications = RecommendationRequest.objects.filter(doctor=doctor_profile, is_reviewed=False)
+    notifications = keyset_paginate(
+        request, RecommendationRequest.objects.filter(doctor=doctor_profile, is_reviewed=False).for_listing(), 'created_at'
+    )
 
     context = {
         'doctor': doctor_profile,